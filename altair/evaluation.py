@@ -1,50 +1,109 @@
 import json
+import os
+import shutil
+import tempfile
 import tqdm
 import numpy
-from multiprocessing import Pool, Queue
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import issparse
+from multiprocessing import Pool
+from scipy.sparse import issparse, csr_matrix
 
 from altair.vectorize01.vectorizers.BowAllVectorizer import BowAllVectorizer
 from altair.vectorize01.vectorizers.BowImportVectorizer import BowImportVectorizer
 from altair.vectorize01.vectorizers.Doc2VecVectorizer import Doc2VecVectorizer
 from altair.vectorize01.vectorizers.LDAVectorizer import LDAVectorizer
 from altair.vectorize01.vectorizers.TFIDFVectorizer import TFIDFVectorizer
-from altair.util.separate_code_and_comments import separate_code_and_comments
-
-features = None
-raw = None
-q = Queue()
-
-def q_init(q):
-    score_performance.q = q
-
-def score_performance(t):
-    current_idx, v = t
-    # sklearn throws deprecation warnings for 1d arrays so need to reshape v
-    pair_sims = cosine_similarity(v.reshape(1, -1), features)
+from altair.vectorize01.vectorizers.CachedVectorizer import CachedVectorizer
+from altair.util.preprocess_cache import PreprocessCache, CACHE_FOLDER_ENV
+from altair.util.top_n_similarity import normalize_features, top_n_similar
+
+# Per-process scoring state, filled in by init_scoring_worker from memory-mapped files
+worker_state = {}
+
+def share_array(array, shared_folder, name):
+    '''
+    Writes an array to a .npy file once so every worker can memory-map the same pages
+    '''
+    path = os.path.join(shared_folder, name + ".npy")
+    numpy.save(path, array)
+    return path
+
+def share_features(features, shared_folder):
+    '''
+    Writes a dense feature matrix, or the data/indices/indptr arrays of a CSR matrix and of its transpose (built
+    once here instead of in every worker), to memory-mappable files
+    Output: paths (dict describing the shared files, passed to load_shared_features)
+    '''
+    if issparse(features):
+        features_t = features.T.tocsr()
+        return {"shape": features.shape,
+                "data": share_array(features.data, shared_folder, "features_data"),
+                "indices": share_array(features.indices, shared_folder, "features_indices"),
+                "indptr": share_array(features.indptr, shared_folder, "features_indptr"),
+                "t_data": share_array(features_t.data, shared_folder, "features_t_data"),
+                "t_indices": share_array(features_t.indices, shared_folder, "features_t_indices"),
+                "t_indptr": share_array(features_t.indptr, shared_folder, "features_t_indptr")}
+    return {"dense": share_array(features, shared_folder, "features")}
+
+def load_shared_features(paths):
+    '''
+    Output: (features, transposed features as CSR, or None for dense features whose transpose is a free view)
+    '''
+    if "dense" in paths:
+        return numpy.load(paths["dense"], mmap_mode="r"), None
+    shape = paths["shape"]
+    features = csr_matrix((numpy.load(paths["data"], mmap_mode="r"),
+                           numpy.load(paths["indices"], mmap_mode="r"),
+                           numpy.load(paths["indptr"], mmap_mode="r")), shape=shape)
+    features_t = csr_matrix((numpy.load(paths["t_data"], mmap_mode="r"),
+                             numpy.load(paths["t_indices"], mmap_mode="r"),
+                             numpy.load(paths["t_indptr"], mmap_mode="r")), shape=(shape[1], shape[0]))
+    return features, features_t
+
+def init_scoring_worker(features_paths, labels_path, top_n, block_size):
+    # Only file paths cross the process boundary, so this works with both fork and spawn start methods
+    worker_state["features"], worker_state["features_t"] = load_shared_features(features_paths)
+    worker_state["labels"] = numpy.load(labels_path, mmap_mode="r")
+    worker_state["top_n"] = top_n
+    worker_state["block_size"] = block_size
+
+def score_performance(chunk):
+    '''
+    Scores a contiguous chunk of documents and returns aggregated counts
+    Input: chunk (tuple of start and stop row indices)
+    Output: (documents scored, Top 1 hits, Top N Any hits, Top N All hits)
+    '''
+    start, stop = chunk
+    features = worker_state["features"]
+    labels = worker_state["labels"]
+    top_n = worker_state["top_n"]
+    top_1_score = 0
+    top_n_any_score = 0
+    top_n_all_score = 0
+
+    # Score blocks of documents with one matrix product instead of one cosine_similarity call per row
     # TODO: Set a minimum cosine similarity score for candidates?
-    top_candidates = pair_sims[0].argsort()[-top_n-1:][::-1]
-
-    comp_id = raw[current_idx]["CompetitionId"]
-    candidate_ids = [raw[candidate_idx]["CompetitionId"] for candidate_idx in top_candidates if candidate_idx!=current_idx][:top_n]
-    scoring = [candidate_id == comp_id for candidate_id in candidate_ids]
-
-    top_1_score = int(scoring[0])
-    top_n_any_score = int(any(scoring))
-    top_n_all_score = int(all(scoring))
-    score_performance.q.put((top_1_score, top_n_any_score, top_n_all_score))
-
-def main(data_path, num_cores, top_n_param, vectorizer):
-    global raw
-    global features
-    global q
-
-    # Patch for error thrown by score_performance on declaration of top_n
-    global top_n
-    top_n = top_n_param
-
+    for current_idx, top_candidates in top_n_similar(features, top_n, start, stop, worker_state["block_size"], normalized=True,
+                                                     features_t=worker_state["features_t"]):
+        comp_id = labels[current_idx]
+        candidate_ids = [labels[candidate_idx] for candidate_idx in top_candidates if candidate_idx!=current_idx][:top_n]
+        scoring = [candidate_id == comp_id for candidate_id in candidate_ids]
+
+        top_1_score += int(scoring[0])
+        top_n_any_score += int(any(scoring))
+        top_n_all_score += int(all(scoring))
+    return stop - start, top_1_score, top_n_any_score, top_n_all_score
+
+def split_chunks(num_rows, num_chunks, block_size):
+    '''
+    Splits row indices into contiguous chunks that are a multiple of block_size (except the last one)
+    '''
+    blocks_per_chunk = max(1, -(-num_rows // (num_chunks * block_size)))
+    chunk_size = blocks_per_chunk * block_size
+    return [(start, min(start + chunk_size, num_rows)) for start in range(0, num_rows, chunk_size)]
+
+def main(data_path, num_cores, top_n, vectorizer, block_size=128, shared_folder=None, cache_folder=None):
     raw = read_data(data_path)
+    cache = PreprocessCache(cache_folder)
 
     """
     # Remove items where competition IDs are in:
@@ -65,10 +124,12 @@ def main(data_path, num_cores, top_n_param, vectorizer):
     
     # Strip out comments and add to scripts if it has code; otherwise remove it from raw list  
     scripts = list()
+    script_sources = list()
     for index,script in list(enumerate(raw)):
-        code, _ = separate_code_and_comments(script["ScriptContent"],script["ScriptTitle"])
+        code = cache.code(script["ScriptContent"],script["ScriptTitle"])
         if len(code)>0: 
             scripts.append(code)
+            script_sources.append(script)
         else:
             raw.pop(index)
     #scripts = [script["ScriptContent"] for script in raw]
@@ -76,23 +137,49 @@ def main(data_path, num_cores, top_n_param, vectorizer):
     # Choose vectorizer
     print("Vectorizing documents...")
     #vectorizer.vectorizer.fit(scripts)
-    features = vectorizer.vectorize_multi(scripts)
-    features_dense = features.todense() if issparse(features) else features
-    p = Pool(num_cores, q_init, [q])
-    print("Calculating pairwise similarities + scores...")
-    for _ in tqdm.tqdm(p.imap_unordered(score_performance, list(enumerate(features_dense))), total=len(features_dense)):
-        pass
-
-    score_top_1 = 0
-    score_top_n_any = 0
-    score_top_n_all = 0
-
-    while not q.empty():
-        top_1, top_n_any, top_n_all = q.get()
-
-        score_top_1 += top_1
-        score_top_n_any += top_n_any
-        score_top_n_all += top_n_all
+    if cache.cache_folder and vectorizer.token_kwargs is not None:
+        # Vectorizers that read normalize_text tokens (Doc2Vec) take them from the cache instead of re-tokenizing
+        token_lists = [cache.tokens(script["ScriptContent"], script["ScriptTitle"], **vectorizer.token_kwargs) for script in script_sources]
+        features = vectorizer.vectorize_tokens_multi(token_lists)
+    else:
+        features = vectorizer.vectorize_multi(scripts)
+    # Normalize once so each block of similarities is a single matrix product
+    # Sparse (bag of words, TF-IDF) features stay CSR; densifying them would cost documents x vocabulary memory
+    features = normalize_features(features)
+    # Workers compare integer label codes instead of looking up CompetitionId in the raw dicts
+    _, labels = numpy.unique([r["CompetitionId"] for r in raw], return_inverse=True)
+
+    # Put the features and labels on disk once; workers memory-map them so RSS does not grow per worker
+    shared_folder = tempfile.mkdtemp(prefix="altair_eval_", dir=shared_folder)
+    p = None
+    try:
+        features_paths = share_features(features, shared_folder)
+        labels_path = share_array(labels, shared_folder, "labels")
+        num_rows = features.shape[0]
+        del features
+
+        score_top_1 = 0
+        score_top_n_any = 0
+        score_top_n_all = 0
+
+        chunks = split_chunks(num_rows, num_cores * 4, block_size)
+        p = Pool(num_cores, init_scoring_worker, (features_paths, labels_path, top_n, block_size))
+        print("Calculating pairwise similarities + scores...")
+        progress = tqdm.tqdm(total=num_rows)
+        for scored, top_1, top_n_any, top_n_all in p.imap_unordered(score_performance, chunks):
+            score_top_1 += top_1
+            score_top_n_any += top_n_any
+            score_top_n_all += top_n_all
+            progress.update(scored)
+        progress.close()
+        p.close()
+        p.join()
+    finally:
+        # A failed worker re-raises in imap_unordered; stop the others before removing the files they map
+        if p is not None:
+            p.terminate()
+            p.join()
+        shutil.rmtree(shared_folder, ignore_errors=True)
 
     top_1_accuracy = score_top_1 / float(len(raw))
     top_n_any_accuracy = score_top_n_any / float(len(raw))
@@ -140,6 +227,24 @@ if __name__ == "__main__":
                         type=int,
                         default=3,
                         help="N for calculating Top N (Any) and Top N (All).")
+    parser.add_argument("--block_size",
+                        type=int,
+                        default=128,
+                        help="Number of documents scored per matrix product (memory grows with block_size x documents).")
+    parser.add_argument("--shared_folder",
+                        type=str,
+                        help="Folder for the memory-mapped features shared by workers, ex: /dev/shm (default = system temp folder).")
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared with the build scripts. Caches the code of every script and, for doc2vec, its tokens; the bag of words, TF-IDF and LDA vectorizers still tokenize with CountVectorizer on every run (default = $%s, disabled if unset)." % CACHE_FOLDER_ENV)
+    parser.add_argument("--vector_cache_bytes",
+                        type=int,
+                        default=0,
+                        help="Cache vectors in memory up to this many bytes, keyed by script content and vectorizer settings (default = 0, disabled).")
+    parser.add_argument("--vector_cache_folder",
+                        type=str,
+                        help="Folder for an on-disk vector cache reused by later runs with the same vectorizer settings (default = disabled).")
 
     subparsers = parser.add_subparsers(help="Subparsers per vectorizer type.")
 
@@ -180,6 +285,10 @@ if __name__ == "__main__":
     doc2vec.add_argument("--infer_kwargs",
                          type=str,
                          help="Keyword arguments (see Doc2Vec.infer_vector() docs for full list). Format: key1=val;key2=val2.")
+    doc2vec.add_argument("--num_workers",
+                         type=int,
+                         default=1,
+                         help="Number of processes for parallel vector inference (results do not depend on this with the fork start method or a fixed PYTHONHASHSEED; otherwise inference stays serial).")
     doc2vec.set_defaults(vectorizer_cls = Doc2VecVectorizer)
 
     ###
@@ -210,6 +319,9 @@ if __name__ == "__main__":
     tfidf.add_argument("--transformer_kwargs",
                        type=str,
                        help="Keyword arguments (see TfidfTransformer docs for full list). Format: key1=val;key2=val2.")
+    tfidf.add_argument("--idf_filename",
+                       type=str,
+                       help="Path to IDF weights generated offline by build_tfidf_weights.py (default = [pkl_vocab without extension]_idf.npy).")
     tfidf.set_defaults(vectorizer_cls = TFIDFVectorizer)
 
     args = parser.parse_args()
@@ -218,6 +330,11 @@ if __name__ == "__main__":
     data_path = args.pop("data_path")
     num_cores = args.pop("num_cores")
     top_n = args.pop("top_n")
+    block_size = args.pop("block_size")
+    shared_folder = args.pop("shared_folder")
+    cache_folder = args.pop("cache_folder")
+    vector_cache_bytes = args.pop("vector_cache_bytes")
+    vector_cache_folder = args.pop("vector_cache_folder")
 
     for argname, val in args.items():
         if "kwargs" in argname and val is not None:
@@ -225,5 +342,9 @@ if __name__ == "__main__":
 
     vectorizer_cls = args.pop("vectorizer_cls")
     vectorizer = vectorizer_cls(**args)
+    if vector_cache_bytes > 0 or vector_cache_folder:
+        vectorizer = CachedVectorizer(vectorizer, max_bytes=vector_cache_bytes, cache_folder=vector_cache_folder)
 
-    main(data_path, num_cores, top_n, vectorizer)
+    main(data_path, num_cores, top_n, vectorizer, block_size, shared_folder, cache_folder)
+    if isinstance(vectorizer, CachedVectorizer):
+        print("Vector cache: %s" % vectorizer.stats())
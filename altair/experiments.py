@@ -20,7 +20,7 @@ from sacred.initialize import Scaffold
 ex = Experiment('altair_baseline_metrics')
 
 def run_model():
-    return altair_evaluation(data_path=data_path,num_cores=num_cores,top_n_param=top_n,vectorizer=vectorizer)
+    return altair_evaluation(data_path=data_path,num_cores=num_cores,top_n=top_n,vectorizer=vectorizer)
 
 def main():
     parser = argparse.ArgumentParser(description='Calculate Altair evaluation metrics (Top 1, Top N Any, Top N All) with Sacred.')
@@ -78,6 +78,10 @@ def main():
     doc2vec.add_argument("--infer_kwargs",
                          type=str,
                          help="Keyword arguments (see Doc2Vec.infer_vector() docs for full list). Format: key1=val;key2=val2.")
+    doc2vec.add_argument("--num_workers",
+                         type=int,
+                         default=1,
+                         help="Number of processes for parallel vector inference (results do not depend on this with the fork start method or a fixed PYTHONHASHSEED; otherwise inference stays serial).")
     doc2vec.set_defaults(vectorizer_cls = Doc2VecVectorizer)
 
     ###
@@ -108,6 +112,9 @@ def main():
     tfidf.add_argument("--transformer_kwargs",
                        type=str,
                        help="Keyword arguments (see TfidfTransformer docs for full list). Format: key1=val;key2=val2.")
+    tfidf.add_argument("--idf_filename",
+                       type=str,
+                       help="Path to IDF weights generated offline by build_tfidf_weights.py (default = [pkl_vocab without extension]_idf.npy).")
     tfidf.set_defaults(vectorizer_cls = TFIDFVectorizer)
 
     args = parser.parse_args()
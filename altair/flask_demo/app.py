@@ -4,12 +4,14 @@
 from flask import Flask
 from flask import render_template
 from flask import request
-from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 import json
 import requests
 from altair.util.separate_code_and_comments import separate_code_and_comments
-from altair.util.normalize_text import normalize_text
+from altair.vectorize01.vectorizers.Doc2VecVectorizer import Doc2VecVectorizer
+from altair.vectorize01.vectorizers.CachedVectorizer import CachedVectorizer
+from altair.vectorize01.indexes.ExactVectorIndex import ExactVectorIndex
+from altair.vectorize01.indexes.VectorStore import VectorStore
 import sys
 
 app= Flask(__name__)
@@ -60,19 +62,11 @@ def get_closest_docs(uri):
         user_doc = r.text
         print("URI content length",len(user_doc))
         code, _ = separate_code_and_comments(user_doc,"user doc")
-        normalized_code = normalize_text(code, remove_stop_words=False, only_letters=False, return_list=True)
-        model.random.seed(0)
-        user_vector = model.infer_vector(normalized_code)
+        # Normalizes the code and infers its vector with the model seeded to 0; repeated scripts come from the cache
+        user_vector = vectorizer.vectorize(code)
         print("finding similar...")
         sys.stdout.flush()
-        stored_urls = list()
-        stored_vectors = list()
-        for url in vectors:
-            stored_urls.append(url)
-            stored_vectors.append(vectors[url])
-        pair_sims = cosine_similarity(user_vector.reshape(1, -1), stored_vectors)
-        indices = (-pair_sims[0]).argsort()[:5]
-        return [(stored_urls[index],round(float(pair_sims[0][index]),2)) for index in indices]
+        return [(url,round(similarity,2)) for url,similarity in index.query(user_vector, 5)]
     else:
         print("URL returned status code", r.status_code)
         raise ValueError('URL error')
@@ -95,12 +89,34 @@ if __name__ == "__main__":
 
     parser.add_argument("vector_pickle_filename",
                         type=str,
-                        help="Pickle file containing dictionary of URLs for Python scripts and associated Doc2Vec vectors")
+                        help="Pickle file containing dictionary of URLs for Python scripts and associated Doc2Vec vectors, or a vector store (.npy) built by build_vector_store.py")
+    # Optional args
+    parser.add_argument("--index_pickle_filename",
+                        type=str,
+                        help="Pickle file containing a vector index built offline by build_vector_index.py over the vector store given as vector_pickle_filename (default = exact index built at startup)")
+    parser.add_argument("--vector_cache_bytes",
+                        type=int,
+                        default=64 * 1024 * 1024,
+                        help="Memory for caching the vectors of scripts already queried, in bytes (default = 67108864)")
     args = parser.parse_args()
+    if args.index_pickle_filename and not args.vector_pickle_filename.endswith(".npy"):
+        parser.error("--index_pickle_filename reads its vectors from a vector store: pass the store (.npy) it was built from as vector_pickle_filename")
+    global vectorizer
+    vectorizer = CachedVectorizer(Doc2VecVectorizer(args.model_pickle_filename), max_bytes=args.vector_cache_bytes)
     global model 
-    model = pickle.load(open(args.model_pickle_filename,"rb"))
-    global vectors 
-    vectors = pickle.load(open(args.vector_pickle_filename,"rb"))
+    model = vectorizer.vectorizer.model
+    global index
+    if args.vector_pickle_filename.endswith(".npy"):
+        # Memory-mapped store: opens in milliseconds and its pages are shared between server processes
+        store = VectorStore(args.vector_pickle_filename[:-len(".npy")])
+        if args.index_pickle_filename:
+            index = pickle.load(open(args.index_pickle_filename,"rb")).attach(store)
+        else:
+            index = ExactVectorIndex.from_store(store)
+    else:
+        vectors = pickle.load(open(args.vector_pickle_filename,"rb"))
+        index = ExactVectorIndex().build(list(vectors.keys()), list(vectors.values()))
+    print("Loaded index of {0} vectors".format(len(index)))
     
     app.run(host='0.0.0.0')
 
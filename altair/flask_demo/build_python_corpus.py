@@ -1,8 +1,5 @@
 import pickle
-import json
-import requests
-import time 
-import os
+from altair.util.github_crawler import GitHubCodeCrawler, GITHUB_API_URL
 
 # Quasi-random search terms to get 1) 200k+ files and 2) variety in results from Github API
 search_terms = ['caffe', 'doc2vec', 'tfidf', 'cnn', 'neural', 'theano','defaultdict', 'torch', \
@@ -46,69 +43,33 @@ search_terms = ['caffe', 'doc2vec', 'tfidf', 'cnn', 'neural', 'theano','defaultd
 'request','data','loader','parser','abc','jinja2','commands','werkzeug','validators','translate',\
 'sql','unittest2','text','functional','files','PyQt5','logger','contenttypes']
 
-def check_api_limit(message, code_urls):
-    over_limit = False
-    if 'message' in message and message['message'][:23]=='API rate limit exceeded':
-        print("WARNING: Over API limit. Saving temp pickle, sleeping for 30 minutes...")
-        over_limit = True
-        save_temp_pickle(code_urls)
-        time.sleep(1800)
-    return over_limit
+def read_credentials(oath_userid, oath_token, credentials_file=None):
+    # Github Oath authentication tokens are capped at 5000 API calls per hour, so requests are spread over every token
+    credentials = [(oath_userid, oath_token)]
+    if credentials_file:
+        with open(credentials_file, "r") as f:
+            for line in f:
+                # One "userid:token" pair per line
+                if line.strip():
+                    userid, token = line.strip().split(":", 1)
+                    credentials.append((userid, token))
+    return credentials
 
-def save_temp_pickle(code_urls):
-    temp_folder="temp"
-    if not os.path.exists(temp_folder): os.mkdir(temp_folder)
-    pickle_file_basename = os.path.basename(pickle_file_name) 
-    temp_file_name = os.path.splitext(pickle_file_basename)[0]+"_"+str(int(time.time()))+os.path.splitext(pickle_file_basename)[1]    
-    pickle.dump(code_urls, open(os.path.join(temp_folder,temp_file_name), "wb"))
-    print("Python file inventory written to temp pickle file", os.path.join(temp_folder,temp_file_name)) 
-    print("Total Python files inventoried:",len(code_urls))
-
-def find_python_repos(oath_creds):
-    code_urls = set()
-    # Search code by multiple terms to generate different results
-    for search_term in search_terms:
-        print("Total Python files inventoried:",len(code_urls))
-        # Github API caps number of results at 1000 (10 pages x 100 results per page)
-        for page_num in range(1,11):
-            print("Search term:'{}', Results page:{}".format(search_term,page_num))            
-            URL = "https://api.github.com/search/code?q="+search_term+"+size:>1000+extension:py+language:python&per_page=100&page="+str(page_num)
-            results = json.loads(requests.get(URL,auth=oath_creds).text)
-            # If there are items in returned dict, look up the raw source code download page            
-            if 'items' in results:
-                for result in results['items']:  
-                    try:                    
-                        contents = json.loads(requests.get(result['url'],auth=oath_creds).text) 
-                        # 'Size' can be missing due to API limit or Github error (ex: missing commit message) 
-                        if 'size' not in contents:
-                            over_limit, oath_token_slot = check_api_limit(contents, code_urls)
-                            # If 'size' was missing because of API throttling error then try again, otherwise skip the url
-                            if over_limit:
-                               contents = json.loads(requests.get(result['url'],auth=oath_creds).text)
-                            else:
-                               continue  
-                        code_urls.add(contents['download_url'])
-                    except ValueError as v:
-                        print("ValueError on",result['url'])
-                        continue
-                    except Exception as e:
-                        print("Error on",result['url'])
-                        continue
-
-            # For generic search terms there should always be 'items' in results; Switch user account if over API limit                
-            else:
-                over_limit, oath_token_slot = check_api_limit(results, code_urls)
-                
-            # Reached the last page of search results (possible but unlikely)
-            if 'items' in results and len(results['items'])<100:
-                break
-                
+def find_python_repos(credentials, journal_filename, api_url=GITHUB_API_URL, num_threads=8):
+    crawler = GitHubCodeCrawler(credentials, journal_filename, api_url, num_threads)
+    try:
+        # Search code by multiple terms to generate different results
+        code_urls = crawler.crawl(search_terms)
+    finally:
+        crawler.close()
     return code_urls
     
-def main(oath_userid,oath_token,pickle_file_name):
-    # Github Oath authentication tokens are capped at 5000 API calls per hour
-    oath_creds = (oath_userid,oath_token)
-    code_urls = find_python_repos(oath_creds)
+def main(oath_userid,oath_token,pickle_file_name,credentials_file=None,journal_filename=None,api_url=GITHUB_API_URL,num_threads=8):
+    credentials = read_credentials(oath_userid, oath_token, credentials_file)
+    # Crawl progress is appended to the journal, so an interrupted run resumes where it stopped
+    if not journal_filename:
+        journal_filename = pickle_file_name + ".journal"
+    code_urls = find_python_repos(credentials, journal_filename, api_url, num_threads)
     print("Total Python files inventoried:",len(code_urls))
     pickle.dump(code_urls, open(pickle_file_name, "wb"))    
         						
@@ -125,5 +86,21 @@ if __name__ == '__main__':
     parser.add_argument("url_pickle_filename",
                         type=str,
                         help="Pickle file to store list of Github URLs that refer to Python scripts")
+    # Optional args
+    parser.add_argument("--credentials_file",
+                        type=str,
+                        help="File of additional Github credentials to rotate across, one userid:token per line")
+    parser.add_argument("--journal_filename",
+                        type=str,
+                        help="Journal of the crawl progress used to resume an interrupted run (default = [url_pickle_filename].journal)")
+    parser.add_argument("--api_url",
+                        type=str,
+                        default=GITHUB_API_URL,
+                        help="Base URL of the Github API, ex: a local mock from altair.util.mock_github_api (default = %s)" % GITHUB_API_URL)
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=8,
+                        help="Maximum number of concurrent API requests (default = 8)")
     args = parser.parse_args()
-    main(args.oath_userid,args.oath_token,args.url_pickle_file_name)						
+    main(args.oath_userid,args.oath_token,args.url_pickle_filename,args.credentials_file,args.journal_filename,args.api_url,
+         args.num_threads)						
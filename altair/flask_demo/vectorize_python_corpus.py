@@ -1,49 +1,126 @@
 import pickle
-import requests
-import time
 import os
+import queue
+import threading
+from functools import partial
+from multiprocessing import Pool
 from altair.util.separate_code_and_comments import separate_code_and_comments
 from altair.util.normalize_text import normalize_text
+from altair.util.http_fetch import make_session, fetch_urls
+from altair.util.vector_log import VectorLog
+from altair.vectorize01.vectorizers.Doc2VecVectorizer import worker_state, init_inference_worker, inference_workers
 import sys
 
-def intermediate_save(code_vectors, vector_file):
-    temp_folder="temp"
-    if not os.path.exists(temp_folder): os.mkdir(temp_folder)
-    vector_file_basename = os.path.basename(vector_file) 
-    temp_file_name = os.path.splitext(vector_file_basename)[0]+"_"+str(int(time.time()))+os.path.splitext(vector_file_basename)[1]
-    pickle.dump(code_vectors, open(os.path.join(temp_folder,temp_file_name), "wb"))
-    print("Update - Python file inventory written to temp pickle file", os.path.join(temp_folder,temp_file_name)) 
-    print("Update - Total Python files vectorized:",len(code_vectors))
+def vectorize_script(task):
+    # Runs in a worker process: separate the code from comments, normalize it and infer its Doc2Vec vector
+    url, code = task
+    try:
+        parsed_code, _ = separate_code_and_comments(code,"code")
+        normalized_code = normalize_text(parsed_code, remove_stop_words=False, only_letters=False, return_list=True)
+        if len(normalized_code)>1:
+            model = worker_state["model"]
+            model.random.seed(worker_state["seed"])
+            return url, model.infer_vector(normalized_code), None
+        return url, None, "Parsing resulted in empty list for %s" % url
+    except:
+        return url, None, "Unexpected error: %s" % sys.exc_info()[0]
+
+def vectorize_code(code_vectors, model, model_file, code_urls, checkpoint_log, num_threads=32, num_workers=4, queue_size=256,
+                   retries=3, backoff_factor=0.5, timeout=30, checkpoint_every=1000):
+    '''
+    Fetches the scripts with a pool of threads sharing a connection-pooled session (one GET per URL, retried with
+    backoff) and vectorizes them in a pool of worker processes. Fetched scripts wait in a bounded queue of queue_size
+    scripts, so fetching pauses while the workers are busy instead of holding every script in memory.
+    Args:
+        code_vectors (dict): URLs already vectorized and their vectors, updated in place
+        model (gensim Doc2Vec): pretrained model, shared with forked workers
+        model_file (str): pickle file of the model, loaded by workers that are not forked
+        code_urls (set): URLs of the scripts to vectorize
+        checkpoint_log (VectorLog): log the vectorized scripts are appended to
+        num_threads (int): number of concurrent HTTP requests
+        num_workers (int): number of processes vectorizing scripts; scripts are vectorized serially when the workers
+                           would not give the same vectors as one process (see inference_workers)
+        queue_size (int): maximum number of fetched scripts waiting for or being vectorized
+        retries (int): maximum number of retries per request
+        backoff_factor (float): base of the exponential backoff between retries, in seconds
+        timeout (float): connect and read timeout of each request, in seconds
+        checkpoint_every (int): number of newly vectorized scripts appended to checkpoint_log at a time
+    Returns:
+        code_vectors (dict)
+    '''
+    # Skip URLs vectorized by a previous run
+    remaining_urls = [url for url in code_urls if url not in code_vectors]
+    print("Vectorizing {} remaining Python files".format(len(remaining_urls)))
+
+    # Vectorized scripts come back through callbacks in the pool's result thread; the main thread collects them
+    results = queue.Queue()
+    slots = threading.BoundedSemaphore(queue_size)
+    def vectorized(result):
+        slots.release()
+        results.put(result)
+    def failed(url, error):
+        slots.release()
+        results.put((url, None, "Unexpected error: %s" % error))
 
-def vectorize_code(code_vectors,model,code_urls, vector_file):
-    # code_urls is a set, make it a list to allow skipping some entries
-    code_urls_list = list(code_urls)
-    # start at a point close to where the previous code_vectors file left off
-    starting_point = len(code_vectors)
-    for i in range(starting_point,len(code_urls_list)):
-	    url = code_urls_list[i]
-	    if i>starting_point and i % 5000 == 0: 
-	        intermediate_save(code_vectors, vector_file)
-	    if requests.get(url).status_code==200:
-	        try:
-	            code = requests.get(url).text
-	            parsed_code, _ = separate_code_and_comments(code,"code")
-	            normalized_code = normalize_text(parsed_code, remove_stop_words=False, only_letters=False, return_list=True)
-	            if len(normalized_code)>1:
-	                model.random.seed(0)
-	                vector = model.infer_vector(normalized_code)
-	                code_vectors[url]=vector
-	            else:
-	                print("Parsing resulted in empty list for",url)
-	                continue
-	        except:
-	            print("Unexpected error:", sys.exc_info()[0])
-	            continue
-	    else:
-	       print("Error code {} for url: {}".format(requests.get(url).status_code, url))
+    # Vectorized scripts not yet appended to the checkpoint log; a crash loses at most these
+    batch = []
+    def collect():
+        while True:
+            try:
+                url, vector, error = results.get_nowait()
+            except queue.Empty:
+                return
+            if vector is not None:
+                code_vectors[url] = vector
+                batch.append((url, vector))
+            else:
+                print(error)
+    def checkpoint():
+        checkpoint_log.append(batch)
+        print("Update - Total Python files vectorized:",len(code_vectors))
+        del batch[:]
+
+    # Share the already loaded model with forked workers instead of reloading it in each of them
+    worker_state["model"] = model
+    worker_state["pkl_d2v_model"] = model_file
+    num_workers = inference_workers(num_workers)
+    session = make_session(num_threads, retries, backoff_factor)
+    if num_workers > 1:
+        pool = Pool(num_workers, init_inference_worker, (model_file, {}, {}, 0))
+    else:
+        pool = None
+        init_inference_worker(model_file, {}, {}, 0)
+    try:
+        for fetched in fetch_urls(remaining_urls, session, num_threads, timeout):
+            if fetched.error is not None:
+                print("Error {} for url: {}".format(fetched.error, fetched.url))
+                continue
+            if fetched.status_code != 200:
+                print("Error code {} for url: {}".format(fetched.status_code, fetched.url))
+                continue
+            # Blocks while queue_size scripts are waiting for or being vectorized
+            slots.acquire()
+            if pool is not None:
+                pool.apply_async(vectorize_script, ((fetched.url, fetched.text),), callback=vectorized,
+                                 error_callback=partial(failed, fetched.url))
+            else:
+                vectorized(vectorize_script((fetched.url, fetched.text)))
+            collect()
+            if len(batch) >= checkpoint_every:
+                checkpoint()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        collect()
+        checkpoint()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        session.close()
     return code_vectors
-	
-def main(model_file,url_file,vector_file):
+
+def main(model_file,url_file,vector_file,num_threads=32,num_workers=4,queue_size=256,retries=3,backoff_factor=0.5,timeout=30,
+         checkpoint_filename=None,checkpoint_every=1000):
     
     # Continue from previous vectorization file, if possible 
     try: 
@@ -51,6 +128,11 @@ def main(model_file,url_file,vector_file):
     except:
         code_vectors = dict()
         pass
+    # Add the scripts vectorized by an interrupted run, recovered from the checkpoint log
+    if not checkpoint_filename:
+        checkpoint_filename = vector_file + ".log"
+    checkpoint_log = VectorLog(checkpoint_filename)
+    code_vectors.update(checkpoint_log.read())
     # Load doc2vec trained model for vectorization
     model = pickle.load(open(model_file,"rb"))
     # Load url list of python scripts
@@ -58,13 +140,17 @@ def main(model_file,url_file,vector_file):
     
     print("Loaded model from",model_file)
     print("Loaded python file listing from",url_file)
-    print("Loaded code vectors from",vector_file)
+    print("Loaded code vectors from",vector_file,"and",checkpoint_filename)
     print("Start - Total Python files inventoried:",len(code_urls))
     print("Start - Total Python files vectorized:",len(code_vectors))
-    if len(code_urls)==len(code_vectors):
+    if len(code_urls)==len(code_vectors) and not checkpoint_log.read():
         print("All code has been vectorized; quitting")
+        checkpoint_log.close()
+        os.remove(checkpoint_filename)
         return 0
-    code_vectors = vectorize_code(code_vectors,model,code_urls,vector_file)
+    with checkpoint_log:
+        code_vectors = vectorize_code(code_vectors,model,model_file,code_urls,checkpoint_log,num_threads,num_workers,queue_size,
+                                      retries,backoff_factor,timeout,checkpoint_every)
     # Catch any we missed
     differences = code_urls.symmetric_difference(set([x for x in code_vectors]))
     if differences!=[]:
@@ -73,7 +159,11 @@ def main(model_file,url_file,vector_file):
                 f.write(difference)
     print("Final - Total Python files inventoried:",len(code_urls))
     print("Final - Total Python files vectorized:",len(code_vectors))
-    pickle.dump(code_vectors, open(vector_file, "wb"))    
+    # Replace the output atomically; its vectors then include every record of the checkpoint log
+    with open(vector_file + ".tmp", "wb") as f:
+        pickle.dump(code_vectors, f)
+    os.replace(vector_file + ".tmp", vector_file)
+    os.remove(checkpoint_filename)
         						
 if __name__ == '__main__':
     import argparse
@@ -88,5 +178,38 @@ if __name__ == '__main__':
     parser.add_argument("vector_pickle_filename",
                         type=str,
                         help="Output pickle file containing dictionary of URLs for Python scripts and associated Doc2Vec vectors")
+    # Optional args
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=32,
+                        help="Number of concurrent HTTP requests (default = 32)")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=4,
+                        help="Number of processes vectorizing the fetched scripts; serial without the fork start method or a fixed PYTHONHASHSEED (default = 4)")
+    parser.add_argument("--queue_size",
+                        type=int,
+                        default=256,
+                        help="Maximum number of fetched scripts waiting to be vectorized (default = 256)")
+    parser.add_argument("--retries",
+                        type=int,
+                        default=3,
+                        help="Maximum number of retries of a failed request (default = 3)")
+    parser.add_argument("--backoff_factor",
+                        type=float,
+                        default=0.5,
+                        help="Base of the exponential backoff between retries, in seconds (default = 0.5)")
+    parser.add_argument("--timeout",
+                        type=float,
+                        default=30,
+                        help="Connect and read timeout of each request, in seconds (default = 30)")
+    parser.add_argument("--checkpoint_filename",
+                        type=str,
+                        help="Append-only log of the vectors computed so far, used to resume an interrupted run (default = [vector_pickle_filename].log)")
+    parser.add_argument("--checkpoint_every",
+                        type=int,
+                        default=1000,
+                        help="Number of vectorized scripts appended to the checkpoint log at a time (default = 1000)")
     args = parser.parse_args()	
-    main(args.model_pickle_filename,args.url_pickle_filename,args.vector_pickle_filename)						
+    main(args.model_pickle_filename,args.url_pickle_filename,args.vector_pickle_filename,args.num_threads,args.num_workers,
+         args.queue_size,args.retries,args.backoff_factor,args.timeout,args.checkpoint_filename,args.checkpoint_every)						
@@ -1,25 +1,65 @@
 import pickle
 import hashlib
+import json
+import mmap
 import os
+import locale
+from fnmatch import fnmatch
+from multiprocessing import Pool
 from altair.util.separate_code_and_comments import separate_code_and_comments
 from altair.util.normalize_text import normalize_text
+from altair.util.vector_cache import file_signature
+from altair.vectorize01.vectorizers.Doc2VecVectorizer import worker_state, init_inference_worker
 
-# Compute MD5 hash of file contents
-def file_digest(current_script_fullpath):
-    # Get MD5 hash of file
-    BLOCKSIZE = 65536
-    hasher = hashlib.md5()
-    with open(current_script_fullpath, 'rb') as afile:
-        buf = afile.read(BLOCKSIZE)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = afile.read(BLOCKSIZE)
-    return hasher.hexdigest()
+# Files at least this large are hashed and decoded through a memory map instead of being read into a bytes copy
+MMAP_MIN_SIZE = 1024 * 1024
+
+def matches(relative_path, patterns):
+    # Glob patterns match either the path relative to the scanned folder or the file/folder name
+    name = os.path.basename(relative_path)
+    return any(fnmatch(relative_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+def scan_scripts(script_folder, include=("*.py",), exclude=(), relative_folder=""):
+    '''
+    Walks script_folder recursively with os.scandir, whose entries carry the file type and stat information without
+    extra system calls on most platforms. Excluded folders are not entered; symbolic links to folders are not followed.
+    Args:
+        script_folder (str): folder to scan
+        include (list of str): glob patterns of the files to keep
+        exclude (list of str): glob patterns of the files and folders to skip
+    Returns:
+        Generator of (relative path using "/" separators, full path, size in bytes, modification time in ns)
+    '''
+    for entry in sorted(os.scandir(script_folder), key=lambda entry: entry.name):
+        relative_path = relative_folder + entry.name
+        if matches(relative_path, exclude):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            for script in scan_scripts(entry.path, include, exclude, relative_path + "/"):
+                yield script
+        elif entry.is_file() and matches(relative_path, include):
+            stat = entry.stat()
+            yield relative_path, entry.path, stat.st_size, stat.st_mtime_ns
+
+def read_script(current_script_fullpath):
+    '''
+    Reads a script once for both hashing and tokenization, through a memory map for large files
+    Returns:
+        (MD5 hex digest of the file contents, contents decoded as open(path, "r") would with universal newlines)
+    '''
+    with open(current_script_fullpath, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+            contents = f.read()
+            code = contents.decode(locale.getpreferredencoding(False))
+            digest = hashlib.md5(contents).hexdigest()
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                digest = hashlib.md5(contents).hexdigest()
+                code = str(memoryview(contents), locale.getpreferredencoding(False))
+    return digest, code.replace("\r\n", "\n").replace("\r", "\n")
 
 # Calculate Doc2Vec vector for a single script via pretrained model
-def vectorize_code(current_script_fullpath, model, remove_comments):
-    with open(current_script_fullpath, "r") as input:
-        code = input.read()
+def vectorize_text(code, model, remove_comments, script_name):
     if remove_comments:
         parsed_code, _ = separate_code_and_comments(code, "code")
     else:
@@ -29,37 +69,117 @@ def vectorize_code(current_script_fullpath, model, remove_comments):
         model.random.seed(0)
         return model.infer_vector(normalized_code)
     else:
-        print("Warning - Parsing resulted in empty list for", current_script_fullpath)
+        print("Warning - Parsing resulted in empty list for", script_name)
         return None
 
-def main(model_file, script_folder, vector_output_file,remove_comments):
+def init_folder_worker(model_file, known_script_keys):
+    init_inference_worker(model_file, {}, {}, 0)
+    worker_state["known_script_keys"] = known_script_keys
+
+# Runs in a worker process: read a script once, hash it and vectorize it unless the same contents were vectorized before
+def process_script(task):
+    relative_path, current_script_fullpath, remove_comments = task
+    try:
+        digest, code = read_script(current_script_fullpath)
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        print("Warning - Could not read", current_script_fullpath, e)
+        return relative_path, None, None
+    # Make dictionary key the script name and script hash to avoid key conflict of two files that have the same name
+    script_dict_key = relative_path + "__" + digest
+    if script_dict_key in worker_state["known_script_keys"]:
+        # Modification time changed but not the contents
+        return relative_path, script_dict_key, None
+    return relative_path, script_dict_key, vectorize_text(code, worker_state["model"], remove_comments, current_script_fullpath)
+
+# Settings the vectors of a manifest depend on; vectors computed with other settings are not reused
+def manifest_settings(model_file, remove_comments):
+    return {"model": file_signature(model_file), "remove_comments": remove_comments}
+
+def load_manifest(vector_output_file, settings):
+    '''
+    The previous output holds the script_name__md5 -> vector of every script; the manifest next to it records the
+    settings and, per script, the size, modification time and key seen by the previous run
+    Returns:
+        (previous vectors (dict), relative path -> [size, mtime in ns, key] (dict))
+    '''
+    try:
+        with open(vector_output_file + ".manifest", "r") as f:
+            manifest = json.load(f)
+        if manifest["settings"] != settings:
+            print("Model or settings changed since the previous run; vectorizing every script")
+            return dict(), dict()
+        with open(vector_output_file, "rb") as f:
+            return pickle.load(f), manifest["files"]
+    except (IOError, OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError):
+        return dict(), dict()
 
-    # Build list of Python scripts (*.py) to vectorize from script_folder
-    filtered_script_folder_contents = [file for file in os.listdir(script_folder) if os.path.splitext(file)[1] in ['.py']]
-    print("Identified {0} Python scripts from {1}".format(len(filtered_script_folder_contents),script_folder))
+def main(model_file, script_folder, vector_output_file, remove_comments, num_workers=1, rebuild=False, include=("*.py",), exclude=()):
 
-    # Load doc2vec trained model for vectorization
-    model = pickle.load(open(model_file, "rb"))
-    print("Loaded Doc2Vec pretrained model from", model_file)
+    # Build list of Python scripts to vectorize from script_folder and its sub-folders
+    scripts = list(scan_scripts(script_folder, include, exclude))
+    print("Identified {0} Python scripts from {1}".format(len(scripts),script_folder))
 
+    settings = manifest_settings(model_file, remove_comments)
+    previous_vectors, previous_files = (dict(), dict()) if rebuild else load_manifest(vector_output_file, settings)
+
+    # Scripts with the size and modification time of the previous run keep their key and vector without being read;
+    # scripts that could not be vectorized have no key and are not retried until they change
     vectorized_scripts = dict()
+    files = dict()
+    tasks = []
+    for relative_path, fullpath, size, mtime_ns in scripts:
+        previous = previous_files.get(relative_path)
+        if previous and previous[0] == size and previous[1] == mtime_ns and (previous[2] is None or previous[2] in previous_vectors):
+            if previous[2] is not None:
+                vectorized_scripts[previous[2]] = previous_vectors[previous[2]]
+            files[relative_path] = previous
+        else:
+            tasks.append((relative_path, fullpath, remove_comments))
+    print("{0} Python scripts unchanged, {1} new or modified".format(len(files), len(tasks)))
+    if vectorized_scripts and "PYTHONHASHSEED" not in os.environ:
+        # infer_vector seeds with Python's string hash, so vectors of different runs only match with a fixed hash seed
+        print("Warning - PYTHONHASHSEED is not set; reused vectors may differ slightly from newly computed ones")
+
     errors = 0
     processed = 0
-    # Iterate over Python scripts and obtain vector for code found inside the file
-    for current_script in filtered_script_folder_contents:
-        current_script_fullpath = os.path.join(script_folder, current_script)
-        script_hash = file_digest(current_script_fullpath)
-        # Make dictionary key the script name and script hash to avoid key conflict of two files that have the same name
-        script_dict_key = current_script + "__" + script_hash
-        script_vector = vectorize_code(current_script_fullpath, model,remove_comments)
-        if script_vector is not None:
-            vectorized_scripts[script_dict_key] = script_vector
-            processed+=1
-        else:
-            errors+=1
+    reused = 0
+    if tasks:
+        # Load doc2vec trained model for vectorization
+        model = pickle.load(open(model_file, "rb"))
+        print("Loaded Doc2Vec pretrained model from", model_file)
+        # Forked workers inherit the loaded model; spawned workers load it once in init_inference_worker
+        worker_state["model"] = model
+        worker_state["pkl_d2v_model"] = model_file
+        worker_state["known_script_keys"] = set(previous_vectors)
+        script_stats = dict((relative_path, (size, mtime_ns)) for relative_path, _, size, mtime_ns in scripts)
 
-    print("{0} Python scripts vectorized with {1} parsing errors encountered".format(processed,errors))
+        pool = Pool(num_workers, init_folder_worker, (model_file, worker_state["known_script_keys"])) if num_workers > 1 else None
+        try:
+            results = pool.imap_unordered(process_script, tasks, chunksize=16) if pool else map(process_script, tasks)
+            # Iterate over Python scripts and obtain vector for code found inside the file
+            for relative_path, script_dict_key, script_vector in results:
+                if script_dict_key in previous_vectors:
+                    script_vector = previous_vectors[script_dict_key]
+                    reused+=1
+                elif script_vector is not None:
+                    processed+=1
+                else:
+                    errors+=1
+                    script_dict_key = None
+                if script_dict_key is not None:
+                    vectorized_scripts[script_dict_key] = script_vector
+                size, mtime_ns = script_stats[relative_path]
+                files[relative_path] = [size, mtime_ns, script_dict_key]
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    print("{0} Python scripts vectorized with {1} parsing errors encountered, {2} modified with unchanged contents".format(processed,errors,reused))
+    print("{0} Python scripts removed since the previous run".format(len(set(previous_files) - set(script[0] for script in scripts))))
     pickle.dump(vectorized_scripts, open(vector_output_file, "wb"))
+    with open(vector_output_file + ".manifest", "w") as f:
+        json.dump({"settings": settings, "files": files}, f)
     print("Script vector dictionary pickled in {0}".format(vector_output_file))
 
 if __name__ == '__main__':
@@ -72,7 +192,7 @@ if __name__ == '__main__':
                         help="Input file name for pickle file containing pretrained Altair Doc2Vec model")
     parser.add_argument("script_foldername",
                         type=str,
-                        help="Input file name for folder containing Python scripts")
+                        help="Input file name for folder containing Python scripts, scanned recursively")
     parser.add_argument("vector_pickle_filename",
                         type=str,
                         help="Output pickle file containing dictionary of Python script names and associated Doc2Vec vectors")
@@ -80,5 +200,23 @@ if __name__ == '__main__':
                         type=bool,
                         default=True,
                         help="Remove comments when vectorizing code in script")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes hashing and vectorizing scripts (default = 1)")
+    parser.add_argument("--rebuild",
+                        action="store_true",
+                        help="Vectorize every script instead of reusing the vectors of unchanged scripts from the previous output (default = false)")
+    parser.add_argument("--include",
+                        type=str,
+                        nargs="+",
+                        default=["*.py"],
+                        help="Glob patterns of the files to vectorize, matched against their name or path relative to script_foldername (default = *.py)")
+    parser.add_argument("--exclude",
+                        type=str,
+                        nargs="+",
+                        default=[],
+                        help="Glob patterns of the files and folders to skip, ex: .git build 'tests/*' (default = none)")
     args = parser.parse_args()
-    main(args.model_pickle_filename, args.script_foldername, args.vector_pickle_filename, args.remove_comments)
\ No newline at end of file
+    main(args.model_pickle_filename, args.script_foldername, args.vector_pickle_filename, args.remove_comments, args.num_workers,
+         args.rebuild, args.include, args.exclude)
\ No newline at end of file
@@ -1,38 +1,150 @@
+import io
 import gzip
 import json
 import os
 import time
+import tarfile
+from multiprocessing import Pool
 
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
 
+# Optional faster gzip backends, used when installed (python-isal, then zlib-ng)
+try:
+    from isal import igzip as fast_gzip
+except ImportError:
+    try:
+        from zlib_ng import gzip_ng as fast_gzip
+    except ImportError:
+        fast_gzip = None
+
+PACK_FORMATS = ["none", "jsonl", "tar"]
+
+def open_json_gz(path_to_json_gz, buffer_size):
+    # Decompress with the fastest available backend and read through a large buffer to limit read calls
+    if fast_gzip is not None:
+        return io.BufferedReader(fast_gzip.open(path_to_json_gz, "rb"), buffer_size)
+    return io.BufferedReader(gzip.open(path_to_json_gz, "rb"), buffer_size)
+
 class JSONExtractor:
-    def __init__(self, output_dir, output_extension):
+    '''
+    Extracts the scripts of .json.gz archives (one JSON object with "id" and "content" per line)
+    pack selects the output layout for every archive <name>.json.gz:
+        none:  one <id>.<extension> file per script in the folder <name>
+        jsonl: a single <name>.jsonl shard with one {"id", "content"} line per script (Altair's JSON-lines format)
+        tar:   a single <name>.tar shard with one <id>.<extension> member per script
+    A <name>.done manifest is written once an archive is fully extracted, and archives with a manifest are skipped,
+    so an interrupted run resumes without checking every output file. Manifests go to manifest_dir (default
+    <output_dir>_manifests) so a folder of jsonl shards can be read directly by the build scripts
+    '''
+    def __init__(self, output_dir, output_extension, pack="none", buffer_size=1024 * 1024, manifest_dir=None):
+        if pack not in PACK_FORMATS:
+            raise ValueError("pack must be one of %s" % ", ".join(PACK_FORMATS))
         self.output_dir = output_dir
         self.output_extension = output_extension
+        self.pack = pack
+        self.buffer_size = buffer_size
+        self.manifest_dir = manifest_dir if manifest_dir else os.path.normpath(output_dir) + "_manifests"
+
+    def _manifest_path(self, basename):
+        return os.path.join(self.manifest_dir, "%s.done" % basename)
 
     def extract(self, path_to_json_gz):
+        '''
+        Extracts one archive unless its manifest shows it was already extracted
+        Output: number of scripts extracted (None if the archive was skipped)
+        '''
         basename = os.path.basename(path_to_json_gz).split(".")[0] # remove extension
+        manifest = self._manifest_path(basename)
+        if os.path.exists(manifest):
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+        with open_json_gz(path_to_json_gz, self.buffer_size) as f1:
+            if self.pack == "jsonl":
+                count = self._extract_jsonl(f1, basename)
+            elif self.pack == "tar":
+                count = self._extract_tar(f1, basename)
+            else:
+                count = self._extract_files(f1, basename)
+
+        with open(manifest, "w") as f:
+            json.dump({"archive": os.path.abspath(path_to_json_gz), "scripts": count, "pack": self.pack}, f)
+        return count
+
+    def _scripts(self, f1):
+        for line in f1:
+            j = json.loads(line.decode("utf-8"))
+            yield j["id"], j["content"]
+
+    def _extract_files(self, f1, basename):
+        # An archive without a manifest is extracted again from the start, overwriting any partial output
         folder = os.path.join(self.output_dir, basename)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-
-        with gzip.open(path_to_json_gz, "rb") as f1:
-            for line in f1:
-                j = json.loads(line.decode("utf-8"))
-                target = os.path.join(folder, "%s.%s" % (j["id"], self.output_extension))
-                if not os.path.exists(target):
-                    with open(target, "wb") as f2:
-                        f2.write(j["content"].encode("utf-8"))
-
-    def extract_dir(self, input_dir):
-        for json_gz_file in sorted(os.listdir(input_dir)):
-            fullpath = os.path.join(input_dir, json_gz_file)
-            logger.info("Processing file: %s" % fullpath)
-            start_time = time.time()
-            self.extract(fullpath)
-            logger.info("Elapsed time: %s" % (time.time()-start_time))
+        os.makedirs(folder, exist_ok=True)
+        count = 0
+        for script_id, content in self._scripts(f1):
+            with open(os.path.join(folder, "%s.%s" % (script_id, self.output_extension)), "wb") as f2:
+                f2.write(content.encode("utf-8"))
+            count += 1
+        return count
+
+    def _extract_jsonl(self, f1, basename):
+        target = os.path.join(self.output_dir, "%s.jsonl" % basename)
+        # Write through a large buffer to a temporary name, renamed once complete
+        count = 0
+        with open(target + ".tmp", "w", encoding="utf-8", buffering=self.buffer_size) as f2:
+            for script_id, content in self._scripts(f1):
+                f2.write(json.dumps({"id": script_id, "content": content}))
+                f2.write("\n")
+                count += 1
+        os.replace(target + ".tmp", target)
+        return count
+
+    def _extract_tar(self, f1, basename):
+        target = os.path.join(self.output_dir, "%s.tar" % basename)
+        mtime = int(time.time())
+        count = 0
+        with open(target + ".tmp", "wb", buffering=self.buffer_size) as f2:
+            with tarfile.open(fileobj=f2, mode="w") as tar:
+                for script_id, content in self._scripts(f1):
+                    data = content.encode("utf-8")
+                    info = tarfile.TarInfo("%s.%s" % (script_id, self.output_extension))
+                    info.size = len(data)
+                    info.mtime = mtime
+                    tar.addfile(info, io.BytesIO(data))
+                    count += 1
+        os.replace(target + ".tmp", target)
+        return count
+
+    def _extract_timed(self, fullpath):
+        start_time = time.time()
+        count = self.extract(fullpath)
+        return fullpath, count, time.time() - start_time
+
+    def extract_dir(self, input_dir, num_workers=1):
+        '''
+        Extracts every archive of a directory, in parallel across archives when num_workers > 1
+        '''
+        paths = [os.path.join(input_dir, json_gz_file) for json_gz_file in sorted(os.listdir(input_dir))]
+        if num_workers > 1:
+            pool = Pool(num_workers)
+            results = pool.imap_unordered(self._extract_timed, paths)
+        else:
+            pool = None
+            results = map(self._extract_timed, paths)
+
+        for fullpath, count, elapsed in results:
+            if count is None:
+                logger.info("Skipping already extracted file: %s" % fullpath)
+            else:
+                logger.info("Processed file: %s (%d scripts)" % (fullpath, count))
+                logger.info("Elapsed time: %s" % elapsed)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     import argparse
@@ -54,10 +166,26 @@ if __name__ == "__main__":
                     type=str,
                     default="py",
                     help="Extracted file extension (all must be the same) (default = py)")
+    parser.add_argument("--pack",
+                        type=str,
+                        choices=PACK_FORMATS,
+                        default="none",
+                        help="Write one file per script (none), or one JSON-lines (jsonl) or tar (tar) shard per archive (default = none)")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of archives extracted in parallel with --dir (default = 1)")
+    parser.add_argument("--manifest_dir",
+                        type=str,
+                        help="Directory of the per-archive completion manifests (default = [output_dir]_manifests)")
+    parser.add_argument("--buffer_size",
+                        type=int,
+                        default=1024 * 1024,
+                        help="Read and write buffer size in bytes (default = 1048576)")
 
     args = parser.parse_args()
-    extractor = JSONExtractor(args.output_dir, args.extension)
+    extractor = JSONExtractor(args.output_dir, args.extension, args.pack, args.buffer_size, args.manifest_dir)
     if args.dir:
-        extractor.extract_dir(args.input_target)
+        extractor.extract_dir(args.input_target, args.num_workers)
     else:
         extractor.extract(args.input_target)
@@ -15,31 +15,18 @@ import csv
 import json
 import argparse
 import sys
+from array import array
+from multiprocessing import Pool
 from pyminifier import token_utils, minification, obfuscate
-from collections import namedtuple, defaultdict
+from collections import namedtuple, OrderedDict, deque
 from altair.util.separate_code_and_comments import separate_code_and_comments
-from difflib import SequenceMatcher
+from altair.util.near_duplicates import find_duplicates, find_duplicates_minhash, ratio_to_jaccard
 
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
 
-def main(args):
-
-    # Open input and output files
-    csv_file = open(args.input_file, 'r')
-    json_file = open(args.output_file, 'w')
-
-    # Check if user wants to customize csv field order
-    if not args.field_order_file:
-        field_names = ["ScriptProjectId","ScriptVersionId","AuthorUserId","UserDisplayName","CompetitionId","CompetitionName","ScriptTitle","ScriptContent"]
-    else:
-        with open(args.field_order_file, 'r') as _order_file:
-            field_order_reader = csv.reader(order_file)
-            for row in field_order_reader:
-                field_names = row
-                continue
-
+def raise_csv_field_size_limit():
     # Address csv error regarding fields that exceed default size limit
     # Adapted from Stack Overflow post by user1251007
     maxInt = sys.maxsize
@@ -56,100 +43,227 @@ def main(args):
             maxInt = int(maxInt/10)
             decrement = True
 
-    # Read CSV and Write the JSON to output_file after doing some preprocessing
-    reader = csv.DictReader(csv_file, field_names)
+class OffsetLineReader:
+    '''
+    Iterates over the decoded lines of a csv file opened in binary mode while keeping the byte offset of the next
+    line, so the offset of every csv row (which can span several lines) is known without holding any row in memory
+    '''
+    def __init__(self, binary_file):
+        self.binary_file = binary_file
+        self.offset = binary_file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.binary_file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        # Same newline translation as reading the file in text mode
+        return line.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
 
+def index_competitions(input_file, field_names):
+    '''
+    First pass over the csv file: byte offsets of the rows of every competition
+    Output: competitions (OrderedDict of CompetitionId to list of row offsets, in order of first appearance),
+            number of rows
+    '''
+    competitions = OrderedDict()
     files = 0
-    parsed_competitions = defaultdict(list)
-    logger.info("Processing csv file...")
-
-    for row in reader:
-        files+=1
-        # Remove very short scripts based on command line arguments
-        script_len = len(separate_code_and_comments(row['ScriptContent'],row['ScriptTitle'])[0])
-        if script_len<args.min_script_len:
-            continue
-        # Remove meta kaggle scripts labeled as python that are probably R
-        if row['ScriptContent'].find("<-")!=-1 and row['ScriptContent'].find("library(")!=-1:
-            continue
-        # Remove Kaggle competition name from the script content to allow model testing on competitions
-        if 'CompetitionName' in row and 'ScriptContent' in row:
-            row['ScriptContent'].replace(row['CompetitionName']," ")
-            row['ScriptContent'].replace(row['CompetitionName'].lower(), " ")
+    with open(input_file, 'rb') as csv_file:
+        lines = OffsetLineReader(csv_file)
+        reader = csv.DictReader(lines, field_names)
+        while True:
+            offset = lines.offset
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            files += 1
+            competitions.setdefault(row['CompetitionId'], array('q')).append(offset)
+    return competitions, files
 
-        parsed_competitions[row['CompetitionId']].append(row)
+def read_rows(input_file, offsets, field_names):
+    '''
+    Reads the csv rows starting at the given byte offsets
+    Output: generator of rows (dict of field name to value)
+    '''
+    with open(input_file, 'rb') as csv_file:
+        for offset in offsets:
+            csv_file.seek(offset)
+            yield next(csv.DictReader(OffsetLineReader(csv_file), field_names))
 
-    submissions_deduped = list()
-    logger.info("Removing duplicates...")
+def keep_submission(row, args):
+    # Remove very short scripts based on command line arguments
+    script_len = len(separate_code_and_comments(row['ScriptContent'],row['ScriptTitle'])[0])
+    if script_len<args.min_script_len:
+        return False
+    # Remove meta kaggle scripts labeled as python that are probably R
+    if row['ScriptContent'].find("<-")!=-1 and row['ScriptContent'].find("library(")!=-1:
+        return False
+    # Remove Kaggle competition name from the script content to allow model testing on competitions
+    if 'CompetitionName' in row and 'ScriptContent' in row:
+        row['ScriptContent'].replace(row['CompetitionName']," ")
+        row['ScriptContent'].replace(row['CompetitionName'].lower(), " ")
+    return True
 
-    # Iterate over competitions to remove duplicates and near duplicates
-    for competition in parsed_competitions:
-        counter = 0
-        submissions = parsed_competitions[competition]
+def remove_duplicates(submissions, args):
+    '''
+    Removes duplicates and near duplicates among the submissions of one competition
+    Output: remaining submissions,
+            number of submissions where the exact pair-wise method decides differently (None unless measuring agreement)
+    '''
+    texts = [submission['ScriptContent'].lower() for submission in submissions]
 
+    if args.dedup_method == "minhash":
+        # Candidate pairs from MinHash/LSH, verified with the exact SequenceMatcher ratio
+        removed = find_duplicates_minhash(texts, args.duplicate_threshold, args.jaccard_threshold, args.num_perm)
+    else:
         # Pair-wise SequenceMatcher comparison of ScriptContent
-        for i in range(len(submissions)):
-            for j in range(len(submissions)):
-                if i!=j and SequenceMatcher(None, submissions[i]['ScriptContent'].lower(), \
-                        submissions[j]['ScriptContent'].lower()).ratio() > args.duplicate_threshold:
-                    submissions[i]['ScriptContent'] = ""
-                    counter+=1
-                    break
-        remove_empties = [x for x in submissions if x['ScriptContent']!=""]
-        logger.info("%d duplicates removed from %d submissions in competition %s" % (counter,len(submissions),competition))
-        
-        # Ensure competition has at least ten entries for future comparison
-        if len(remove_empties)>=10:
-            for item in remove_empties:
-                submissions_deduped.append(item)
-        else:
-            logger.warning("Competition %s has too few remaining submissions at threshold %f" % (competition,args.duplicate_threshold))
+        removed = find_duplicates(texts, args.duplicate_threshold)
+
+    disagreements = None
+    if args.measure_agreement and args.dedup_method != "exact":
+        exact_removed = find_duplicates(texts, args.duplicate_threshold)
+        disagreements = sum(1 for flag, exact_flag in zip(removed, exact_removed) if flag != exact_flag)
+
+    return [submission for submission, flag in zip(submissions, removed) if not flag], disagreements
 
+def minify_submission(row, args):
+    '''
+    Minimizes (and optionally obfuscates) the script of a submission in place
+    Output: True on success, False if pyminifier failed to parse the script
+    '''
     # Build a custom namedtuple to integrate into pyminifer argparse command line methods
-    if args.minimize or args.obfuscate:
-        options_tuple = namedtuple("options_tuple", ["tabs", "minimize", "obfuscate", "replacement_length"])
-        options = options_tuple(False, args.minimize, args.obfuscate, 1)
+    options_tuple = namedtuple("options_tuple", ["tabs", "minimize", "obfuscate", "replacement_length"])
+    options = options_tuple(False, args.minimize, args.obfuscate, 1)
 
+    try:
+        tokens = token_utils.listified_tokenizer(row['ScriptContent'])
+        source = minification.minify(tokens,options)
+        tokens = token_utils.listified_tokenizer(source)
 
-    errors = 0
-    written = 0
+        # Obsfuscate python script
+        if args.obfuscate:
+            table = [{}]
+            module = row['ScriptTitle']
+            name_generator = obfuscate.obfuscation_machine(identifier_length=int(options.replacement_length))
+            obfuscate.obfuscate(module, tokens, options, name_generator=name_generator, table=table)
+
+        # Convert back to text
+        result = ''
+        result += token_utils.untokenize(tokens)
+        row['ScriptContent'] = result
+
+    except Exception as e:
+        # logger.info("%s in %s; continuing" % (e.__class__.__name__,row['ScriptTitle']))
+        return False
+    return True
+
+def process_competition(task):
+    '''
+    Second pass for one competition: reads its rows, filters, removes duplicates and minifies the remaining scripts
+    Only the rows of this competition are held in memory
+    Input: task (competition id, row offsets, csv field names, parsed command line arguments)
+    Output: competition id, JSON lines to write, statistics (dict)
+    '''
+    competition, offsets, field_names, args = task
+    raise_csv_field_size_limit()
+
+    submissions = [row for row in read_rows(args.input_file, offsets, field_names) if keep_submission(row, args)]
+    remove_empties, disagreements = remove_duplicates(submissions, args)
+    stats = {"submissions": len(submissions), "duplicates": len(submissions) - len(remove_empties),
+             "disagreements": disagreements, "too_few": False, "errors": 0}
 
-    for row in submissions_deduped:
+    # Ensure competition has at least ten entries for future comparison
+    if len(remove_empties)<10:
+        stats["too_few"] = True
+        return competition, [], stats
 
+    json_lines = []
+    for row in remove_empties:
         # Minimize size of python script if set in args
-        if args.minimize or args.obfuscate:
-            try:
-                tokens = token_utils.listified_tokenizer(row['ScriptContent'])
-                source = minification.minify(tokens,options)
-                tokens = token_utils.listified_tokenizer(source)
-
-                # Obsfuscate python script
-                if args.obfuscate:
-                    table = [{}]
-                    module = row['ScriptTitle']
-                    name_generator = obfuscate.obfuscation_machine(identifier_length=int(options.replacement_length))
-                    obfuscate.obfuscate(module, tokens, options, name_generator=name_generator, table=table)
-
-                # Convert back to text
-                result = ''
-                result += token_utils.untokenize(tokens)
-                row['ScriptContent'] = result
-
-            except Exception as e:
-                # logger.info("%s in %s; continuing" % (e.__class__.__name__,row['ScriptTitle']))
-                errors+=1
+        if (args.minimize or args.obfuscate) and not minify_submission(row, args):
+            stats["errors"] += 1
+            continue
+        json_lines.append(json.dumps(row))
+    return competition, json_lines, stats
+
+def bounded_imap(pool, function, tasks, max_in_flight):
+    '''
+    Ordered imap that submits a task only when fewer than max_in_flight results are pending or unconsumed
+    (pool.imap submits every task up front and buffers all results finished ahead of a slow one)
+    '''
+    in_flight = deque()
+    for task in tasks:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().get()
+        in_flight.append(pool.apply_async(function, (task,)))
+    while in_flight:
+        yield in_flight.popleft().get()
+
+def main(args):
+
+    # Check if user wants to customize csv field order
+    if not args.field_order_file:
+        field_names = ["ScriptProjectId","ScriptVersionId","AuthorUserId","UserDisplayName","CompetitionId","CompetitionName","ScriptTitle","ScriptContent"]
+    else:
+        with open(args.field_order_file, 'r') as order_file:
+            field_order_reader = csv.reader(order_file)
+            for row in field_order_reader:
+                field_names = row
                 continue
 
-        written+=1
-        json.dump(row, json_file)
-        json_file.write('\n')
+    raise_csv_field_size_limit()
+
+    # First pass: index the rows of every competition by byte offset
+    logger.info("Indexing csv file...")
+    competitions, files = index_competitions(args.input_file, field_names)
+    logger.info("Found %d rows in %d competitions" % (files, len(competitions)))
+
+    logger.info("Removing duplicates...")
+    if args.dedup_method == "minhash":
+        logger.info("Using MinHash/LSH candidates at Jaccard threshold %f" % \
+                    (args.jaccard_threshold if args.jaccard_threshold is not None else ratio_to_jaccard(args.duplicate_threshold)))
+
+    # Second pass: process one competition per task and write its JSON lines in order of first appearance in the
+    # csv file. At most 2 * num_workers competitions are submitted and not yet written, so a slow competition holds
+    # back the submission of new ones instead of letting finished results pile up in memory behind it
+    tasks = ((competition, competitions[competition], field_names, args) for competition in competitions)
+    pool = Pool(args.num_workers) if args.num_workers > 1 else None
+    results = bounded_imap(pool, process_competition, tasks, 2 * args.num_workers) if pool else map(process_competition, tasks)
+
+    errors = 0
+    written = 0
+    decisions = 0
+    disagreements = 0
+    with open(args.output_file, 'w') as json_file:
+        for competition, json_lines, stats in results:
+            logger.info("%d duplicates removed from %d submissions in competition %s" % (stats["duplicates"],stats["submissions"],competition))
+            if stats["disagreements"] is not None:
+                decisions += stats["submissions"]
+                disagreements += stats["disagreements"]
+            if stats["too_few"]:
+                logger.warning("Competition %s has too few remaining submissions at threshold %f" % (competition,args.duplicate_threshold))
+
+            errors += stats["errors"]
+            for json_line in json_lines:
+                json_file.write(json_line)
+                json_file.write('\n')
+            written += len(json_lines)
+
+    if pool:
+        pool.close()
+        pool.join()
+    if args.measure_agreement and args.dedup_method != "exact":
+        logger.info("Dedup decisions that differ from the exact pair-wise method: %d of %d (%.3f%%)" % \
+                    (disagreements, decisions, 100.0 * disagreements / max(decisions, 1)))
 
     logger.info("Total files reviewed: %d" % files)
     if args.minimize or args.obfuscate:
         logger.info("File that failed pyminifier minimization/obfuscation parsing: %d" % errors)
     logger.info("Files successfully parsed to json: %d" % written)
-    csv_file.close()
-    json_file.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert Meta Kaggle csv file to json format')
@@ -175,6 +289,27 @@ if __name__ == "__main__":
                         type=float,
                         default=0.5,
                         help="Set the ratio threshold used to remove duplicates and near duplicates in a competition (default=0.5)")
+    parser.add_argument("--dedup_method",
+                        type=str,
+                        choices=["exact", "minhash"],
+                        default="exact",
+                        help="Compare every pair of submissions in a competition (exact) or only the candidate pairs found with \
+                        MinHash/LSH (minhash), which is much faster on large competitions (default = exact)")
+    parser.add_argument("--jaccard_threshold",
+                        type=float,
+                        help="Shingle Jaccard similarity targeted by the MinHash/LSH candidates; lower values find more \
+                        candidates (default = duplicate_threshold / (2 - duplicate_threshold))")
+    parser.add_argument("--num_perm",
+                        type=int,
+                        default=128,
+                        help="Number of MinHash permutations (default = 128)")
+    parser.add_argument("--measure_agreement",
+                        action="store_true",
+                        help="Also run the exact pair-wise method and report how many dedup decisions differ (default = false)")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes filtering, deduplicating and minifying competitions in parallel (default = 1)")
     parser.add_argument("--minimize",
                         action="store_true",
                         help="Specify whether to minimize script contents (default = false)")
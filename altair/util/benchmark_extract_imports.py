@@ -0,0 +1,84 @@
+'''
+Parity test and benchmark of extract_imports against the RedBaron import extraction it replaced
+(parse_import_statements and parse_fromimport_statements) over a corpus of real scripts. Scripts RedBaron parses
+must give identical libraries; scripts RedBaron fails on are reported separately since extract_imports still
+finds their imports. Reports throughput in scripts per second for both implementations.
+The corpus can be a folder of .py files or a folder of Altair JSON-lines files (script code in 'content')
+Requires redbaron for the reference implementation.
+'''
+
+import time
+
+from redbaron import RedBaron
+
+from altair.util.extract_imports import extract_imports
+from altair.util.benchmark_separate_code_and_comments import read_scripts
+from altair.vectorize01.build.build_imported_libraries_vocabulary import parse_import_statements, parse_fromimport_statements
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def redbaron_imports(script):
+    # Reference implementation; None when RedBaron cannot parse the script
+    try:
+        red = RedBaron(script)
+        libraries = parse_import_statements(red.find_all("ImportNode"))
+        libraries |= parse_fromimport_statements(red.find_all("FromImportNode"))
+        return libraries
+    except Exception as e:
+        return None
+
+def time_extractor(extractor, scripts):
+    start_time = time.time()
+    results = [extractor(script) for script in scripts]
+    return time.time() - start_time, results
+
+def main(corpus_folder, max_script_count, json_lines, show_mismatches):
+    scripts = read_scripts(corpus_folder, max_script_count, json_lines)
+    logger.info("Extracting imports from %d scripts" % len(scripts))
+
+    redbaron_time, redbaron_results = time_extractor(redbaron_imports, scripts)
+    ast_time, ast_results = time_extractor(extract_imports, scripts)
+
+    parsed = 0
+    mismatches = 0
+    for script_index, (reference, libraries) in enumerate(zip(redbaron_results, ast_results)):
+        if reference is None:
+            continue
+        parsed += 1
+        if reference != libraries:
+            mismatches += 1
+            if show_mismatches:
+                logger.info("Script %d: RedBaron %s, extract_imports %s" % (script_index, sorted(reference), sorted(libraries)))
+
+    logger.info("RedBaron:        %.2f s (%.1f scripts/s), failed on %d scripts" % \
+                (redbaron_time, len(scripts) / redbaron_time, len(scripts) - parsed))
+    logger.info("extract_imports: %.2f s (%.1f scripts/s), %.1fx faster" % \
+                (ast_time, len(scripts) / ast_time, redbaron_time / ast_time))
+    logger.info("Scripts parsed by RedBaron with different libraries: %d of %d" % (mismatches, parsed))
+    return mismatches
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Check extract_imports against the RedBaron import extraction and benchmark both')
+
+    # Required args
+    parser.add_argument("corpus_folder",
+                        type=str,
+                        help="Folder (searched recursively) of .py files, or of Altair JSON-lines script files with --json_lines")
+
+    # Optional args
+    parser.add_argument("--max_script_count",
+                        type=int,
+                        default=1000,
+                        help="Specify maximum number of code scripts to check (default = 1000)")
+    parser.add_argument("--json_lines",
+                        action="store_true",
+                        help="Read every file in corpus_folder as JSON lines with the script in 'content' (default = false)")
+    parser.add_argument("--show_mismatches",
+                        action="store_true",
+                        help="Log the libraries of every script where the implementations differ (default = false)")
+
+    args = parser.parse_args()
+    mismatches = main(args.corpus_folder, args.max_script_count, args.json_lines, args.show_mismatches)
+    exit(1 if mismatches else 0)
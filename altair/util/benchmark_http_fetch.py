@@ -0,0 +1,109 @@
+'''
+Benchmark of fetch_urls against a local stand-in HTTP server that answers every request after a fixed latency,
+as a remote host with that round-trip time would. Reports throughput in URLs per second for each number of fetch
+threads; with a pooled session it should grow with the number of threads rather than stay at 1 / latency.
+The server fails the first request of every failure_every-th URL with a 503 to exercise the retries, and every
+fetched text is checked against the content served.
+'''
+
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from altair.util.http_fetch import make_session, fetch_urls
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def script_content(path):
+    return "import os\nprint(%r)\n" % path
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency, failure_every, port=0):
+        HTTPServer.__init__(self, ("127.0.0.1", port), StandInHandler)
+        self.latency = latency
+        self.failure_every = failure_every
+        self.failed_paths = set()
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        script_number = int(self.path.strip("/").split(".")[0])
+        with server.lock:
+            server.request_count += 1
+            fail = server.failure_every and script_number % server.failure_every == 0 and self.path not in server.failed_paths
+            if fail:
+                server.failed_paths.add(self.path)
+        if fail:
+            body = b"unavailable"
+            self.send_response(503)
+        else:
+            body = script_content(self.path).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def main(url_count, latency, thread_counts, failure_every):
+    server = StandInServer(latency, failure_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%d" % server.server_address[1]
+    logger.info("Stand-in server at %s with %.0f ms latency" % (base_url, latency * 1000))
+
+    errors = 0
+    for num_threads in thread_counts:
+        server.failed_paths = set()
+        server.request_count = 0
+        urls = ["%s/%d.py" % (base_url, script_number) for script_number in range(url_count)]
+        session = make_session(num_threads, retries=3, backoff_factor=0.01)
+        start_time = time.time()
+        fetched = list(fetch_urls(urls, session, num_threads))
+        elapsed = time.time() - start_time
+        session.close()
+
+        bad = [result for result in fetched if result.status_code != 200 or result.text != script_content(result.url[len(base_url):])]
+        errors += len(bad) + abs(len(fetched) - len(urls))
+        logger.info("%3d threads: %d URLs in %.2f s (%.1f URLs/s), %d requests, %d bad results" % \
+                    (num_threads, len(fetched), elapsed, len(fetched) / elapsed, server.request_count, len(bad)))
+    server.shutdown()
+    return errors
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark concurrent URL fetching against a local stand-in HTTP server.')
+
+    # Optional args
+    parser.add_argument("--url_count",
+                        type=int,
+                        default=500,
+                        help="Number of URLs fetched per run (default = 500)")
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.05,
+                        help="Seconds the server waits before answering each request (default = 0.05)")
+    parser.add_argument("--thread_counts",
+                        type=int,
+                        nargs="+",
+                        default=[1, 4, 16, 64],
+                        help="Numbers of fetch threads to benchmark (default = 1 4 16 64)")
+    parser.add_argument("--failure_every",
+                        type=int,
+                        default=10,
+                        help="Fail the first request of every n-th URL with a 503, 0 disables failures (default = 10)")
+
+    args = parser.parse_args()
+    main(args.url_count, args.latency, args.thread_counts, args.failure_every)
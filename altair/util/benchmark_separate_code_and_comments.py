@@ -0,0 +1,128 @@
+'''
+Benchmarks separate_code_and_comments against the previous implementation (materialized token list and
+string concatenation) over a corpus of real scripts, checks that both produce identical output and reports
+throughput in MB of script content per second
+The corpus can be a folder of .py files or a folder of Altair JSON-lines files (script code in 'content', as read
+by the build scripts)
+'''
+
+import io
+import os
+import json
+import time
+import tokenize
+
+from altair.util.separate_code_and_comments import separate_code_and_comments
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def legacy_separate_code_and_comments(script, script_id):
+    # Previous implementation, kept as the baseline; see separate_code_and_comments for the annotated algorithm
+    io_obj = io.StringIO(script)
+    code = ""
+    comments = ""
+    prev_toktype = tokenize.INDENT
+    last_lineno = -1
+    last_col = 0
+
+    try:
+        token_list = [x for x in tokenize.generate_tokens(io_obj.readline)]
+    except Exception as e:
+        return "",""
+
+    for tok in token_list:
+        token_type = tok[0]
+        token_string = tok[1]
+        start_line, start_col = tok[2]
+        end_line, end_col = tok[3]
+        inside_operator = False
+        if start_line > last_lineno:
+            last_col = 0
+        if start_col > last_col:
+            code += (" " * (start_col - last_col))
+        if token_type == tokenize.COMMENT:
+            comments += token_string
+        elif token_type == tokenize.STRING:
+            if prev_toktype != tokenize.INDENT:
+                if prev_toktype != tokenize.NEWLINE:
+                    if start_col > 0:
+                        code += token_string
+                        inside_operator = True
+            if not inside_operator:
+                comments += token_string
+        else:
+            code += token_string
+
+        prev_toktype = token_type
+        last_col = end_col
+        last_lineno = end_line
+
+    return code,comments
+
+def read_scripts(corpus_folder, max_script_count, json_lines):
+    scripts = []
+    for root, dirs, files in os.walk(corpus_folder):
+        dirs.sort()
+        for file_name in sorted(files):
+            if len(scripts) >= max_script_count: return scripts
+            fullpath = os.path.join(root, file_name)
+            if not json_lines and file_name.endswith(".py"):
+                with open(fullpath, "r", encoding="utf-8", errors="replace") as f:
+                    scripts.append(f.read())
+            elif json_lines:
+                with open(fullpath, "r") as f:
+                    for line in f:
+                        if len(scripts) >= max_script_count: return scripts
+                        scripts.append(json.loads(line)['content'])
+    return scripts
+
+def time_separator(separator, scripts, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.time()
+        results = [separator(script, "benchmark") for script in scripts]
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+def main(corpus_folder, max_script_count, repeat, json_lines):
+    scripts = read_scripts(corpus_folder, max_script_count, json_lines)
+    megabytes = sum(len(script.encode("utf-8")) for script in scripts) / 1e6
+    largest = max(len(script) for script in scripts) / 1e6 if scripts else 0
+    logger.info("Benchmarking %d scripts, %.2f MB total, largest %.2f MB" % (len(scripts), megabytes, largest))
+
+    legacy_time, legacy_results = time_separator(legacy_separate_code_and_comments, scripts, repeat)
+    streaming_time, streaming_results = time_separator(separate_code_and_comments, scripts, repeat)
+
+    mismatches = sum(1 for legacy, streaming in zip(legacy_results, streaming_results) if legacy != streaming)
+    logger.info("Before: %.2f s (%.2f MB/s)" % (legacy_time, megabytes / legacy_time))
+    logger.info("After:  %.2f s (%.2f MB/s)" % (streaming_time, megabytes / streaming_time))
+    logger.info("Scripts with different output: %d" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark separate_code_and_comments on a corpus of Python scripts')
+
+    # Required args
+    parser.add_argument("corpus_folder",
+                        type=str,
+                        help="Folder (searched recursively) of .py files, or of Altair JSON-lines script files with --json_lines")
+
+    # Optional args
+    parser.add_argument("--max_script_count",
+                        type=int,
+                        default=10000,
+                        help="Specify maximum number of code scripts to benchmark (default = 10000)")
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=3,
+                        help="Number of timed runs per implementation; the fastest is reported (default = 3)")
+
+    parser.add_argument("--json_lines",
+                        action="store_true",
+                        help="Read every file in corpus_folder as JSON lines with the script in 'content' (default = false)")
+
+    args = parser.parse_args()
+    main(args.corpus_folder, args.max_script_count, args.repeat, args.json_lines)
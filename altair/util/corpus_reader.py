@@ -0,0 +1,222 @@
+import os
+import json
+import queue
+from itertools import islice
+from collections import deque, Counter
+from multiprocessing import Pool
+
+from altair.util.preprocess_cache import PreprocessCache
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# Files are split into byte ranges of about this size so large files are also spread across workers
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+def corpus_chunks(script_folder, chunk_bytes=DEFAULT_CHUNK_BYTES, start_position=None):
+    '''
+    Splits every file of a script folder (in sorted order) into byte ranges
+    start_position (file_name, offset) skips the corpus before that line, as returned by read_corpus(with_positions=True)
+    Output: list of (fullpath, file_name, start, end) tuples in corpus order
+    '''
+    chunks = []
+    for file_name in sorted(os.listdir(script_folder)):
+        first = 0
+        if start_position is not None:
+            if file_name < start_position[0]:
+                continue
+            if file_name == start_position[0]:
+                first = start_position[1]
+        fullpath = os.path.join(script_folder, file_name)
+        size = os.path.getsize(fullpath)
+        if first > 0 and first >= size:
+            continue
+        for start in range(first, max(size, 1), chunk_bytes):
+            chunks.append((fullpath, file_name, start, min(start + chunk_bytes, size)))
+    return chunks
+
+def read_chunk(chunk, process, with_positions=False):
+    '''
+    Parses the JSON lines that start inside a byte range and applies process(parsed_json, file_name) to each
+    A line belongs to the range containing its first byte, so adjacent ranges never share or drop a line
+    Output: list of process results, skipping None (filtered out) results; with_positions pairs every result
+            with the (file_name, offset) position of the line after it
+    '''
+    return list(_iter_chunk(chunk, process, with_positions))
+
+def count_chunk(chunk, process, make_counter=Counter, max_records=None):
+    '''
+    Counts the items of every process result of a byte range (process returns an iterable of items, e.g. tokens)
+    Output: counts (make_counter() instance), number of scripts counted (at most max_records)
+    '''
+    counts = make_counter()
+    script_count = 0
+    for items in islice(_iter_chunk(chunk, process), max_records):
+        counts.update(items)
+        script_count += 1
+    return counts, script_count
+
+def _iter_chunk(chunk, process, with_positions=False):
+    fullpath, file_name, start, end = chunk
+    with open(fullpath, "rb") as f:
+        if start > 0:
+            # Skip the rest of the line that started in the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            record = process(json.loads(line.decode("utf-8")), file_name)
+            if record is not None:
+                yield ((file_name, f.tell()), record) if with_positions else record
+
+def _read_chunk_task(task):
+    return read_chunk(*task)
+
+def _count_chunk_task(task):
+    return count_chunk(*task)
+
+def _parallel_results(pool, function, tasks, num_workers, ordered):
+    # Keep a bounded number of chunks in flight so a slow consumer does not buffer the whole corpus
+    max_in_flight = num_workers * 2
+    tasks = iter(tasks)
+    if ordered:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.apply_async(function, (task,)))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+    else:
+        completed = queue.Queue()
+        pending = 0
+        for task in tasks:
+            pool.apply_async(function, (task,), callback=completed.put, error_callback=completed.put)
+            pending += 1
+            if pending >= max_in_flight:
+                yield _get_completed(completed)
+                pending -= 1
+        while pending:
+            yield _get_completed(completed)
+            pending -= 1
+
+def _get_completed(completed):
+    result = completed.get()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def read_corpus(script_folder, process, max_script_count=None, num_workers=1, ordered=True, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                start_position=None, with_positions=False):
+    '''
+    Reads a folder of JSON-lines script files (Altair's format uses the 'content' label for the script code)
+    JSON parsing and process() run in a pool of worker processes when num_workers > 1
+    Args:
+        script_folder (str): Folder location of corpus containing script files
+        process: picklable function (module-level function or functools.partial of one) called as
+                 process(parsed_json, file_name); returning None drops the script
+        max_script_count (int): stop after this many scripts that were not dropped (None reads everything).
+                 Scripts are counted in sorted file order, so the same scripts are returned for any num_workers
+        num_workers (int): number of worker processes (1 reads in the calling process)
+        ordered (bool): yield results in corpus order; unordered results are yielded as chunks complete.
+                 A max_script_count forces ordered results to keep the selection deterministic
+        chunk_bytes (int): approximate size of the byte ranges handed to workers
+        start_position ((str, int)): resume reading at this position, skipping the scripts before it without
+                 parsing or processing them
+        with_positions (bool): yield (position, result) pairs, where position is the start_position that resumes
+                 after that result
+    Returns:
+        Generator of process results
+    '''
+    tasks = [(chunk, process, with_positions) for chunk in corpus_chunks(script_folder, chunk_bytes, start_position)]
+    if max_script_count is not None:
+        ordered = True
+    if max_script_count is not None and max_script_count <= 0:
+        return
+
+    pool = None
+    if num_workers > 1:
+        pool = Pool(num_workers)
+        results = _parallel_results(pool, _read_chunk_task, tasks, num_workers, ordered)
+    else:
+        results = (_read_chunk_task(task) for task in tasks)
+
+    counter = 0
+    try:
+        for records in results:
+            for record in records:
+                yield record
+                counter += 1
+                if max_script_count is not None and counter >= max_script_count:
+                    return
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def count_corpus(script_folder, process, max_script_count=None, num_workers=1, make_counter=Counter, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Map-reduce counting over a folder of JSON-lines script files: every worker counts the items returned by
+    process(parsed_json, file_name) over its byte ranges into its own counter, and the partial counts are merged
+    in corpus order. Only counters cross process boundaries, never the per-script results.
+    Args:
+        script_folder (str): Folder location of corpus containing script files
+        process: picklable function returning an iterable of items to count, or None to drop the script
+        max_script_count (int): count at most this many scripts that were not dropped, in sorted file order
+                 (None counts everything). The byte range that crosses the limit is recounted up to the limit,
+                 so the counted scripts are the same as read_corpus and independent of num_workers
+        num_workers (int): number of worker processes (1 counts in the calling process)
+        make_counter: picklable factory for the counters; instances need update(items) and update(counter),
+                 as collections.Counter (exact, default) and vocabulary.SpaceSavingCounter (bounded memory) have
+        chunk_bytes (int): approximate size of the byte ranges handed to workers
+    Returns:
+        counts (make_counter() instance), number of scripts counted
+    '''
+    chunks = corpus_chunks(script_folder, chunk_bytes)
+    tasks = [(chunk, process, make_counter) for chunk in chunks]
+
+    pool = None
+    if num_workers > 1:
+        pool = Pool(num_workers)
+        results = _parallel_results(pool, _count_chunk_task, tasks, num_workers, True)
+    else:
+        results = (_count_chunk_task(task) for task in tasks)
+
+    total_counts = make_counter()
+    script_count = 0
+    try:
+        for chunk, (counts, chunk_script_count) in zip(chunks, results):
+            if max_script_count is not None and script_count >= max_script_count:
+                break
+            if max_script_count is not None and script_count + chunk_script_count > max_script_count:
+                # The limit falls inside this range: recount only the scripts below the limit
+                counts, chunk_script_count = count_chunk(chunk, process, make_counter, max_script_count - script_count)
+            total_counts.update(counts)
+            script_count += chunk_script_count
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return total_counts, script_count
+
+def script_code(parsed_json, file_name, cache_folder=None, min_code_len=0):
+    '''
+    Process function for read_corpus: code of the script with comments removed, or None if shorter than min_code_len
+    '''
+    code = PreprocessCache(cache_folder).code(parsed_json['content'], file_name)
+    return code if len(code) >= min_code_len else None
+
+def script_tokens(parsed_json, file_name, cache_folder=None, min_code_len=0, min_tokens=0, **normalizer_kwargs):
+    '''
+    Process function for read_corpus: normalized tokens of the script code (see normalize_text)
+    Returns None for scripts whose code is shorter than min_code_len or that have fewer than min_tokens tokens
+    '''
+    cache = PreprocessCache(cache_folder)
+    if min_code_len > 0 and len(cache.code(parsed_json['content'], file_name)) < min_code_len:
+        return None
+    tokens = cache.tokens(parsed_json['content'], file_name, **normalizer_kwargs)
+    return tokens if len(tokens) >= min_tokens else None
@@ -0,0 +1,91 @@
+import io
+import ast
+import tokenize
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def extract_imports(script):
+    '''
+    Identifies the libraries imported by a Python script with the standard ast module, falling back on a token scan
+    for scripts that do not parse (ex: Python 2 syntax). Same semantics as parse_import_statements and
+    parse_fromimport_statements over a RedBaron tree:
+        import xml.parser as p      = xml (only the base of a library, alias removed)
+        from xml.parser import tree = xml, parser (every dotted segment of the module)
+        from .util import x         = nothing (relative imports are skipped)
+    Input: String representation of a Python script
+    Output: libraries (set of imported libraries)
+    '''
+    try:
+        tree = ast.parse(script)
+    except Exception as e:
+        return _extract_imports_from_tokens(script)
+
+    libraries = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                libraries.add(alias.name.split('.')[0])
+        elif isinstance(node, ast.ImportFrom):
+            # node.level counts the leading dots of a relative import
+            if node.level == 0 and node.module:
+                libraries.update(node.module.split('.'))
+    return libraries
+
+# Tokens after which a new statement starts, where a 'from' keyword begins an import
+statement_start_types = frozenset([tokenize.NEWLINE, tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENCODING])
+statement_start_ops = frozenset([";", ":"])
+
+def _extract_imports_from_tokens(script):
+    # Token-level scan of import statements; tokenize works line by line, so imports before a tokenize error
+    # (ex: inconsistent indentation) are still returned
+    libraries = set()
+    io_obj = io.StringIO(script)
+    statement_start = True
+    # None outside of import statements, otherwise "import" or "from"
+    statement = None
+    module = []
+    relative = False
+    expect_name = False
+
+    try:
+        for tok in tokenize.generate_tokens(io_obj.readline):
+            token_type, token_string = tok[0], tok[1]
+
+            if statement == "import":
+                if token_type == tokenize.NAME and expect_name:
+                    # Only the base of a library is kept (xml.parser becomes xml)
+                    libraries.add(token_string)
+                    expect_name = False
+                elif token_type == tokenize.OP and token_string == ",":
+                    expect_name = True
+                elif token_type in (tokenize.NEWLINE, tokenize.ENDMARKER) or token_string == ";":
+                    statement = None
+
+            elif statement == "from":
+                if token_type == tokenize.NAME and token_string == "import":
+                    if not relative:
+                        libraries.update(module)
+                    statement = None
+                elif token_type == tokenize.NAME:
+                    module.append(token_string)
+                elif token_type == tokenize.OP and token_string in (".", "...") and not module:
+                    relative = True
+                elif token_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                    statement = None
+
+            elif token_type == tokenize.NAME and token_string == "import":
+                statement = "import"
+                expect_name = True
+            elif token_type == tokenize.NAME and token_string == "from" and statement_start:
+                statement = "from"
+                module = []
+                relative = False
+
+            statement_start = token_type in statement_start_types or \
+                              (token_type == tokenize.OP and token_string in statement_start_ops)
+    except Exception as e:
+        pass
+
+    return libraries
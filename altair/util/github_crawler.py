@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from altair.util.http_fetch import make_session
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+GITHUB_API_URL = "https://api.github.com"
+
+# Code search query of a search term; GitHub caps code search at 1000 results (10 pages of 100)
+SEARCH_QUERY = "%s+size:>1000+extension:py+language:python"
+RESULTS_PER_PAGE = 100
+MAX_PAGES = 10
+
+# Extra time waited after a rate limit window resets, since X-RateLimit-Reset is rounded to the second
+RESET_MARGIN = 0.5
+
+def rate_limit_resource(url):
+    # Search requests have a separate, much smaller rate limit than the other API requests
+    return "search" if "/search/" in url else "core"
+
+class ClientError(Exception):
+    # A request rejected with a 4xx status other than a rate limit, which retrying will not fix
+    pass
+
+class TokenPool:
+    '''
+    Schedules API requests across several tokens from the X-RateLimit-Remaining and X-RateLimit-Reset headers of
+    their responses, instead of sleeping a fixed time when a limit is hit. acquire() hands out the token with the most
+    requests left for a resource (search or core), counting requests still in flight, and blocks until the earliest
+    reset when every token is exhausted. Tokens whose remaining count is not known yet are used optimistically.
+    '''
+    def __init__(self, credentials):
+        self.tokens = [{"credentials": credentials_item, "remaining": {}, "reset": {}, "in_flight": {}} for credentials_item in credentials]
+        self.condition = threading.Condition()
+
+    def _available(self, token, resource, now):
+        remaining = token["remaining"].get(resource)
+        if remaining is None or now >= token["reset"].get(resource, 0) + RESET_MARGIN:
+            return float("inf")
+        return remaining - token["in_flight"].get(resource, 0)
+
+    def acquire(self, resource):
+        with self.condition:
+            while True:
+                now = time.time()
+                best_token = max(self.tokens, key=lambda token: self._available(token, resource, now))
+                if self._available(best_token, resource, now) > 0:
+                    best_token["in_flight"][resource] = best_token["in_flight"].get(resource, 0) + 1
+                    return best_token
+                # Every token is exhausted or busy: wait for a response or for the earliest window reset
+                next_reset = min(token["reset"].get(resource, now) for token in self.tokens) + RESET_MARGIN
+                wait_time = max(next_reset - now, 0.1)
+                if wait_time > 5:
+                    logger.info("All tokens over the %s rate limit, waiting %.0f s for the next reset" % (resource, wait_time))
+                self.condition.wait(wait_time)
+
+    def release(self, token, resource, response):
+        '''
+        Updates the limits of token from the response of a request made with it
+        Returns:
+            rate_limited (bool): True when the request was rejected by a rate limit and should be retried
+        '''
+        with self.condition:
+            token["in_flight"][resource] -= 1
+            rate_limited = False
+            if response is not None:
+                headers = response.headers
+                rate_limited = response.status_code in (403, 429) and \
+                    (headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers or "rate limit" in response.text.lower())
+                if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset" in headers:
+                    remaining = int(headers["X-RateLimit-Remaining"])
+                    reset = float(headers["X-RateLimit-Reset"])
+                    # Responses of the same window can arrive out of order; keep the lowest remaining count
+                    if token["reset"].get(resource) == reset and token["remaining"].get(resource) is not None:
+                        remaining = min(remaining, token["remaining"][resource])
+                    token["remaining"][resource] = remaining
+                    token["reset"][resource] = reset
+                if rate_limited:
+                    token["remaining"][resource] = 0
+                    if "Retry-After" in headers:
+                        # Secondary rate limits only say how long to back off
+                        token["reset"][resource] = time.time() + float(headers["Retry-After"])
+                    else:
+                        token["reset"][resource] = max(token["reset"].get(resource, 0), time.time())
+            self.condition.notify_all()
+            return rate_limited
+
+class CrawlJournal:
+    '''
+    JSON-lines journal of the crawl, appended as each request completes so an interrupted crawl resumes where it
+    stopped. A search event records a results page and the contents URLs found on it; a contents event records the
+    download URL a contents URL resolved to (null when the API rejected it with a client error). Requests that failed
+    for transient reasons are not journaled, so they stay in the frontier.
+    Replaying the journal gives the discovered download URLs and the frontier: the next page of every search term
+    not finished and the contents URLs found but not resolved yet.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.search_pages = {}
+        self.finished_terms = set()
+        self.contents = OrderedDict()
+        if os.path.exists(filename):
+            self._replay()
+        self.f = open(filename, "a")
+
+    def _replay(self):
+        with open(self.filename, "rb+") as f:
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    # Last line torn by an interrupted write: cut it off so the next event starts on a new line
+                    f.truncate(f.tell() - len(line))
+                    break
+                try:
+                    event = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                if "search" in event:
+                    self._apply_search(event)
+                else:
+                    self.contents[event["contents"]] = event["download_url"]
+
+    def _apply_search(self, event):
+        term = event["search"]
+        self.search_pages[term] = max(self.search_pages.get(term, 0), event["page"])
+        if event["last"]:
+            self.finished_terms.add(term)
+        for contents_url in event["contents"]:
+            self.contents.setdefault(contents_url, False)
+
+    def _write(self, event):
+        self.f.write(json.dumps(event) + "\n")
+        self.f.flush()
+
+    def record_search(self, term, page, contents_urls, last):
+        event = {"search": term, "page": page, "contents": contents_urls, "last": last}
+        self._apply_search(event)
+        self._write(event)
+
+    def record_contents(self, contents_url, download_url):
+        self.contents[contents_url] = download_url
+        self._write({"contents": contents_url, "download_url": download_url})
+
+    def next_page(self, term):
+        # None when every page of the term has been crawled
+        if term in self.finished_terms or self.search_pages.get(term, 0) >= MAX_PAGES:
+            return None
+        return self.search_pages.get(term, 0) + 1
+
+    def pending_contents(self):
+        return [contents_url for contents_url, download_url in self.contents.items() if download_url is False]
+
+    def download_urls(self):
+        return set(download_url for download_url in self.contents.values() if download_url)
+
+    def close(self):
+        self.f.close()
+
+class GitHubCodeCrawler:
+    '''
+    Finds the download URLs of Python scripts from GitHub code search with a bounded pool of concurrent requests.
+    Search terms are crawled in parallel, the pages of each term in order until a page has fewer than
+    RESULTS_PER_PAGE results. Every search result is resolved to its download URL through the contents API.
+    Requests are spread across the tokens of a TokenPool and progress is persisted in a CrawlJournal.
+    Args:
+        credentials (list of (str, str)): GitHub user ids and OAuth tokens
+        journal_filename (str): JSON-lines file the crawl progress is appended to and resumed from
+        api_url (str): base URL of the GitHub API, a local mock for testing
+        num_threads (int): maximum number of concurrent requests
+        max_search_threads (int): maximum number of concurrent search requests (default = half of num_threads)
+        timeout (float): connect and read timeout of each request, in seconds
+        max_attempts (int): attempts of a request failing for other reasons than a rate limit
+    '''
+    def __init__(self, credentials, journal_filename, api_url=GITHUB_API_URL, num_threads=8, max_search_threads=None,
+                 timeout=30, max_attempts=3):
+        self.tokens = TokenPool(credentials)
+        self.journal = CrawlJournal(journal_filename)
+        self.api_url = api_url.rstrip("/")
+        self.num_threads = num_threads
+        self.max_search_threads = max_search_threads or max(1, num_threads // 2)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        # Rate limit responses are retried here with another token, so urllib3 only retries server errors
+        self.session = make_session(num_threads, status_forcelist=(500, 502, 503, 504))
+
+    def search_url(self, term, page):
+        return "%s/search/code?q=%s&per_page=%d&page=%d" % (self.api_url, SEARCH_QUERY % term, RESULTS_PER_PAGE, page)
+
+    def get_json(self, url):
+        # Returns the decoded response, or None when the request keeps failing for other reasons than a rate limit;
+        # raises ClientError on a 4xx response that is not a rate limit
+        resource = rate_limit_resource(url)
+        failures = 0
+        while failures < self.max_attempts:
+            token = self.tokens.acquire(resource)
+            response = None
+            try:
+                response = self.session.get(url, auth=token["credentials"], timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("Request error on %s: %s" % (url, e))
+            finally:
+                rate_limited = self.tokens.release(token, resource, response)
+            if rate_limited:
+                continue
+            if response is not None and response.status_code == 200:
+                try:
+                    return response.json()
+                except ValueError:
+                    logger.warning("Invalid JSON from %s" % url)
+            elif response is not None:
+                logger.warning("Error code %d on %s" % (response.status_code, url))
+                # Client errors other than rate limits (missing file, invalid query, bad credentials) do not go away
+                if 400 <= response.status_code < 500:
+                    raise ClientError("Error code %d on %s" % (response.status_code, url))
+            failures += 1
+        return None
+
+    def _search(self, term, page):
+        return self.get_json(self.search_url(term, page))
+
+    def _contents(self, contents_url):
+        return self.get_json(contents_url)
+
+    def crawl(self, search_terms):
+        '''
+        Crawls the search terms, resuming from the journal
+        Returns:
+            code_urls (set of str): download URLs of the Python scripts found
+        '''
+        ready_contents = deque(self.journal.pending_contents())
+        ready_searches = deque()
+        for term in OrderedDict.fromkeys(search_terms):
+            page = self.journal.next_page(term)
+            if page is not None:
+                ready_searches.append((term, page))
+        logger.info("Resuming with %d download URLs, %d contents and %d search terms to crawl" % \
+                    (len(self.journal.download_urls()), len(ready_contents), len(ready_searches)))
+
+        pending = {}
+        searches_in_flight = 0
+        resolved = 0
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            while ready_contents or ready_searches or pending:
+                # Resolve contents first so the frontier stays small, and keep threads for them when searches wait on limits
+                while len(pending) < self.num_threads:
+                    if ready_contents:
+                        contents_url = ready_contents.popleft()
+                        pending[executor.submit(self._contents, contents_url)] = ("contents", contents_url)
+                    elif ready_searches and searches_in_flight < self.max_search_threads:
+                        term, page = ready_searches.popleft()
+                        pending[executor.submit(self._search, term, page)] = ("search", term, page)
+                        searches_in_flight += 1
+                    else:
+                        break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    try:
+                        result = future.result()
+                        client_error = False
+                    except ClientError:
+                        result = None
+                        client_error = True
+                    if task[0] == "contents":
+                        if result is None and not client_error:
+                            # Left pending in the journal so a resumed crawl retries it
+                            logger.warning("Could not resolve %s, left for a resumed crawl" % task[1])
+                            continue
+                        download_url = result.get("download_url") if isinstance(result, dict) else None
+                        self.journal.record_contents(task[1], download_url)
+                        resolved += 1
+                        if resolved % 1000 == 0:
+                            logger.info("Total Python files inventoried: %d" % len(self.journal.download_urls()))
+                        continue
+
+                    searches_in_flight -= 1
+                    _, term, page = task
+                    if result is None and not client_error:
+                        # The term is left unfinished at this page so a resumed crawl retries it
+                        logger.warning("Search term:'%s', Results page:%d failed, left for a resumed crawl" % (term, page))
+                        continue
+                    items = result.get("items", []) if isinstance(result, dict) else []
+                    contents_urls = [url for url in OrderedDict.fromkeys(item.get("url") for item in items) if url and url not in self.journal.contents]
+                    # A page with fewer results than requested is the last one, as is a page the API rejects
+                    last = client_error or (isinstance(result, dict) and "items" in result and len(items) < RESULTS_PER_PAGE)
+                    self.journal.record_search(term, page, contents_urls, last)
+                    ready_contents.extend(contents_urls)
+                    next_page = self.journal.next_page(term)
+                    if next_page is not None:
+                        ready_searches.append((term, next_page))
+                    logger.info("Search term:'%s', Results page:%d, %d new files" % (term, page, len(contents_urls)))
+        return self.journal.download_urls()
+
+    def close(self):
+        self.journal.close()
+        self.session.close()
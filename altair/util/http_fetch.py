@@ -0,0 +1,80 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# Responses retried with backoff: rate limiting and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Result of a single GET: text is None unless status_code is 200, error holds the exception message of failed requests
+FetchResult = namedtuple("FetchResult", ["url", "status_code", "text", "error"])
+
+def make_session(pool_size=32, retries=3, backoff_factor=0.5, status_forcelist=RETRY_STATUS_CODES):
+    '''
+    Creates a requests session whose connection pool holds pool_size connections per host, so concurrent fetches
+    reuse connections instead of opening one per request. Connection errors and status_forcelist responses are
+    retried up to retries times, sleeping backoff_factor * 2^(attempt - 1) seconds between attempts.
+    Args:
+        pool_size (int): connections kept open per host, should be at least the number of fetch threads
+        retries (int): maximum number of retries per request
+        backoff_factor (float): base of the exponential backoff between retries, in seconds
+        status_forcelist (tuple of int): response status codes retried (default = RETRY_STATUS_CODES)
+    Returns:
+        session (requests.Session)
+    '''
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=status_forcelist, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_url(session, url, timeout=30):
+    # One GET per URL; the status code and the text both come from the same response
+    try:
+        response = session.get(url, timeout=timeout)
+        text = response.text if response.status_code == 200 else None
+        return FetchResult(url, response.status_code, text, None)
+    except Exception as e:
+        return FetchResult(url, None, None, "%s: %s" % (e.__class__.__name__, e))
+
+def fetch_urls(urls, session=None, num_threads=32, timeout=30, max_in_flight=None):
+    '''
+    Fetches URLs concurrently with a pool of threads sharing one connection-pooled session, so throughput grows
+    with num_threads instead of being bound by the round-trip time of each request.
+    At most max_in_flight requests are pending or unconsumed at any time, so a slow consumer holds back the fetching
+    instead of buffering the whole list of responses in memory.
+    Args:
+        urls (iterable of str): URLs to fetch
+        session (requests.Session): session used by every thread (default = make_session(num_threads))
+        num_threads (int): number of concurrent requests
+        timeout (float): connect and read timeout of each request, in seconds
+        max_in_flight (int): maximum number of requests submitted but not yet consumed (default = 2 * num_threads)
+    Returns:
+        Generator of FetchResult, in completion order
+    '''
+    if session is None:
+        session = make_session(num_threads)
+    if not max_in_flight:
+        max_in_flight = 2 * num_threads
+
+    urls = iter(urls)
+    pending = set()
+    with ThreadPoolExecutor(num_threads) as executor:
+        while True:
+            # Top up the requests in flight, then hand back whichever completes first
+            for url in urls:
+                pending.add(executor.submit(fetch_url, session, url, timeout))
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
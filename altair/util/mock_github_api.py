@@ -0,0 +1,195 @@
+'''
+Local mock of the GitHub code search and contents API for running the crawler of build_python_corpus without
+network access or real tokens. Search results and contents are generated deterministically from the search term,
+a few contents requests fail with a 404, and every token gets per-window rate limits on the search and core
+resources with X-RateLimit-Remaining and X-RateLimit-Reset headers, answering 403 "API rate limit exceeded" once a
+limit is used up, as GitHub does.
+By default runs GitHubCodeCrawler against the mock and checks it finds exactly the expected download URLs without
+exceeding the rate limits; with --serve the mock is left running for build_python_corpus --api_url.
+'''
+
+import os
+import json
+import time
+import zlib
+import base64
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from altair.util.github_crawler import GitHubCodeCrawler, RESULTS_PER_PAGE, MAX_PAGES
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def term_result_count(term):
+    # Number of search results of a term, up to a little more than the 1000 results GitHub returns
+    return zlib.crc32(term.encode("utf-8")) % (RESULTS_PER_PAGE * MAX_PAGES + 200)
+
+def missing_contents(term, index):
+    # Contents requests answered with a 404
+    return index % 47 == 46
+
+def expected_download_urls(base_url, search_terms):
+    download_urls = set()
+    for term in set(search_terms):
+        for index in range(min(term_result_count(term), RESULTS_PER_PAGE * MAX_PAGES)):
+            if not missing_contents(term, index):
+                download_urls.add("%s/raw/%s/%d.py" % (base_url, term, index))
+    return download_urls
+
+class MockGitHubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, search_limit=10, core_limit=100, window=2, latency=0.01, port=0):
+        HTTPServer.__init__(self, ("127.0.0.1", port), MockGitHubHandler)
+        self.limits = {"search": search_limit, "core": core_limit}
+        self.window = window
+        self.latency = latency
+        self.lock = threading.Lock()
+        # (token, resource, window start) -> requests counted
+        self.usage = {}
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.base_url = "http://127.0.0.1:%d" % self.server_address[1]
+
+    def consume(self, token, resource):
+        # Counts a request against the limit of the token; returns (allowed, remaining, reset epoch second)
+        now = time.time()
+        window_start = int(now // self.window) * self.window
+        with self.lock:
+            self.request_count += 1
+            used = self.usage.get((token, resource, window_start), 0)
+            allowed = used < self.limits[resource]
+            if allowed:
+                used += 1
+                self.usage[(token, resource, window_start)] = used
+            else:
+                self.rate_limited_count += 1
+        return allowed, self.limits[resource] - used, window_start + self.window
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def send_json(self, status, content, headers):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        url = urlsplit(self.path)
+        token = "anonymous"
+        authorization = self.headers.get("Authorization", "")
+        if authorization.startswith("Basic "):
+            token = base64.b64decode(authorization[6:]).decode("utf-8").split(":", 1)[-1]
+
+        resource = "search" if url.path.startswith("/search/") else "core"
+        allowed, remaining, reset = server.consume(token, resource)
+        headers = {"X-RateLimit-Limit": server.limits[resource], "X-RateLimit-Remaining": remaining, "X-RateLimit-Reset": reset}
+        if not allowed:
+            self.send_json(403, {"message": "API rate limit exceeded for user %s." % token}, headers)
+            return
+
+        if url.path == "/search/code":
+            query = parse_qs(url.query)
+            term = unquote(query["q"][0]).split(" ")[0].split("+")[0]
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            # GitHub only serves the first 1000 results of a search
+            total = min(term_result_count(term), RESULTS_PER_PAGE * MAX_PAGES)
+            first = (page - 1) * per_page
+            items = [{"name": "%d.py" % index, "url": "%s/repos/mock/%s/contents/%d.py" % (server.base_url, term, index)}
+                     for index in range(first, min(first + per_page, total))]
+            self.send_json(200, {"total_count": term_result_count(term), "items": items}, headers)
+        elif url.path.startswith("/repos/mock/"):
+            term, name = url.path[len("/repos/mock/"):].split("/contents/")
+            index = int(name.split(".")[0])
+            if missing_contents(term, index):
+                self.send_json(404, {"message": "Not Found"}, headers)
+            else:
+                self.send_json(200, {"name": name, "size": 2000, "download_url": "%s/raw/%s/%s" % (server.base_url, term, name)}, headers)
+        else:
+            self.send_json(404, {"message": "Not Found"}, headers)
+
+    def log_message(self, format, *args):
+        pass
+
+def main(search_terms, token_count, num_threads, search_limit, core_limit, window, latency, serve, port):
+    server = MockGitHubServer(search_limit, core_limit, window, latency, port)
+    logger.info("Mock GitHub API at %s" % server.base_url)
+    if serve:
+        server.serve_forever()
+        return 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    credentials = [("user%d" % token_number, "token%d" % token_number) for token_number in range(token_count)]
+    journal_filename = os.path.join(tempfile.mkdtemp(), "crawl.journal")
+    crawler = GitHubCodeCrawler(credentials, journal_filename, server.base_url, num_threads)
+    start_time = time.time()
+    code_urls = crawler.crawl(search_terms)
+    elapsed = time.time() - start_time
+    crawler.close()
+    server.shutdown()
+
+    expected = expected_download_urls(server.base_url, search_terms)
+    logger.info("Found %d download URLs in %.2f s with %d requests, %d rejected by rate limits" % \
+                (len(code_urls), elapsed, server.request_count, server.rate_limited_count))
+    logger.info("Missing %d and unexpected %d download URLs" % (len(expected - code_urls), len(code_urls - expected)))
+    return len(expected ^ code_urls)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the GitHub crawler against a local mock of the GitHub search and contents API.')
+
+    # Optional args
+    parser.add_argument("--search_terms",
+                        type=str,
+                        nargs="+",
+                        default=["numpy", "flask", "gensim", "lstm", "pandas"],
+                        help="Search terms crawled (default = numpy flask gensim lstm pandas)")
+    parser.add_argument("--token_count",
+                        type=int,
+                        default=3,
+                        help="Number of tokens rotated by the crawler (default = 3)")
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=16,
+                        help="Maximum number of concurrent requests of the crawler (default = 16)")
+    parser.add_argument("--search_limit",
+                        type=int,
+                        default=10,
+                        help="Search requests allowed per token and window (default = 10)")
+    parser.add_argument("--core_limit",
+                        type=int,
+                        default=200,
+                        help="Contents requests allowed per token and window (default = 200)")
+    parser.add_argument("--window",
+                        type=int,
+                        default=2,
+                        help="Length of the rate limit windows, in seconds (default = 2)")
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.01,
+                        help="Seconds the mock waits before answering each request (default = 0.01)")
+    parser.add_argument("--serve",
+                        action="store_true",
+                        help="Only serve the mock API until interrupted (default = false)")
+    parser.add_argument("--port",
+                        type=int,
+                        default=0,
+                        help="Port of the mock API, 0 picks a free port (default = 0)")
+
+    args = parser.parse_args()
+    main(args.search_terms, args.token_count, args.num_threads, args.search_limit, args.core_limit, args.window,
+         args.latency, args.serve, args.port)
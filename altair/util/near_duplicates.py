@@ -0,0 +1,151 @@
+import zlib
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+import numpy
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# Mersenne prime used by the MinHash permutations (a * x + b) % minhash_prime
+minhash_prime = (1 << 31) - 1
+
+def ratio_to_jaccard(ratio):
+    '''
+    Maps a SequenceMatcher ratio threshold to a Jaccard similarity threshold
+    SequenceMatcher.ratio() is 2 * matches / total length, the Dice coefficient of the two texts, and a Dice
+    coefficient D corresponds to a Jaccard similarity of D / (2 - D)
+    '''
+    return ratio / (2.0 - ratio)
+
+def is_similar(text_a, text_b, threshold):
+    '''
+    Exact near-duplicate test: SequenceMatcher(None, text_a, text_b).ratio() > threshold
+    The cheap upper bounds real_quick_ratio() and quick_ratio() are checked first, which never changes the result
+    '''
+    matcher = SequenceMatcher(None, text_a, text_b)
+    return matcher.real_quick_ratio() > threshold and matcher.quick_ratio() > threshold and matcher.ratio() > threshold
+
+def find_duplicates(texts, threshold, candidates=None):
+    '''
+    Flags near duplicates the way the pair-wise dedup in convert_meta_kaggle_csv_to_json always has: texts are
+    visited in order and a text is removed when it is similar to any other text that has not been removed yet
+    Args:
+        texts (list): texts to compare (ex: lower case script contents)
+        threshold (float): SequenceMatcher ratio above which two texts are near duplicates
+        candidates (list): optional list of sets; when given, text i is only compared with the texts in
+                           candidates[i] instead of with every other text
+    Returns:
+        removed (list of bool): removed[i] is True when text i is a near duplicate
+    '''
+    removed = [False] * len(texts)
+    for i in range(len(texts)):
+        others = range(len(texts)) if candidates is None else sorted(candidates[i])
+        for j in others:
+            if i != j and not removed[j] and is_similar(texts[i], texts[j], threshold):
+                removed[i] = True
+                break
+    return removed
+
+def shingle_hashes(text, shingle_size=5):
+    '''
+    Hashes of the distinct character shingles (substrings of shingle_size characters) of a text
+    Output: numpy array of uint64 hashes reduced modulo minhash_prime (a single hash for texts shorter than a shingle)
+    '''
+    data = text.encode("utf-8", "surrogatepass")
+    if len(data) <= shingle_size:
+        return numpy.array([zlib.crc32(data) % minhash_prime], dtype=numpy.uint64)
+    # Polynomial rolling hash over the UTF-8 bytes, computed for every shingle at once
+    byte_values = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.uint64)
+    shingle_count = len(data) - shingle_size + 1
+    hashes = numpy.zeros(shingle_count, dtype=numpy.uint64)
+    for offset in range(shingle_size):
+        hashes = (hashes * numpy.uint64(257) + byte_values[offset:offset + shingle_count]) % numpy.uint64(minhash_prime)
+    return numpy.unique(hashes)
+
+class MinHasher:
+    '''
+    MinHash signatures of character shingle sets: the fraction of equal signature values of two texts is an
+    unbiased estimate of the Jaccard similarity of their shingle sets
+    '''
+    def __init__(self, num_perm=128, shingle_size=5, seed=0):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        random_state = numpy.random.RandomState(seed)
+        self.a = random_state.randint(1, minhash_prime, size=(num_perm, 1)).astype(numpy.uint64)
+        self.b = random_state.randint(0, minhash_prime, size=(num_perm, 1)).astype(numpy.uint64)
+
+    def signature(self, text, block_size=4096):
+        hashes = shingle_hashes(text, self.shingle_size)
+        signature = numpy.full(self.num_perm, minhash_prime, dtype=numpy.uint64)
+        # Permute blocks of shingles to bound the num_perm x shingles intermediate array
+        for start in range(0, len(hashes), block_size):
+            permuted = (self.a * hashes[start:start + block_size] + self.b) % numpy.uint64(minhash_prime)
+            numpy.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature
+
+    def signatures(self, texts):
+        return numpy.vstack([self.signature(text) for text in texts]) if texts else \
+               numpy.empty((0, self.num_perm), dtype=numpy.uint64)
+
+def lsh_parameters(jaccard_threshold, num_perm, false_negative_weight=0.9):
+    '''
+    Chooses the number of LSH bands and rows per band (bands * rows <= num_perm) that minimize the weighted
+    probability of missing pairs above jaccard_threshold and of proposing pairs below it. Candidates are verified
+    exactly afterwards, so misses are weighted more heavily than false candidates by default.
+    Output: bands, rows
+    '''
+    similarities = numpy.linspace(0.0, 1.0, 1001)
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        candidate_probability = 1.0 - (1.0 - similarities ** rows) ** bands
+        false_positive = numpy.mean(numpy.where(similarities < jaccard_threshold, candidate_probability, 0.0))
+        false_negative = numpy.mean(numpy.where(similarities >= jaccard_threshold, 1.0 - candidate_probability, 0.0))
+        error = (1.0 - false_negative_weight) * false_positive + false_negative_weight * false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+def lsh_candidates(signatures, bands, rows):
+    '''
+    Candidate pairs from LSH banding: two texts are candidates if all rows of any band of their signatures are equal
+    Output: candidates (list of sets, candidates[i] holds the indices that share a band bucket with text i)
+    '''
+    candidates = [set() for _ in range(len(signatures))]
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_values = numpy.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for index in range(len(signatures)):
+            buckets[band_values[index].tobytes()].append(index)
+        for bucket in buckets.values():
+            if len(bucket) > 1:
+                for index in bucket:
+                    candidates[index].update(bucket)
+    for index in range(len(candidates)):
+        candidates[index].discard(index)
+    return candidates
+
+def find_duplicates_minhash(texts, threshold, jaccard_threshold=None, num_perm=128, shingle_size=5, seed=0):
+    '''
+    Near-duplicate flags of find_duplicates computed on LSH candidate pairs only
+    MinHash signatures of character shingles are banded so texts whose shingle sets have an estimated Jaccard
+    similarity around jaccard_threshold or above share a bucket; only those pairs are verified with the exact
+    SequenceMatcher test, so every removal is one find_duplicates would also consider
+    Args:
+        texts (list): texts to compare (ex: lower case script contents)
+        threshold (float): SequenceMatcher ratio above which two texts are near duplicates
+        jaccard_threshold (float): shingle Jaccard similarity targeted by the LSH bands
+                                   (default = ratio_to_jaccard(threshold))
+        num_perm (int): number of MinHash permutations (signature length)
+        shingle_size (int): number of characters per shingle
+        seed (int): seed of the MinHash permutations
+    Returns:
+        removed (list of bool): removed[i] is True when text i is a near duplicate
+    '''
+    if jaccard_threshold is None:
+        jaccard_threshold = ratio_to_jaccard(threshold)
+    bands, rows = lsh_parameters(jaccard_threshold, num_perm)
+    signatures = MinHasher(num_perm, shingle_size, seed).signatures(texts)
+    return find_duplicates(texts, threshold, lsh_candidates(signatures, bands, rows))
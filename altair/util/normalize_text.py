@@ -11,11 +11,16 @@ link_re = re.compile(r'\/{2}[\d\w-]+(\.[\d\w-]+)*(?:(?:\/[^\s/]*))*')
 letter_re = re.compile(r"[^a-zA-Z]")
 letter_number_re = re.compile(r"[^0-9a-zA-Z]")
 
+# Only text that BeautifulSoup/lxml would change needs the HTML parser: tag, comment or declaration openings,
+# character entities and NUL characters (dropped by lxml). Everything else it returns verbatim
+markup_re = re.compile(r"<[!/?a-zA-Z]|&[#a-zA-Z]|\x00")
+
 # Use Python 3.0 keyword list (keyword.kwlist) in lower case as stop word candidates for code
-python_stop_words = ['false', 'none', 'true', 'and', 'as', 'assert', 'break', 'class', 'continue', 'def', \
+python_stop_words = frozenset(['false', 'none', 'true', 'and', 'as', 'assert', 'break', 'class', 'continue', 'def', \
               'del', 'elif', 'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', \
               'in', 'is', 'lambda', 'nonlocal', 'not', 'or', 'pass', 'raise', 'return', 'try', 'while', \
-              'with', 'yield']
+              'with', 'yield'])
+stop_words = python_stop_words | frozenset(ENGLISH_STOP_WORDS)
 
 def normalize_text(raw_text, remove_stop_words=True, only_letters=True, return_list=False, remove_one_char_words=True, **kwargs):
     '''
@@ -37,9 +42,10 @@ def normalize_text(raw_text, remove_stop_words=True, only_letters=True, return_l
 
     # Remove HTML
     # Suppress UserWarnings from BeautifulSoup due to text with tech info (ex: code, directory structure)
-    with warnings.catch_warnings():
-        warnings.filterwarnings('ignore', category=UserWarning)
-        clean_text = BeautifulSoup(clean_text, "lxml").get_text()
+    if markup_re.search(clean_text):
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', category=UserWarning)
+            clean_text = BeautifulSoup(clean_text, "lxml").get_text()
 
     # Only keep letters or keep letters and numbers
     if only_letters: 
@@ -50,17 +56,14 @@ def normalize_text(raw_text, remove_stop_words=True, only_letters=True, return_l
     # Convert to lower case, split into individual words
     clean_text = clean_text.lower().split()
 
+    # Single filter pass:
     # If numbers are allowed in words, remove candidate words that only contain numbers
-    if not only_letters:
-        clean_text = [w for w in clean_text if not all(i.isdigit() for i in w)]
-
     # Remove stop words
-    if remove_stop_words:
-        clean_text = [w for w in clean_text if not w in python_stop_words]
-        clean_text = [w for w in clean_text if not w in ENGLISH_STOP_WORDS]
-
     # Remove words that are only a single character in length
-    if remove_one_char_words: clean_text = [w for w in clean_text if len(w)>1]
+    remove_numbers = not only_letters
+    clean_text = [w for w in clean_text if not (remove_numbers and w.isdigit()) and \
+                  not (remove_stop_words and w in stop_words) and \
+                  not (remove_one_char_words and len(w)<2)]
 
     # Return as string or list based on parameters
     if return_list:
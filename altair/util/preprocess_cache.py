@@ -0,0 +1,84 @@
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+
+from altair.util.separate_code_and_comments import separate_code_and_comments
+from altair.util.normalize_text import normalize_text
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# Bump when separate_code_and_comments or normalize_text change output so stale entries are not reused
+CACHE_VERSION = 1
+
+# Environment variable used as the default cache folder by the build scripts and evaluation
+CACHE_FOLDER_ENV = "ALTAIR_PREPROCESS_CACHE"
+
+class PreprocessCache:
+    '''
+    On-disk, content-addressed cache for code/comment separation and text normalization
+    Entries are keyed by a hash of the script content (plus the normalizer parameters for token lists), so the
+    same script is only tokenized once no matter which build script, vectorizer or corpus file it comes from.
+    Code is stored as zlib-compressed UTF-8 and token lists as zlib-compressed newline-joined words, spread over
+    256 sub-folders. With cache_folder=None every call is computed directly and nothing is stored.
+    '''
+    def __init__(self, cache_folder=None):
+        self.cache_folder = cache_folder
+        if cache_folder and not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+
+    def code(self, script, script_id):
+        '''
+        Returns the code of a script with comments and docstrings removed (see separate_code_and_comments)
+        '''
+        if not self.cache_folder:
+            return separate_code_and_comments(script, script_id)[0]
+        key = self._key(script, "code")
+        code = self._read(key)
+        if code is None:
+            code = separate_code_and_comments(script, script_id)[0]
+            self._write(key, code)
+        return code
+
+    def tokens(self, script, script_id, **normalizer_kwargs):
+        '''
+        Returns normalize_text(code, return_list=True, **normalizer_kwargs) for the code of a script
+        '''
+        normalizer_kwargs["return_list"] = True
+        if not self.cache_folder:
+            return normalize_text(self.code(script, script_id), **normalizer_kwargs)
+        key = self._key(script, "tokens", json.dumps(normalizer_kwargs, sort_keys=True))
+        joined = self._read(key)
+        if joined is None:
+            tokens = normalize_text(self.code(script, script_id), **normalizer_kwargs)
+            # Normalized words never contain whitespace, so a newline-joined string round-trips exactly
+            self._write(key, "\n".join(tokens))
+            return tokens
+        return joined.split("\n") if joined else []
+
+    def _key(self, script, *parts):
+        hasher = hashlib.sha1(script.encode("utf-8", "surrogatepass"))
+        hasher.update(("\0%d\0%s" % (CACHE_VERSION, "\0".join(parts))).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, key[:2], key)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8", "surrogatepass")
+        except (IOError, OSError, zlib.error):
+            return None
+
+    def _write(self, key, value):
+        # Write to a temporary file and rename so concurrent readers never see a partial entry
+        folder = os.path.dirname(self._path(key))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(value.encode("utf-8", "surrogatepass"), 1))
+        os.replace(temp_path, self._path(key))
@@ -11,72 +11,70 @@ def separate_code_and_comments(script, script_id):
     Output: code (string), comments (string)
     """
     io_obj = io.StringIO(script)
-    code = ""
-    comments = ""
+    # Collect pieces in lists and join once; repeated += on strings can go quadratic on large scripts
+    code = []
+    comments = []
     prev_toktype = tokenize.INDENT
     last_lineno = -1
     last_col = 0
 
-    # Tokenize will throw syntax errors (ex: IndentationError)
+    # Tokens are consumed lazily as they are generated. Tokenize will throw syntax errors (ex: IndentationError)
+    # part way through a script, so any error discards the partial output just like the up-front token list did
     try:
-        token_list = [x for x in tokenize.generate_tokens(io_obj.readline)]
-    except Exception as e:
-        # logger.info("%s in %s; continuing" % (e.__class__.__name__, script_id))
-        return "",""
-
-    for tok in token_list:
-        token_type = tok[0]
-        token_string = tok[1]
-        start_line, start_col = tok[2]
-        end_line, end_col = tok[3]
-        ltext = tok[4]
-        inside_operator = False
-        # The following two conditionals preserve indentation.
-        # This is necessary because we're not using tokenize.untokenize()
-        # (because it spits out code with copious amounts of oddly-placed
-        # whitespace).
-        if start_line > last_lineno:
-            last_col = 0
-        if start_col > last_col:
-            code += (" " * (start_col - last_col))
-        # Add to comments
-        if token_type == tokenize.COMMENT:
-            comments += token_string
-        # This series of conditionals identifies docstrings:
-        elif token_type == tokenize.STRING:
-            if prev_toktype != tokenize.INDENT:
-                # This is likely a docstring; double-check we're not inside an operator:
-                if prev_toktype != tokenize.NEWLINE:
-                    # Note regarding NEWLINE vs NL: The tokenize module
-                    # differentiates between newlines that start a new statement
-                    # and newlines inside of operators such as parens, brackes,
-                    # and curly braces.  Newlines inside of operators are
-                    # NEWLINE and newlines that start new code are NL.
-                    # Catch whole-module docstrings:
-                    if start_col > 0:
-                        # Unlabelled indentation means we're inside an operator
-                        code += token_string
-                        inside_operator = True
-                    # Note regarding the INDENT token: The tokenize module does
-                    # not label indentation inside of an operator (parens,
-                    # brackets, and curly braces) as actual indentation.
-                    # For example:
-                    # def foo():
-                    #     "The spaces before this docstring are tokenize.INDENT"
-                    #     test = [
-                    #         "The spaces before this string do not get a token"
-                    #     ]
+        for tok in tokenize.generate_tokens(io_obj.readline):
+            token_type = tok[0]
+            token_string = tok[1]
+            start_line, start_col = tok[2]
+            end_line, end_col = tok[3]
+            inside_operator = False
+            # The following two conditionals preserve indentation.
+            # This is necessary because we're not using tokenize.untokenize()
+            # (because it spits out code with copious amounts of oddly-placed
+            # whitespace).
+            if start_line > last_lineno:
+                last_col = 0
+            if start_col > last_col:
+                code.append(" " * (start_col - last_col))
+            # Add to comments
+            if token_type == tokenize.COMMENT:
+                comments.append(token_string)
+            # This series of conditionals identifies docstrings:
+            elif token_type == tokenize.STRING:
+                if prev_toktype != tokenize.INDENT:
+                    # This is likely a docstring; double-check we're not inside an operator:
+                    if prev_toktype != tokenize.NEWLINE:
+                        # Note regarding NEWLINE vs NL: The tokenize module
+                        # differentiates between newlines that start a new statement
+                        # and newlines inside of operators such as parens, brackes,
+                        # and curly braces.  Newlines inside of operators are
+                        # NEWLINE and newlines that start new code are NL.
+                        # Catch whole-module docstrings:
+                        if start_col > 0:
+                            # Unlabelled indentation means we're inside an operator
+                            code.append(token_string)
+                            inside_operator = True
+                        # Note regarding the INDENT token: The tokenize module does
+                        # not label indentation inside of an operator (parens,
+                        # brackets, and curly braces) as actual indentation.
+                        # For example:
+                        # def foo():
+                        #     "The spaces before this docstring are tokenize.INDENT"
+                        #     test = [
+                        #         "The spaces before this string do not get a token"
+                        #     ]
 
-            # If this isn't inside an operator then it's a docstring comment
-            if not inside_operator:
-                comments += token_string
+                # If this isn't inside an operator then it's a docstring comment
+                if not inside_operator:
+                    comments.append(token_string)
 
-        else:
-            code += token_string
+            else:
+                code.append(token_string)
 
-        prev_toktype = token_type
-        last_col = end_col
-        last_lineno = end_line
-
-    return code,comments
+            prev_toktype = token_type
+            last_col = end_col
+            last_lineno = end_line
+    except Exception as e:
+        # logger.info("%s in %s; continuing" % (e.__class__.__name__, script_id))
+        return "",""
 
+    return "".join(code),"".join(comments)
@@ -0,0 +1,167 @@
+import os
+import pickle
+import shutil
+from array import array
+
+import numpy
+from gensim.models.doc2vec import TaggedDocument
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# Shard formats written by write_shards: a pickled list of TaggedDocument, or a columnar shard folder
+SHARD_FORMATS = ["columnar", "pickle"]
+
+class ColumnarShard:
+    '''
+    Compact, memory-mappable shard of tagged documents, stored as a folder of:
+        tokens.npy:  int32 index in vocab.txt of every token of every document, documents concatenated
+        offsets.npy: int64 start of every document in tokens.npy, plus the total token count
+        tags.npy:    int64 tag of every document
+        vocab.txt:   the distinct words of the shard, one per line
+    Loading maps the arrays instead of rebuilding every token string, and documents are decoded lazily
+    '''
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        self.tokens = numpy.load(os.path.join(shard_path, "tokens.npy"), mmap_mode="r")
+        self.offsets = numpy.load(os.path.join(shard_path, "offsets.npy"), mmap_mode="r")
+        self.tags = numpy.load(os.path.join(shard_path, "tags.npy"), mmap_mode="r")
+        with open(os.path.join(shard_path, "vocab.txt"), "r", encoding="utf-8", newline="") as f:
+            words = f.read().split("\n")
+        # Object array so a document's token indices are turned into words with one fancy-indexing call
+        self.vocab = numpy.empty(len(words), dtype=object)
+        self.vocab[:] = words
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, index):
+        tokens = self.tokens[self.offsets[index]:self.offsets[index + 1]]
+        return TaggedDocument(self.vocab[tokens].tolist(), [int(self.tags[index])])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @staticmethod
+    def write(doc2vec_tagged_documents, shard_path):
+        '''
+        Writes tagged documents with a single integer tag each (as built by the build scripts) as a columnar shard
+        '''
+        vocab = {}
+        tokens = array('i')
+        offsets = array('q', [0])
+        tags = array('q')
+        for tagged_document in doc2vec_tagged_documents:
+            if len(tagged_document.tags) != 1:
+                raise ValueError("Columnar shards store exactly one integer tag per document")
+            tokens.extend(vocab.setdefault(word, len(vocab)) for word in tagged_document.words)
+            offsets.append(len(tokens))
+            tags.append(tagged_document.tags[0])
+
+        # Write to a temporary folder and rename so a shard is never read half written
+        temp_path = shard_path + ".tmp"
+        if not os.path.exists(temp_path):
+            os.makedirs(temp_path)
+        numpy.save(os.path.join(temp_path, "tokens.npy"), numpy.frombuffer(tokens, dtype=numpy.int32) if tokens else numpy.empty(0, dtype=numpy.int32))
+        numpy.save(os.path.join(temp_path, "offsets.npy"), numpy.frombuffer(offsets, dtype=numpy.int64))
+        numpy.save(os.path.join(temp_path, "tags.npy"), numpy.frombuffer(tags, dtype=numpy.int64) if tags else numpy.empty(0, dtype=numpy.int64))
+        # Normalized words never contain whitespace, so a newline-joined vocabulary round-trips exactly
+        with open(os.path.join(temp_path, "vocab.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write("\n".join(sorted(vocab, key=vocab.get)))
+        if os.path.exists(shard_path):
+            shutil.rmtree(shard_path)
+        os.rename(temp_path, shard_path)
+
+def load_shard(shard_path):
+    '''
+    Loads the tagged documents of one training shard: a columnar shard folder or a pickled list of TaggedDocument
+    Output: ColumnarShard or list of TaggedDocument
+    '''
+    if os.path.isdir(shard_path):
+        return ColumnarShard(shard_path)
+    with open(shard_path, "rb") as f:
+        return pickle.load(f)
+
+def write_shard(doc2vec_tagged_documents, shard_path, shard_format="columnar"):
+    if shard_format == "columnar":
+        ColumnarShard.write(doc2vec_tagged_documents, shard_path)
+    else:
+        with open(shard_path, "wb") as f:
+            pickle.dump(doc2vec_tagged_documents, f)
+
+def write_shards(doc2vec_tagged_documents, output_folder, max_per_shard=50000, shard_format="columnar", prefix="training"):
+    '''
+    Writes a stream of tagged documents to shards of at most max_per_shard documents, holding one shard in memory
+    Shards are named <prefix><number of documents written so far> (with a .pkl extension for pickle shards)
+    Output: shard_paths (list of the written shards, in stream order)
+    '''
+    if shard_format not in SHARD_FORMATS:
+        raise ValueError("shard_format must be one of %s" % ", ".join(SHARD_FORMATS))
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    extension = ".pkl" if shard_format == "pickle" else ""
+    shard_paths = []
+    shard = []
+    counter = 0
+    for tagged_document in doc2vec_tagged_documents:
+        shard.append(tagged_document)
+        counter += 1
+        if len(shard) >= max_per_shard:
+            shard_paths.append(os.path.join(output_folder, "%s%d%s" % (prefix, counter, extension)))
+            logger.info("Saving %s shard of %d tagged documents" % (shard_format, len(shard)))
+            write_shard(shard, shard_paths[-1], shard_format)
+            shard = []
+    if shard:
+        shard_paths.append(os.path.join(output_folder, "%s%d%s" % (prefix, counter, extension)))
+        logger.info("Saving final %s shard of %d tagged documents" % (shard_format, len(shard)))
+        write_shard(shard, shard_paths[-1], shard_format)
+    return shard_paths
+
+class ShardedTaggedCorpus:
+    '''
+    Restartable iterable over tagged documents stored in on-disk shards (columnar or pickle), for training gensim
+    models without holding the corpus in memory: only one shard plus the shuffle buffer is loaded at any time.
+    Every iteration (gensim iterates once to build the vocabulary and once per training pass) is a new epoch. With
+    shuffle=True each epoch visits the shards in a new random order and passes documents through a buffer of
+    buffer_size documents from which they are drawn at random, which mixes documents within and across neighbouring
+    shards without materializing the whole corpus. The order of every epoch only depends on seed and the epoch number.
+    '''
+    def __init__(self, shard_paths, shuffle=False, buffer_size=10000, seed=0):
+        self.shard_paths = list(shard_paths)
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    @classmethod
+    def from_folder(cls, shard_folder, **kwargs):
+        '''
+        Corpus over every shard of a folder, in sorted order
+        Skips the .tmp folders an interrupted write_shards leaves behind, which may be half written
+        '''
+        shards = [shard for shard in sorted(os.listdir(shard_folder)) if not shard.endswith(".tmp")]
+        return cls([os.path.join(shard_folder, shard) for shard in shards], **kwargs)
+
+    def __iter__(self):
+        random_state = numpy.random.RandomState([self.seed, self.epoch])
+        self.epoch += 1
+        if not self.shuffle:
+            for shard_path in self.shard_paths:
+                for tagged_document in load_shard(shard_path):
+                    yield tagged_document
+            return
+
+        buffer = []
+        for shard_index in random_state.permutation(len(self.shard_paths)):
+            for tagged_document in load_shard(self.shard_paths[shard_index]):
+                if len(buffer) < self.buffer_size:
+                    buffer.append(tagged_document)
+                    continue
+                # Emit a random buffered document and keep the new one in its place
+                position = random_state.randint(len(buffer))
+                yield buffer[position]
+                buffer[position] = tagged_document
+        for position in random_state.permutation(len(buffer)):
+            yield buffer[position]
@@ -0,0 +1,161 @@
+import numpy
+from scipy.sparse import issparse
+from sklearn.preprocessing import normalize
+
+def normalize_features(features):
+    '''
+    L2-normalizes every row of a feature matrix once so cosine similarity reduces to a dot product
+    Args:
+        features: Sparse matrix, ndarray or list of 1d arrays (one row per document)
+    Returns:
+        normalized: CSR matrix for sparse input, otherwise a 2d ndarray. Rows that are all zeros stay all zeros,
+        which matches sklearn's cosine_similarity
+    '''
+    if issparse(features):
+        return normalize(features.tocsr(), norm="l2", axis=1)
+    return normalize(numpy.asarray(features), norm="l2", axis=1)
+
+def top_k_indices(sims, k):
+    '''
+    Selects the k largest columns of every row in a block of similarity scores
+    Ordering is by descending similarity; ties are broken toward the higher column index, which is the order
+    a stable argsort followed by [::-1] produces
+    Args:
+        sims: 2d ndarray of similarity scores (block rows x all documents)
+        k: number of columns to keep per row
+    Returns:
+        top: 2d ndarray (block rows x k) of column indices
+    '''
+    n_rows, n_cols = sims.shape
+    k = min(k, n_cols)
+    rows = numpy.arange(n_rows)[:, None]
+    if k < n_cols:
+        candidates = numpy.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        candidates = numpy.tile(numpy.arange(n_cols), (n_rows, 1))
+    candidate_sims = sims[rows, candidates]
+
+    # argpartition picks arbitrarily among values tied with the k-th largest; redo those rows so the
+    # selection follows the same tie-break as the ordering below
+    if k < n_cols:
+        kth_sims = candidate_sims.min(axis=1)
+        tied_total = (sims == kth_sims[:, None]).sum(axis=1)
+        tied_selected = (candidate_sims == kth_sims[:, None]).sum(axis=1)
+        for row in numpy.flatnonzero(tied_total != tied_selected):
+            above = numpy.flatnonzero(sims[row] > kth_sims[row])
+            tied = numpy.flatnonzero(sims[row] == kth_sims[row])[-tied_selected[row]:]
+            candidates[row] = numpy.concatenate((above, tied))
+        candidate_sims = sims[rows, candidates]
+
+    order = numpy.lexsort((-candidates, -candidate_sims), axis=1)
+    return candidates[rows, order]
+
+def sparse_top_k_indices(sims, k):
+    '''
+    Sparse counterpart of top_k_indices for a CSR block of similarity scores
+    Only the stored entries of each row are examined, so work and memory stay proportional to nnz. Columns that
+    are not stored have a similarity of 0; the highest-indexed of them are added as candidates so the result
+    (including the tie-break toward higher indices) is identical to running top_k_indices on sims.toarray()
+    Args:
+        sims: CSR matrix of similarity scores (block rows x all documents)
+        k: number of columns to keep per row
+    Returns:
+        top: 2d ndarray (block rows x k) of column indices
+    '''
+    n_rows, n_cols = sims.shape
+    k = min(k, n_cols)
+    sims = sims.tocsr()
+    sims.sum_duplicates()
+    row_nnz = numpy.diff(sims.indptr)
+    stored_rows = numpy.repeat(numpy.arange(n_rows), row_nnz)
+    stored_cols = sims.indices.astype(numpy.intp)
+
+    # The k highest column indices without a stored entry (implicit zeros) are among the k + nnz highest columns
+    # of the row: list those windows for every row at once, in descending column order, and drop stored columns
+    window_sizes = numpy.minimum(row_nnz + k, n_cols)
+    window_rows = numpy.repeat(numpy.arange(n_rows), window_sizes)
+    window_starts = numpy.cumsum(window_sizes) - window_sizes
+    window_cols = n_cols - 1 - (numpy.arange(window_sizes.sum()) - numpy.repeat(window_starts, window_sizes))
+    # sum_duplicates leaves the stored columns sorted within each row, so the stored (row, column) keys are sorted
+    stored_keys = stored_rows * n_cols + stored_cols
+    window_keys = window_rows * n_cols + window_cols
+    positions = numpy.minimum(numpy.searchsorted(stored_keys, window_keys), max(len(stored_keys) - 1, 0))
+    implicit = stored_keys[positions] != window_keys if len(stored_keys) else numpy.ones(len(window_keys), dtype=bool)
+    zero_rows = window_rows[implicit]
+    zero_cols = window_cols[implicit]
+    # Keep the first (highest) k implicit zeros of each row
+    zero_counts = numpy.bincount(zero_rows, minlength=n_rows)
+    zero_rank = numpy.arange(len(zero_rows)) - numpy.repeat(numpy.cumsum(zero_counts) - zero_counts, zero_counts)
+    keep = zero_rank < k
+    zero_rows, zero_cols, zero_rank = zero_rows[keep], zero_cols[keep], zero_rank[keep]
+
+    # Lay the candidates of each row out side by side (stored entries, then implicit zeros, padded with -inf) so
+    # the k best of every row are selected with one argpartition over the block
+    width = max(int((row_nnz + numpy.minimum(k, n_cols - row_nnz)).max()), k) if n_rows else k
+    candidate_sims = numpy.full((n_rows, width), -numpy.inf)
+    candidate_cols = numpy.full((n_rows, width), -1, dtype=numpy.intp)
+    stored_positions = numpy.arange(len(stored_rows)) - numpy.repeat(sims.indptr[:-1], row_nnz)
+    candidate_sims[stored_rows, stored_positions] = sims.data
+    candidate_cols[stored_rows, stored_positions] = stored_cols
+    candidate_sims[zero_rows, row_nnz[zero_rows] + zero_rank] = 0
+    candidate_cols[zero_rows, row_nnz[zero_rows] + zero_rank] = zero_cols
+    return _top_k_candidates(candidate_sims, candidate_cols, k)
+
+def _top_k_candidates(candidate_sims, candidate_cols, k):
+    # top_k_indices over rows of candidates whose column indices are given by candidate_cols instead of positions
+    n_rows, width = candidate_sims.shape
+    rows = numpy.arange(n_rows)[:, None]
+    if k < width:
+        selected = numpy.argpartition(-candidate_sims, k - 1, axis=1)[:, :k]
+        selected_sims = candidate_sims[rows, selected]
+        # Among candidates tied with the k-th largest, keep the highest columns as top_k_indices does
+        kth_sims = selected_sims.min(axis=1)
+        tied_total = (candidate_sims == kth_sims[:, None]).sum(axis=1)
+        tied_selected = (selected_sims == kth_sims[:, None]).sum(axis=1)
+        for row in numpy.flatnonzero(tied_total != tied_selected):
+            above = numpy.flatnonzero(candidate_sims[row] > kth_sims[row])
+            tied = numpy.flatnonzero(candidate_sims[row] == kth_sims[row])
+            tied = tied[numpy.argsort(candidate_cols[row, tied])][-tied_selected[row]:]
+            selected[row] = numpy.concatenate((above, tied))
+    else:
+        selected = numpy.tile(numpy.arange(width), (n_rows, 1))
+    selected_sims = candidate_sims[rows, selected]
+    selected_cols = candidate_cols[rows, selected]
+    order = numpy.lexsort((-selected_cols, -selected_sims), axis=1)
+    return selected_cols[rows, order]
+
+def top_n_similar(features, top_n, start=0, stop=None, block_size=128, normalized=False, features_t=None):
+    '''
+    Finds the top_n+1 most cosine-similar documents for a range of rows without building the full N x N matrix
+    Rows are processed in blocks: each block is multiplied against the whole (normalized) matrix as a single
+    matrix product and the top candidates are chosen with argpartition instead of a full sort
+    Sparse features stay sparse: the block product is sparse x sparse-transpose and only its stored entries are
+    ranked, so memory is proportional to nnz instead of documents x vocabulary
+    Args:
+        features: Sparse matrix or dense array with one row per document
+        top_n: N for Top N scoring; top_n+1 candidates are returned so the query document itself can be dropped
+        start, stop: Row range to score (defaults to every row)
+        block_size: Number of query rows multiplied per matrix product
+        normalized: Set to True if features were already passed through normalize_features
+        features_t: Transpose of the normalized features as a CSR matrix (ex: shared by share_features), built on
+                    every call when None
+    Returns:
+        Generator of (row_index, candidate_indices) in row order, candidates ordered by descending similarity
+    '''
+    if not normalized:
+        features = normalize_features(features)
+    if stop is None:
+        stop = features.shape[0]
+    # Transpose once; scipy would otherwise convert the CSC transpose back to CSR on every block product
+    if features_t is None:
+        features_t = features.T.tocsr() if issparse(features) else features.T
+
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        sims = features[block_start:block_stop].dot(features_t)
+        if issparse(sims):
+            top = sparse_top_k_indices(sims.tocsr(), top_n + 1)
+        else:
+            top = top_k_indices(numpy.asarray(sims), top_n + 1)
+        for offset, candidates in enumerate(top):
+            yield block_start + offset, candidates
@@ -0,0 +1,115 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy
+import scipy.sparse
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def file_signature(path):
+    '''
+    Identifies the version of a model or vocabulary file by path, size and modification time, so cached vectors
+    are not reused after the file is rebuilt
+    '''
+    if path is None or not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+def vector_nbytes(vector):
+    # Memory held by a cached vector (dense array, sparse matrix or any other picklable result)
+    if isinstance(vector, numpy.ndarray):
+        return vector.nbytes
+    if scipy.sparse.issparse(vector):
+        vector = vector.tocsr()
+        return vector.data.nbytes + vector.indices.nbytes + vector.indptr.nbytes
+    return len(pickle.dumps(vector, pickle.HIGHEST_PROTOCOL))
+
+class VectorCache:
+    '''
+    Two-tier cache of vectors: an in-memory LRU bounded by the total size of the cached vectors in bytes and an
+    optional on-disk tier (one pickle per key spread over 256 sub-folders, as PreprocessCache stores entries).
+    Disk hits are promoted to memory. Hit and miss counters are exposed through stats().
+    '''
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_folder=None):
+        self.max_bytes = max_bytes
+        self.cache_folder = cache_folder
+        if cache_folder and not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts):
+        hasher = hashlib.sha1()
+        for part in parts:
+            hasher.update(part.encode("utf-8", "surrogatepass"))
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    def get(self, key):
+        '''
+        Returns the cached vector for key, or None on a miss. Cached vectors are shared, so callers must not modify them
+        '''
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return self.entries[key][0]
+        if self.cache_folder:
+            vector = self._read(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+        self.misses += 1
+        return None
+
+    def put(self, key, vector):
+        self._remember(key, vector)
+        if self.cache_folder:
+            self._write(key, vector)
+
+    def stats(self):
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "entries": len(self.entries), "bytes": self.nbytes}
+
+    def _remember(self, key, vector):
+        nbytes = vector_nbytes(vector)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (vector, nbytes)
+        self.nbytes += nbytes
+        # Evict the least recently used vectors until the cache fits its size bound again
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, key[:2], key)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write(self, key, vector):
+        # Write to a temporary file and rename so concurrent readers never see a partial entry
+        folder = os.path.dirname(self._path(key))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(vector, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path(key))
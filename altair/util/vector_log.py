@@ -0,0 +1,144 @@
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# File header: magic and format version
+LOG_MAGIC = b"AVLOG\x00"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<6sH")
+
+# Record header: url length in bytes, vector length in float32 values, CRC32 of the url and vector bytes
+RECORD_HEADER = struct.Struct("<III")
+
+def encode_record(url, vector):
+    url_bytes = url.encode("utf-8")
+    vector_bytes = numpy.ascontiguousarray(vector, dtype="<f4").tobytes()
+    payload = url_bytes + vector_bytes
+    return RECORD_HEADER.pack(len(url_bytes), len(vector_bytes) // 4, zlib.crc32(payload) & 0xffffffff) + payload
+
+def read_records(f):
+    '''
+    Reads the records following the file header
+    Returns:
+        Generator of (url, vector, end offset of the record); stops at the first incomplete or corrupt record
+    '''
+    offset = f.tell()
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        url_length, vector_length, crc = RECORD_HEADER.unpack(header)
+        payload_length = url_length + 4 * vector_length
+        payload = f.read(payload_length)
+        if len(payload) < payload_length or zlib.crc32(payload) & 0xffffffff != crc:
+            return
+        offset += RECORD_HEADER.size + payload_length
+        url = payload[:url_length].decode("utf-8")
+        vector = numpy.frombuffer(payload[url_length:], dtype="<f4").astype(numpy.float32)
+        yield url, vector, offset
+
+class VectorLog:
+    '''
+    Append-only checkpoint log of (url, float32 vector) records. Each append writes and fsyncs one batch, so
+    checkpoint cost is proportional to the batch and a crash loses at most the batch being written. Every record
+    carries a CRC32: a torn or corrupt tail left by a crash is detected and truncated when the log is opened.
+    Records of a url appended again supersede the earlier ones; compact() rewrites the log with one record per url,
+    and append() compacts automatically once superseded records exceed compact_ratio of the live ones.
+    '''
+    def __init__(self, path, compact_ratio=0.5):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.urls = set()
+        self.record_count = 0
+        self.vectors = self._recover()
+        self.f = open(self.path, "ab")
+
+    def _recover(self):
+        # Load the records of an existing log and truncate whatever follows the last valid one
+        vectors = OrderedDict()
+        # A log shorter than its header was never written past creation
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < LOG_HEADER.size:
+            with open(self.path, "wb") as f:
+                f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+            return vectors
+
+        with open(self.path, "r+b") as f:
+            magic, version = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+            if magic != LOG_MAGIC or version != LOG_VERSION:
+                raise ValueError("%s is not a version %d vector log" % (self.path, LOG_VERSION))
+            valid_end = LOG_HEADER.size
+            for url, vector, valid_end in read_records(f):
+                vectors[url] = vector
+                self.record_count += 1
+            file_size = os.path.getsize(self.path)
+            if valid_end < file_size:
+                logger.warning("Truncating %d bytes of incomplete records at the end of %s" % (file_size - valid_end, self.path))
+                f.truncate(valid_end)
+        self.urls = set(vectors)
+        return vectors
+
+    def read(self):
+        '''
+        Returns the vectors found in the log when it was opened (OrderedDict of url -> float32 vector, latest record
+        of each url). Records appended since are not included.
+        '''
+        return self.vectors
+
+    def append(self, items):
+        '''
+        Appends a batch of records and forces them to disk
+        Args:
+            items (iterable of (str, numpy array)): urls and their vectors
+        '''
+        records = []
+        for url, vector in items:
+            records.append(encode_record(url, vector))
+            self.urls.add(url)
+        if not records:
+            return
+        self.f.write(b"".join(records))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.record_count += len(records)
+        if self.record_count - len(self.urls) > self.compact_ratio * len(self.urls):
+            self.compact()
+
+    def compact(self):
+        '''
+        Rewrites the log with only the latest record of each url. The compacted log is written to a temporary file
+        and renamed over the log, so a crash during compaction leaves the previous log intact.
+        '''
+        self.f.close()
+        latest = OrderedDict()
+        with open(self.path, "rb") as f:
+            f.seek(LOG_HEADER.size)
+            for url, vector, _ in read_records(f):
+                latest[url] = vector
+
+        temp_path = self.path + ".compact"
+        with open(temp_path, "wb") as f:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+            for url, vector in latest.items():
+                f.write(encode_record(url, vector))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logger.info("Compacted %s from %d to %d records" % (self.path, self.record_count, len(latest)))
+        self.record_count = len(latest)
+        self.f = open(self.path, "ab")
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
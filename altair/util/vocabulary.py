@@ -0,0 +1,90 @@
+import heapq
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def top_vocabulary(counts, max_vocab_size, min_count):
+    '''
+    Selects the most frequent words of a corpus with a heap instead of sorting every counted word
+    Args:
+        counts: mapping (or object with items()) of word to count
+        max_vocab_size (int): the maximum number of words to return
+        min_count (int): only words counted more than min_count times are returned
+    Returns:
+        words (list): up to max_vocab_size words, ordered by descending (count, word) like
+        sorted(counts.items(), key=lambda x: (x[1], x[0]), reverse=True)
+    '''
+    frequent = ((word, count) for word, count in counts.items() if count > min_count)
+    return [word for word, count in heapq.nlargest(max_vocab_size, frequent, key=lambda x: (x[1], x[0]))]
+
+class SpaceSavingCounter:
+    '''
+    Bounded-memory approximate counter (Space-Saving, Metwally et al. 2005) with the update() interface of
+    collections.Counter, for vocabularies that do not fit in memory when every distinct word is counted.
+    At most capacity words are tracked. A new word evicts the word with the lowest count and inherits that count
+    plus one, so counts are upper bounds that overestimate by at most the smallest tracked count (see min_count()).
+    Within one stream every word occurring more than total / capacity times is guaranteed to be tracked; merging
+    summaries of several streams keeps that property approximately. With a capacity well above max_vocab_size the
+    most frequent words and their order match exact counting.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # Min-heap holding one (count, word) entry per tracked word; entries can lag behind counts and are refreshed
+        # lazily when they reach the top, so increments of tracked words stay a single dict update
+        self.heap = []
+
+    def update(self, items):
+        '''
+        Counts an iterable of words, or merges another SpaceSavingCounter or mapping of word to count
+        '''
+        if isinstance(items, SpaceSavingCounter):
+            items = items.counts
+        if hasattr(items, "items"):
+            self._merge(items)
+            return
+        counts = self.counts
+        for word in items:
+            if word in counts:
+                counts[word] += 1
+            elif len(counts) < self.capacity:
+                counts[word] = 1
+                heapq.heappush(self.heap, (1, word))
+            else:
+                min_count, min_word = self._pop_min()
+                del counts[min_word]
+                counts[word] = min_count + 1
+                heapq.heappush(self.heap, (min_count + 1, word))
+
+    def _pop_min(self):
+        while True:
+            count, word = heapq.heappop(self.heap)
+            if self.counts[word] == count:
+                return count, word
+            heapq.heappush(self.heap, (self.counts[word], word))
+
+    def _merge(self, other_counts):
+        # Merged counts are the sums of both summaries, trimmed back to the capacity most frequent words
+        counts = dict(self.counts)
+        for word, count in other_counts.items():
+            counts[word] = counts.get(word, 0) + count
+        if len(counts) > self.capacity:
+            counts = dict(heapq.nlargest(self.capacity, counts.items(), key=lambda x: (x[1], x[0])))
+        self.counts = counts
+        self.heap = [(count, word) for word, count in counts.items()]
+        heapq.heapify(self.heap)
+
+    def min_count(self):
+        '''
+        Smallest tracked count (0 while fewer than capacity words are tracked), the maximum overestimation of a count
+        '''
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def items(self):
+        return self.counts.items()
+
+    def __len__(self):
+        return len(self.counts)
@@ -1,15 +1,15 @@
 import os
-import json
 import pickle
-from collections import defaultdict
+from functools import partial
 
-from altair.util.separate_code_and_comments import separate_code_and_comments
-from altair.util.normalize_text import normalize_text
+from altair.util.corpus_reader import count_corpus, script_tokens
+from altair.util.vocabulary import top_vocabulary, SpaceSavingCounter
+from altair.util.preprocess_cache import CACHE_FOLDER_ENV
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
 
-def build_bow_script_vocabulary(script_folder, max_script_count=10000, max_vocab_size=5000, min_word_count=2):
+def build_bow_script_vocabulary(script_folder, max_script_count=10000, max_vocab_size=5000, min_word_count=2, cache_folder=None, num_workers=1, approximate_counter_size=0):
     '''
     Generates a dictionary of words to be used as the vocabulary in techniques that utilize bag of words.
     Args:
@@ -17,43 +17,35 @@ def build_bow_script_vocabulary(script_folder, max_script_count=10000, max_vocab
         max_script_count (int): the maximum number of code scripts to process in the script_folder
         max_vocab_size (int): the maximum number of words to be used in the vocabulary (dimension of bag of words vector)
         min_word_count (int): a word will be included in vocabulary if it appears at least min_count times in the corpus
+        cache_folder (str): folder of the preprocessing cache (None disables caching)
+        num_workers (int): number of processes used to read and preprocess the corpus, each counting its own files
+        approximate_counter_size (int): if > 0, count with a SpaceSavingCounter tracking at most this many words
     Returns:
         words_ordered_by_count (list): a list of size equal or less than vocab_size that contains the most frequent
         normalized words in the corpus
     '''
-    word_count = defaultdict(int)
-    counter = 0
-
-    # Read file contents, extract code, normalize contents and count resulting tokens
-    # Altair's JSON format uses the 'content' label for the script code
-    for py_file in sorted(os.listdir(script_folder)):
-        if counter >= max_script_count: break
-        fullpath = os.path.join(script_folder, py_file)
-        with open(fullpath, "r") as py_file_contents:
-            for line in py_file_contents:
-                counter += 1
-                parsed_json = json.loads(line)
-                code, comments = separate_code_and_comments(parsed_json['content'],py_file)
-                normalized_script = normalize_text(code, remove_stop_words=True, only_letters=False, return_list=True, remove_one_char_words=True)
-                for token in normalized_script: word_count[token] += 1
-                if counter >= max_script_count: break
+    # Read file contents, extract code, normalize contents and count resulting tokens; workers count their own
+    # files and only the partial counts are merged
+    process = partial(script_tokens, cache_folder=cache_folder, remove_stop_words=True, only_letters=False, remove_one_char_words=True)
+    if approximate_counter_size > 0:
+        word_count, _ = count_corpus(script_folder, process, max_script_count, num_workers, partial(SpaceSavingCounter, approximate_counter_size))
+        logger.info("Approximate word counts overestimate by at most %d" % word_count.min_count())
+    else:
+        word_count, _ = count_corpus(script_folder, process, max_script_count, num_workers)
 
     # Determine descending order for library based on count and restricted by min_count threshold
-    words_ordered_by_count = [i[0] for i in sorted(word_count.items(), key=lambda x: (x[1], x[0]), reverse=True) if
-                              i[1] > min_word_count]
+    words_ordered_by_count = top_vocabulary(word_count, max_vocab_size, min_word_count)
 
-    # Trim the vocabulary to the requested vocab_size
-    if len(words_ordered_by_count) >= max_vocab_size:
-        words_ordered_by_count = words_ordered_by_count[:max_vocab_size]
-    else:
+    # The vocabulary is already trimmed to the requested vocab_size
+    if len(words_ordered_by_count) < max_vocab_size:
         logger.warning("Only %d words were observed using max_script_count=%d, max_vocab_size=%d and min_word_count=%d" % \
                        (len(words_ordered_by_count),max_script_count, max_vocab_size,min_word_count))
 
     return words_ordered_by_count
 
-def main(script_folder,vocab_pickle_filename,max_script_count,max_vocab_size,min_word_count):
+def main(script_folder,vocab_pickle_filename,max_script_count,max_vocab_size,min_word_count,cache_folder=None,num_workers=1,approximate_counter_size=0):
 
-    bow_script_vocabulary = build_bow_script_vocabulary(script_folder, max_script_count, max_vocab_size, min_word_count)
+    bow_script_vocabulary = build_bow_script_vocabulary(script_folder, max_script_count, max_vocab_size, min_word_count, cache_folder, num_workers, approximate_counter_size)
 
     #logger.info("Saving bag of words vocabulary pickle file at %s" % vocab_pickle_filename)
     pickle.dump(bow_script_vocabulary, open(vocab_pickle_filename, "wb"))
@@ -84,6 +76,18 @@ if __name__ == "__main__":
                     type=int,
                     default=2,
                     help="Minimum times a word is observed in corpus for the word to be included in vocabulary (default = 2)")
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared by the build scripts (default = $%s, disabled if unset)" % CACHE_FOLDER_ENV)
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes used to read and preprocess the corpus (default = 1)")
+    parser.add_argument("--approximate_counter_size",
+                        type=int,
+                        default=0,
+                        help="Count with a bounded-memory approximate counter tracking at most this many words, for corpora whose exact counts do not fit in memory (default = 0, exact counting)")
 
     args = parser.parse_args()
-    main(args.script_folder,args.vocab_pickle_filename,args.max_script_count,args.max_vocab_size,args.min_word_count)
+    main(args.script_folder,args.vocab_pickle_filename,args.max_script_count,args.max_vocab_size,args.min_word_count,args.cache_folder,args.num_workers,args.approximate_counter_size)
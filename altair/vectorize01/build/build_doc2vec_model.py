@@ -2,10 +2,13 @@ from gensim.models import doc2vec
 from random import shuffle
 import pickle
 import os
-import json
+import shutil
+import tempfile
+from functools import partial
 
-from altair.util.separate_code_and_comments import separate_code_and_comments
-from altair.util.normalize_text import normalize_text
+from altair.util.corpus_reader import read_corpus, script_tokens
+from altair.util.tagged_corpus import ShardedTaggedCorpus, write_shards
+from altair.util.preprocess_cache import CACHE_FOLDER_ENV
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
@@ -29,6 +32,9 @@ def build_doc2vec_model(doc2vec_tagged_documents,training_algorithm=2,num_cores=
     iter = number of iterations (epochs) over the corpus. The default inherited from Word2Vec is 5, but values of 10 or 20 are common in published ‘Paragraph Vector’ experiments.
     hs = if 1 (default), hierarchical sampling will be used for model training (else set to 0).
     negative = if > 0, negative sampling will be used, the int for negative specifies how many “noise words” should be drawn (usually between 5-20).
+
+    doc2vec_tagged_documents can be a list, shuffled in place after every epoch, or a re-iterable corpus such as
+    ShardedTaggedCorpus that streams (and shuffles) the documents itself on every pass
     '''
 
     # build Doc2Vec's vocab
@@ -40,35 +46,34 @@ def build_doc2vec_model(doc2vec_tagged_documents,training_algorithm=2,num_cores=
         logger.info("starting code epoch %d" % int(i+1))
         doc2vec_model.train(doc2vec_tagged_documents)
         doc2vec_model.alpha -= 0.002
-        shuffle(doc2vec_tagged_documents)
+        if isinstance(doc2vec_tagged_documents, list):
+            shuffle(doc2vec_tagged_documents)
 
     return doc2vec_model
 
-def main(script_folder, model_pickle_filename, training_algorithm, num_cores, epochs, vector_size, window, min_count, alpha, max_script_count, min_script_len, negative):
+def tagged_documents(script_folder, max_script_count, min_script_len, num_cores, cache_folder=None):
+    # Retrieve Python scripts with at least min_script_len characters of code, preprocessed on num_cores processes
+    process = partial(script_tokens, cache_folder=cache_folder, min_code_len=min_script_len, remove_stop_words=False, only_letters=False, remove_one_char_words=True)
+    for counter, tokenized_code in enumerate(read_corpus(script_folder, process, max_script_count, num_cores)):
+        if counter % 100000 == 0: logger.info("processed %d files" % counter)
+        yield doc2vec.TaggedDocument(tokenized_code, [counter])
 
-    doc2vec_tagged_documents = list()
-    counter = 0
+def main(script_folder, model_pickle_filename, training_algorithm, num_cores, epochs, vector_size, window, min_count, alpha, max_script_count, min_script_len, negative, cache_folder=None, shard_folder=None, max_per_shard=50000, shuffle_buffer=10000):
 
     logger.info("retrieving files")
 
-    # Retrieve files containing Python scripts
-    # Altair's JSON format uses the 'content' label for the script code
-    for py_file in sorted(os.listdir(script_folder)):
-        if counter >= max_script_count: break
-        if counter % 100000 == 0: logger.info("processed %d files" % counter)
-        fullpath = os.path.join(script_folder, py_file)
-        with open(fullpath, "r") as py_file_contents:
-            for line in py_file_contents:
-                parsed_json = json.loads(line)
-                code, comments = separate_code_and_comments(parsed_json['content'],py_file)
-                if len(code) < min_script_len:
-                    continue
-                else:
-                    tokenized_code = normalize_text(code, remove_stop_words=False, only_letters=False, return_list=True, remove_one_char_words=True)
-                    doc2vec_tagged_documents.append(doc2vec.TaggedDocument(tokenized_code, [counter]))
-                    counter += 1
-
-    doc2vec_model = build_doc2vec_model(doc2vec_tagged_documents,training_algorithm,num_cores,epochs,vector_size,window,min_count,alpha,negative)
+    # Spill the tokenized scripts to on-disk shards so training streams them instead of holding every document
+    # in memory; the shards are deleted afterwards unless a shard_folder is given
+    temp_folder = None
+    if not shard_folder:
+        shard_folder = temp_folder = tempfile.mkdtemp(prefix="doc2vec_shards_")
+    try:
+        shard_paths = write_shards(tagged_documents(script_folder, max_script_count, min_script_len, num_cores, cache_folder), shard_folder, max_per_shard)
+        doc2vec_corpus = ShardedTaggedCorpus(shard_paths, shuffle=True, buffer_size=shuffle_buffer)
+        doc2vec_model = build_doc2vec_model(doc2vec_corpus,training_algorithm,num_cores,epochs,vector_size,window,min_count,alpha,negative)
+    finally:
+        if temp_folder:
+            shutil.rmtree(temp_folder)
 
     # Per http://radimrehurek.com/gensim/models/doc2vec.html, delete_temporary_training_data reduces model size
     # If keep_doctags_vectors is set to false, most_similar, similarity, sims is no longer available
@@ -148,5 +153,24 @@ if __name__ == "__main__":
                        default=0,
                        help="Specify number of noise words used for negative sampling (default = 0)")
 
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared by the build scripts (default = $%s, disabled if unset)" % CACHE_FOLDER_ENV)
+
+    parser.add_argument("--shard_folder",
+                        type=str,
+                        help="Folder to keep the tokenized training shards in (default = temporary folder deleted after training)")
+
+    parser.add_argument("--max_per_shard",
+                        type=int,
+                        default=50000,
+                        help="Maximum number of scripts per training shard (default = 50000)")
+
+    parser.add_argument("--shuffle_buffer",
+                        type=int,
+                        default=10000,
+                        help="Number of documents buffered to shuffle the training order within each epoch (default = 10000)")
+
     args = parser.parse_args()
-    main(args.script_folder, args.model_pickle_filename, args.training_algorithm, args.num_cores, args.epochs, args.vector_size, args.window, args.min_count, args.alpha, args.max_script_count, args.min_script_len, args.negative)
+    main(args.script_folder, args.model_pickle_filename, args.training_algorithm, args.num_cores, args.epochs, args.vector_size, args.window, args.min_count, args.alpha, args.max_script_count, args.min_script_len, args.negative, args.cache_folder, args.shard_folder, args.max_per_shard, args.shuffle_buffer)
@@ -18,34 +18,32 @@ negative = if > 0, negative sampling will be used, the int for negative specifie
 '''
 
 from gensim.models import doc2vec
-from random import shuffle
 import pickle
-import os
 import time
 
-from log import getLogger
+from altair.util.tagged_corpus import ShardedTaggedCorpus
+from altair.util.log import getLogger
 logger = getLogger(__name__)
 
-def main(trainingset_folder, model_pickle_filename, training_algorithm, num_cores, epochs, vector_size, window, min_count, alpha, negative):
+def main(trainingset_folder, model_pickle_filename, training_algorithm, num_cores, epochs, vector_size, window, min_count, alpha, negative, shuffle_buffer=10000):
 
     doc2vec_model = doc2vec.Doc2Vec(dm=training_algorithm, size=vector_size, sample=1e-5, window=window, min_count=min_count, iter=20, dbow_words=1, workers=num_cores, alpha=0.05, min_alpha=0.001, negative=negative)
-    doc2vec_tagged_documents = list()
 
-    for trainingset in os.listdir(trainingset_folder):
-        logger.info("starting training set %s" % trainingset)
-        doc2vec_tagged_documents += pickle.load(open(os.path.join(trainingset_folder,trainingset),"rb"))
+    # Stream the training sets from disk one at a time; every pass visits them in a new order and shuffles
+    # documents through a buffer instead of shuffling one list holding the whole corpus
+    doc2vec_tagged_documents = ShardedTaggedCorpus.from_folder(trainingset_folder, shuffle=True, buffer_size=shuffle_buffer)
+    logger.info("streaming %d training sets" % len(doc2vec_tagged_documents.shard_paths))
 
     #doc2vec_model = train_doc2vec_model(doc2vec_model, doc2vec_tagged_documents,epochs)
     # build Doc2Vec's vocab
     logger.info("building vocabulary")
     doc2vec_model.build_vocab(doc2vec_tagged_documents)
 
-    # run training epochs while shuffling data and lowering learning rate (alpha)
+    # run training epochs while lowering learning rate (alpha); the corpus reshuffles itself on every pass
     for i in range(epochs):
         logger.info("starting code epoch %d" % int(i+1))
         doc2vec_model.train(doc2vec_tagged_documents)
         doc2vec_model.alpha -= 0.002
-        shuffle(doc2vec_tagged_documents)
     #logger.info("saving model pickle for %s" % trainingset)
     #pickle.dump(doc2vec_model, open(model_pickle_filename[:-4]+"_"+str(int(time.time()))+os.path.splitext(model_pickle_filename)[1], "wb"))
     #doc2vec_model.alpha = 0.05
@@ -72,7 +70,7 @@ if __name__ == "__main__":
     # Required args
     parser.add_argument("trainingset_folder",
                         type=str,
-                        help="Folder location of Python script file list pickled in TaggedDocument format")
+                        help="Folder location of training sets written by build_doc2vec_trainingset (columnar shards or TaggedDocument pickles)")
 
     parser.add_argument("model_pickle_filename",
                         type=str,
@@ -119,6 +117,11 @@ if __name__ == "__main__":
                        default=0,
                        help="Specify number of noise words used for negative sampling (default = 0)")
 
+    parser.add_argument("--shuffle_buffer",
+                        type=int,
+                        default=10000,
+                        help="Number of documents buffered to shuffle the training order within each epoch (default = 10000)")
+
     args = parser.parse_args()
-    main(args.trainingset_folder, args.model_pickle_filename, args.training_algorithm, args.num_cores, args.epochs, args.vector_size, args.window, args.min_count, args.alpha, args.negative)
+    main(args.trainingset_folder, args.model_pickle_filename, args.training_algorithm, args.num_cores, args.epochs, args.vector_size, args.window, args.min_count, args.alpha, args.negative, args.shuffle_buffer)
 
@@ -1,48 +1,29 @@
 from gensim.models import doc2vec
-import pickle
 import os
-import json
 import time
-from altair.util.separate_code_and_comments import separate_code_and_comments
-from altair.util.normalize_text import normalize_text
+from functools import partial
+from altair.util.corpus_reader import read_corpus, script_tokens
+from altair.util.tagged_corpus import write_shards, SHARD_FORMATS
+from altair.util.preprocess_cache import CACHE_FOLDER_ENV
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
 
-def main(script_folder,output_folder,min_script_len,max_total_files,max_per_pkl):
+def tagged_documents(script_folder,min_script_len,max_total_files,cache_folder=None,num_workers=1):
+    # Retrieve Python scripts with at least min_script_len characters of code and more than one token
+    process = partial(script_tokens, cache_folder=cache_folder, min_code_len=min_script_len, min_tokens=2, remove_stop_words=False, only_letters=False, remove_one_char_words=True)
+    for counter, tokenized_code in enumerate(read_corpus(script_folder, process, max_total_files, num_workers)):
+        if counter!=0 and counter % 50000 == 0: logger.info("processed %d files" % counter)
+        yield doc2vec.TaggedDocument(tokenized_code, [counter])
+
+def main(script_folder,output_folder,min_script_len,max_total_files,max_per_pkl,cache_folder=None,num_workers=1,shard_format="columnar"):
 
-    doc2vec_tagged_documents = list()
-    counter = 0
     logger.info("retrieving files")
-    just_started = True
 
-    # Retrieve files containing Python scripts
-    # Altair's JSON format uses the 'content' label for the script code
-    for py_file in sorted(os.listdir(script_folder)):
-        if counter>= max_total_files: break
-        fullpath = os.path.join(script_folder, py_file)
-        with open(fullpath, "r") as py_file_contents:
-            for line in py_file_contents:
-                if counter >= max_total_files: break
-                if counter!=0 and counter % 50000 == 0: logger.info("processed %d files" % counter)
-                if not just_started and counter % max_per_pkl == 0:
-                    logger.info("Saving pickle file of tagged documents for size %d",max_per_pkl)
-                    pickle.dump(doc2vec_tagged_documents, open(os.path.join(output_folder,"training"+str(counter)+".pkl"), "wb"))
-                    doc2vec_tagged_documents = list()
-                    just_started = True
-                parsed_json = json.loads(line)
-                code, _ = separate_code_and_comments(parsed_json['content'],py_file)
-                if len(code) < min_script_len:
-                    continue
-                else:
-                    tokenized_code = normalize_text(code, remove_stop_words=False, only_letters=False, return_list=True, remove_one_char_words=True)
-                    if len(tokenized_code) > 1:
-                    	doc2vec_tagged_documents.append(doc2vec.TaggedDocument(tokenized_code, [counter]))
-                    	counter += 1
-                    	just_started = False
-        
-    logger.info("Saving final pickle file of tagged documents for size %d",max_per_pkl)            
-    pickle.dump(doc2vec_tagged_documents, open(os.path.join(output_folder,"training"+str(counter)+".pkl"), "wb"))
+    # Training sets are written as columnar shard folders (see ColumnarShard) or as pickled TaggedDocument lists,
+    # both named training<number of scripts so far> and read by build_doc2vec_model_from_training_set
+    documents = tagged_documents(script_folder,min_script_len,max_total_files,cache_folder,num_workers)
+    write_shards(documents, output_folder, max_per_pkl, shard_format)
 
 # Run this when called from CLI
 if __name__ == "__main__":
@@ -66,8 +47,22 @@ if __name__ == "__main__":
                         default=1200000)
     parser.add_argument("max_per_pkl",
                         type=int,
-                        help="Maximum number of Python scripts per saved pickle file",
+                        help="Maximum number of Python scripts per saved training set file",
                         default=300000)
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared by the build scripts (default = $%s, disabled if unset)" % CACHE_FOLDER_ENV)
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes used to read and preprocess the corpus (default = 1)")
+
+    parser.add_argument("--shard_format",
+                        type=str,
+                        choices=SHARD_FORMATS,
+                        default="columnar",
+                        help="Write training sets as memory-mappable columnar shards or as pickled TaggedDocument lists (default = columnar)")
 
     args = parser.parse_args()
-    main(args.script_folder,args.output_folder,args.min_script_len,args.max_total_files,args.max_per_pkl)						
+    main(args.script_folder,args.output_folder,args.min_script_len,args.max_total_files,args.max_per_pkl,args.cache_folder,args.num_workers,args.shard_format)						
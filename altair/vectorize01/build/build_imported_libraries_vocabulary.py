@@ -1,9 +1,9 @@
-from redbaron import RedBaron
-import os
-import json
-from collections import defaultdict
 import pickle
+from functools import partial
 
+from altair.util.corpus_reader import count_corpus
+from altair.util.extract_imports import extract_imports
+from altair.util.vocabulary import top_vocabulary, SpaceSavingCounter
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
@@ -12,6 +12,7 @@ def parse_fromimport_statements(fromimport_node_list, include_import_segment=Fal
     '''
     Function to parse through import statements that begin with 'from' keyword (ex: from xml import parser)
     Note: Only the main library referenced after the from keyword is captured (ex: from xml.parser import tree = xml)
+    Note: extract_imports gives the same result straight from a script without building a RedBaron tree
     Input: fromimport_node_list (RedBaron object containing list of FromImportNode objects)
             include_import_segment (Boolean flag to parse the segment after the 'import' keyword)
      Output: libraries (set of imported libraries identified from the fromimport_node_list)
@@ -44,6 +45,7 @@ def parse_import_statements(import_node_list, include_dotted_segments=False):
     '''
     Function to parse through library import statements (ex: import xml.parser)
     Note: Only the main library referenced after the 'import' keyword is captured (ex: import xml.parser = xml)
+    Note: extract_imports gives the same result straight from a script without building a RedBaron tree
     Input: import_node_list (RedBaron object containing list of ImportNode objects)
             include_dotted_segments (Boolean flag to also parse the dotted segments of a library)
     Output: libraries (set of imported libraries identified from the import_node_list)
@@ -70,7 +72,13 @@ def parse_import_statements(import_node_list, include_dotted_segments=False):
 
     return libraries
 
-def build_imported_libraries_vocabulary(script_folder, max_script_count=10000,vocab_size=500, min_count=2):
+def script_libraries(parsed_json, file_name):
+    '''
+    Process function for read_corpus: set of libraries imported by a script
+    '''
+    return extract_imports(parsed_json['content'])
+
+def build_imported_libraries_vocabulary(script_folder, max_script_count=10000,vocab_size=500, min_count=2, num_workers=1, approximate_counter_size=0):
     '''
     Generates a dictionary of imported library calls to be used as the vocabulary in techniques that utilize bag of words.
     Args:
@@ -78,52 +86,31 @@ def build_imported_libraries_vocabulary(script_folder, max_script_count=10000,vo
         max_script_count (int): the maximum number of code scripts to process in the script_folder
         vocab_size (int): the maximum number of words to be used in the vocabulary (dimension of bag of words vector)
         min_word_count (int): a word will be included in vocabulary if it appears at least min_count times in the corpus
+        num_workers (int): number of processes used to parse the scripts, each counting its own files
+        approximate_counter_size (int): if > 0, count with a SpaceSavingCounter tracking at most this many libraries
     Returns:
         libraries_ordered_by_count (list): a list of size equal or less than max_vocab_size that contains the most frequent
         normalized words in the corpus
     '''
 
-    library_count = defaultdict(int)
-    counter = 0
-
-    # Retrieve files with script content and process with red baron to identify imported libraries
-    # Altair's JSON format uses the 'content' label for the script code
-    for py_file in sorted(os.listdir(script_folder)):
-        if counter >= max_script_count: break
-        fullpath = os.path.join(script_folder, py_file)
-        with open(fullpath, "r") as py_file_contents:
-            for line in py_file_contents:
-                counter += 1
-                parsed_json = json.loads(line)
-
-                try:
-                    red = RedBaron(parsed_json['content'])
-                    libraries = parse_import_statements(red.find_all("ImportNode"))
-                    libraries |= parse_fromimport_statements(red.find_all("FromImportNode"))
-                    for library in libraries: library_count[library] += 1
-
-                except Exception as e:
-                    #logger.info("%s error encountered in %s; skipping file" % (e.__class__.__name__, py_file))
-                    continue
-
-                if counter >= max_script_count: break
-
-    # Determine descending order for library based on count
-    libraries_ordered_by_count = [i[0] for i in sorted(library_count.items(), key=lambda x: (x[1], x[0]), reverse=True) if
-                        i[1] > min_count]
-
-    # Trim the vocabulary to the requested vocab_size
-    if len(libraries_ordered_by_count) >= vocab_size:
-        libraries_ordered_by_count = libraries_ordered_by_count[:vocab_size]
+    # Retrieve files with script content and identify imported libraries
+    if approximate_counter_size > 0:
+        library_count, _ = count_corpus(script_folder, script_libraries, max_script_count, num_workers, partial(SpaceSavingCounter, approximate_counter_size))
     else:
+        library_count, _ = count_corpus(script_folder, script_libraries, max_script_count, num_workers)
+
+    # Determine descending order for library based on count, trimmed to the requested vocab_size
+    libraries_ordered_by_count = top_vocabulary(library_count, vocab_size, min_count)
+
+    if len(libraries_ordered_by_count) < vocab_size:
         logger.warning("Only %d libraries were observed using max_script_count=%d, max_vocab_size=%d and min_word_count=%d" % \
             (len(libraries_ordered_by_count), max_script_count, vocab_size, min_count))
 
     return libraries_ordered_by_count
 
-def main(script_folder,vocab_pickle_filename,max_script_count,max_vocab_size,min_word_count):
+def main(script_folder,vocab_pickle_filename,max_script_count,max_vocab_size,min_word_count,num_workers=1,approximate_counter_size=0):
 
-    imported_libraries_vocabulary = build_imported_libraries_vocabulary(script_folder,max_script_count,max_vocab_size,min_word_count)
+    imported_libraries_vocabulary = build_imported_libraries_vocabulary(script_folder,max_script_count,max_vocab_size,min_word_count,num_workers,approximate_counter_size)
 
     #logger.info("Saving imported libraries vocabulary pickle file at %s" % vocab_pickle_filename)
     pickle.dump(imported_libraries_vocabulary, open(vocab_pickle_filename, "wb"))
@@ -155,6 +142,14 @@ if __name__ == "__main__":
                     type=int,
                     default=2,
                     help="Minimum times a library is observed in corpus for the library to be included in vocabulary (default = 2)")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes used to parse the scripts (default = 1)")
+    parser.add_argument("--approximate_counter_size",
+                        type=int,
+                        default=0,
+                        help="Count with a bounded-memory approximate counter tracking at most this many libraries, for corpora whose exact counts do not fit in memory (default = 0, exact counting)")
 
     args=parser.parse_args()
-    main(args.script_folder,args.vocab_pickle_filename,args.max_script_count,args.max_vocab_size,args.min_word_count)
+    main(args.script_folder,args.vocab_pickle_filename,args.max_script_count,args.max_vocab_size,args.min_word_count,args.num_workers,args.approximate_counter_size)
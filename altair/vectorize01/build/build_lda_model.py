@@ -1,28 +1,95 @@
 import pickle
 import os
-import json
+from functools import partial
 from sklearn.decomposition import LatentDirichletAllocation
 from sklearn.feature_extraction.text import CountVectorizer,TfidfVectorizer
 
-from altair.util.separate_code_and_comments import separate_code_and_comments
-from altair.util.normalize_text import normalize_text
+from altair.util.corpus_reader import read_corpus, script_tokens
+from altair.util.preprocess_cache import CACHE_FOLDER_ENV
 from altair.util.log import getLogger
 
 logger = getLogger(__name__)
 
 def build_lda_model(code_scripts_list,topics,vocab,use_binary=False,n_jobs=1):
 
-    # Vectorize the python scripts with bag of words
+    # Vectorize the python scripts with bag of words, keeping the scripts x vocabulary matrix sparse
     bow_model = CountVectorizer(analyzer="word", vocabulary=vocab, binary=use_binary)
-    bow_vector_values = bow_model.transform(code_scripts_list).toarray()
+    bow_vector_values = bow_model.transform(code_scripts_list)
 
     # Train/Fit LDA
-    lda_model = LatentDirichletAllocation(n_topics=topics,learning_method="online",random_state=0,n_jobs=1)
+    lda_model = LatentDirichletAllocation(n_topics=topics,learning_method="online",random_state=0,n_jobs=n_jobs)
     lda_model.fit(bow_vector_values)
 
     return lda_model
 
-def main(script_folder,topics,vocab_pickle_filename,model_pickle_filename,max_script_count,use_binary,n_jobs):
+def save_checkpoint(checkpoint_filename, lda_model, script_count, batch_count, position, complete=False):
+    # Write to a temporary file and rename so an interrupted save never replaces a good checkpoint
+    with open(checkpoint_filename + ".tmp", "wb") as f:
+        pickle.dump({"model": lda_model, "scripts": script_count, "batches": batch_count, "position": position, "complete": complete}, f)
+    os.replace(checkpoint_filename + ".tmp", checkpoint_filename)
+
+def build_lda_model_online(code_scripts_batches,topics,vocab,use_binary=False,n_jobs=1,total_samples=1e6,checkpoint_filename=None,
+                           checkpoint_every=10,perplexity_every=1,checkpoint=None):
+    '''
+    Trains LDA with online variational Bayes, one partial_fit call per mini-batch, so only one batch of scripts
+    is ever held in memory and the number of scripts is not limited by RAM
+    Args:
+        code_scripts_batches: iterable of (list of scripts, position) pairs, where scripts are normalized tokens
+                              joined by spaces and position is the read_corpus position after the batch
+        topics (int): number of topics
+        vocab (list): bag of words vocabulary
+        use_binary (bool): use binary bag of words counts
+        n_jobs (int): number of processes used by the E-step of every batch (-1 uses all CPUs)
+        total_samples (int): expected total number of scripts, which weights every batch in the online update
+        checkpoint_filename (str): file to save the model and progress to every checkpoint_every batches, marked
+                                   complete after the last batch
+        perplexity_every (int): log the perplexity of every n-th batch, measured before the batch updates the model
+                                so it estimates held-out perplexity (0 disables, perplexity costs an extra E-step)
+        checkpoint (dict): checkpoint to resume from, as written by save_checkpoint
+    Returns:
+        lda_model (LatentDirichletAllocation)
+    '''
+    bow_model = CountVectorizer(analyzer="word", vocabulary=vocab, binary=use_binary)
+    if checkpoint is None:
+        lda_model = LatentDirichletAllocation(n_topics=topics,learning_method="online",total_samples=total_samples,random_state=0,n_jobs=n_jobs)
+        script_count = 0
+        batch_count = 0
+        position = None
+    else:
+        lda_model, script_count, batch_count, position = checkpoint["model"], checkpoint["scripts"], checkpoint["batches"], checkpoint["position"]
+        lda_model.n_jobs = n_jobs
+
+    for code_scripts_list, position in code_scripts_batches:
+        bow_vector_values = bow_model.transform(code_scripts_list)
+        if perplexity_every > 0 and batch_count > 0 and batch_count % perplexity_every == 0:
+            logger.info("batch %d perplexity: %f" % (batch_count + 1, lda_model.perplexity(bow_vector_values)))
+
+        lda_model.partial_fit(bow_vector_values)
+        script_count += len(code_scripts_list)
+        batch_count += 1
+        logger.info("trained batch %d (%d scripts)" % (batch_count, script_count))
+
+        if checkpoint_filename and batch_count % checkpoint_every == 0:
+            save_checkpoint(checkpoint_filename, lda_model, script_count, batch_count, position)
+
+    if checkpoint_filename:
+        save_checkpoint(checkpoint_filename, lda_model, script_count, batch_count, position, complete=True)
+    return lda_model
+
+def batches(positioned_scripts, batch_size):
+    # Groups (position, script) pairs into (scripts, position after the last script) mini-batches
+    batch = []
+    position = None
+    for position, script in positioned_scripts:
+        batch.append(script)
+        if len(batch) >= batch_size:
+            yield batch, position
+            batch = []
+    if batch:
+        yield batch, position
+
+def main(script_folder,topics,vocab_pickle_filename,model_pickle_filename,max_script_count,use_binary,n_jobs,cache_folder=None,num_workers=1,
+         batch_size=4096,total_samples=None,checkpoint_filename=None,checkpoint_every=10,perplexity_every=1):
 
     # Retrieve existing vocabulary
     if vocab_pickle_filename is not None:
@@ -31,31 +98,47 @@ def main(script_folder,topics,vocab_pickle_filename,model_pickle_filename,max_sc
         logger.warning("Pickle file containing bag of words vocabulary required")
         quit()
 
-    code_scripts_list = list()
-    counter = 0
-
-    # Retrieve files containing Python scripts
-    # Altair's JSON format uses the 'content' label for the script code
-    for py_file in sorted(os.listdir(script_folder)):
-        if counter >= max_script_count: break
-        fullpath = os.path.join(script_folder, py_file)
-        with open(fullpath, "r") as py_file_contents:
-            for line in py_file_contents:
-                counter += 1
-                parsed_json = json.loads(line)
-                code, comments = separate_code_and_comments(parsed_json['content'],py_file)
-                if len(code) == 0:
-                    continue
-                else:
-                    normalized_code = normalize_text(code, remove_stop_words=True, only_letters=False, return_list=False, remove_one_char_words=True)
-                    code_scripts_list.append(normalized_code)
-
-    lda_model = build_lda_model(code_scripts_list,topics,vocab,use_binary,n_jobs)
+    # Retrieve Python scripts that contain code
+    if max_script_count is not None and max_script_count <= 0:
+        max_script_count = None
+    process = partial(script_tokens, cache_folder=cache_folder, min_code_len=1, remove_stop_words=True, only_letters=False, remove_one_char_words=True)
+
+    if batch_size > 0:
+        if total_samples is None:
+            total_samples = max_script_count if max_script_count is not None else 1e6
+        # Stream mini-batches; a checkpoint from an interrupted run is resumed at the corpus position after the
+        # scripts it already saw, so the reader skips them without parsing or preprocessing them again
+        checkpoint = None
+        start_position = None
+        if checkpoint_filename and os.path.exists(checkpoint_filename):
+            checkpoint = pickle.load(open(checkpoint_filename, "rb"))
+            if checkpoint.get("complete"):
+                # Resuming a finished run would skip every script and return its model unchanged
+                logger.warning("Checkpoint %s is from a finished run of %d scripts, ignoring it and training from scratch" % \
+                               (checkpoint_filename, checkpoint["scripts"]))
+                checkpoint = None
+            else:
+                logger.info("Resuming from checkpoint %s after %d scripts" % (checkpoint_filename, checkpoint["scripts"]))
+                start_position = checkpoint["position"]
+                if max_script_count is not None:
+                    max_script_count = max(max_script_count - checkpoint["scripts"], 0)
+        positioned_scripts = ((position, " ".join(normalized_code)) for position, normalized_code in \
+                              read_corpus(script_folder, process, max_script_count, num_workers, start_position=start_position, with_positions=True))
+        lda_model = build_lda_model_online(batches(positioned_scripts, batch_size),topics,vocab,use_binary,n_jobs,total_samples,
+                                           checkpoint_filename,checkpoint_every,perplexity_every,checkpoint)
+    else:
+        code_scripts = [" ".join(normalized_code) for normalized_code in read_corpus(script_folder, process, max_script_count, num_workers)]
+        lda_model = build_lda_model(code_scripts,topics,vocab,use_binary,n_jobs)
 
     #logger.info("Saving LDA model in a pickle file at %s" % model_pickle_filename)
     pickle.dump(lda_model, open(model_pickle_filename, "wb"))
     logger.info("LDA model pickle file saved at %s" % model_pickle_filename)
 
+    # The model is saved, so the checkpoint is no longer needed to resume and would only confuse the next run
+    if batch_size > 0 and checkpoint_filename and os.path.exists(checkpoint_filename):
+        os.remove(checkpoint_filename)
+        logger.info("Removed checkpoint %s of the finished run" % checkpoint_filename)
+
 # Run this when called from CLI
 if __name__ == "__main__":
     import argparse
@@ -83,7 +166,7 @@ if __name__ == "__main__":
     parser.add_argument("--max_script_count",
                         type=int,
                         default=10000,
-                        help="Specify maximum number of code scripts to process (default = 10000")
+                        help="Specify maximum number of code scripts to process, 0 reads the whole corpus (default = 10000")
     
     parser.add_argument("--use_binary",
                     action="store_true",
@@ -92,7 +175,35 @@ if __name__ == "__main__":
     parser.add_argument("--n_jobs",
                     type=int,
                     default=1,
-                    help="Flag for multiprocessing where -1 uses all CPUs and 1 uses 1 CPU (default=1)")
+                    help="Number of CPUs used by LDA training where -1 uses all CPUs and 1 uses 1 CPU (default=1)")
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared by the build scripts (default = $%s, disabled if unset)" % CACHE_FOLDER_ENV)
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes used to read and preprocess the corpus (default = 1)")
+
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=4096,
+                        help="Stream the corpus in mini-batches of this many scripts through partial_fit; 0 holds every script in memory and fits them at once (default = 4096)")
+    parser.add_argument("--total_samples",
+                        type=int,
+                        help="Expected number of scripts when streaming mini-batches (default = max_script_count, or 1000000 for the whole corpus)")
+    parser.add_argument("--checkpoint_filename",
+                        type=str,
+                        help="Pickle file the model is checkpointed to when streaming mini-batches; an existing checkpoint of an interrupted run is resumed, and the checkpoint is removed once the model is saved (default = no checkpoints)")
+    parser.add_argument("--checkpoint_every",
+                        type=int,
+                        default=10,
+                        help="Number of mini-batches between checkpoints (default = 10)")
+    parser.add_argument("--perplexity_every",
+                        type=int,
+                        default=1,
+                        help="Log the perplexity of every n-th mini-batch before training on it, 0 disables (default = 1)")
 
     args = parser.parse_args()
-    main(args.script_folder,args.topics,args.vocab_pickle_filename,args.model_pickle_filename,args.max_script_count,args.use_binary,args.n_jobs)
+    main(args.script_folder,args.topics,args.vocab_pickle_filename,args.model_pickle_filename,args.max_script_count,args.use_binary,args.n_jobs,args.cache_folder,args.num_workers,
+         args.batch_size,args.total_samples,args.checkpoint_filename,args.checkpoint_every,args.perplexity_every)
@@ -0,0 +1,144 @@
+import os
+import json
+import pickle
+from functools import partial
+
+import numpy
+from sklearn.feature_extraction.text import CountVectorizer
+
+from altair.util.corpus_reader import read_corpus, script_code
+from altair.util.preprocess_cache import CACHE_FOLDER_ENV
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def default_idf_filename(vocab_pickle_filename):
+    '''
+    IDF weights are saved next to the vocabulary pickle they belong to (ex: vocab.pkl -> vocab_idf.npy)
+    '''
+    return os.path.splitext(vocab_pickle_filename)[0] + "_idf.npy"
+
+def idf_settings_filename(idf_filename):
+    '''
+    The settings the IDF weights were fitted with are saved next to them (ex: vocab_idf.npy -> vocab_idf.json)
+    '''
+    return os.path.splitext(idf_filename)[0] + ".json"
+
+def load_idf_settings(idf_filename):
+    '''
+    Returns the settings saved by main, or the defaults of weights saved without settings
+    '''
+    try:
+        with open(idf_settings_filename(idf_filename), "r") as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return {"vectorizer_kwargs": {}, "smooth_idf": True}
+
+def parse_kwargs(kwargs_str):
+    # Same key1=val;key2=val2 format as the --vectorizer_kwargs of evaluation.py
+    kwargs = {}
+    for kv_pair in kwargs_str.split(";"):
+        k, v = kv_pair.split("=")
+        kwargs[k] = v
+    return kwargs
+
+def compute_idf(document_frequency, document_count, smooth_idf=True):
+    # Same formula as sklearn's TfidfTransformer.fit (smoothing adds one document containing every term)
+    document_frequency = numpy.asarray(document_frequency, dtype=numpy.float64) + int(smooth_idf)
+    document_count = document_count + int(smooth_idf)
+    return numpy.log(float(document_count) / document_frequency) + 1.0
+
+def build_tfidf_weights(script_folder, vocab, max_script_count=10000, smooth_idf=True, vectorizer_kwargs=None, cache_folder=None,
+                        num_workers=1, batch_size=10000):
+    '''
+    Fits the IDF weights of a bag of words vocabulary once over a corpus of scripts, with comments removed like the
+    scripts passed to TFIDFVectorizer
+    Args:
+        script_folder (str): Folder location of corpus containing script files
+        vocab (list): bag of words vocabulary
+        max_script_count (int): the maximum number of code scripts to process (None reads the whole corpus)
+        smooth_idf (bool): smooth the weights as TfidfTransformer(smooth_idf=True) does
+        vectorizer_kwargs (dict): CountVectorizer keyword arguments, which should match the ones given to TFIDFVectorizer
+        cache_folder (str): folder of the preprocessing cache (None disables caching)
+        num_workers (int): number of processes used to read and preprocess the corpus
+        batch_size (int): number of scripts counted per sparse transform
+    Returns:
+        idf (numpy array of float64 with one weight per vocabulary word)
+    '''
+    vectorizer_kwargs = dict(vectorizer_kwargs or {})
+    vectorizer_kwargs["vocabulary"] = vocab
+    bow_model = CountVectorizer(**vectorizer_kwargs)
+
+    document_frequency = numpy.zeros(len(vocab), dtype=numpy.int64)
+    document_count = 0
+    batch = []
+    process = partial(script_code, cache_folder=cache_folder, min_code_len=1)
+    for code in read_corpus(script_folder, process, max_script_count, num_workers):
+        batch.append(code)
+        if len(batch) >= batch_size:
+            document_frequency += numpy.bincount(bow_model.transform(batch).indices, minlength=len(vocab))
+            document_count += len(batch)
+            batch = []
+    if batch:
+        document_frequency += numpy.bincount(bow_model.transform(batch).indices, minlength=len(vocab))
+        document_count += len(batch)
+
+    logger.info("Fitted IDF weights over %d scripts" % document_count)
+    return compute_idf(document_frequency, document_count, smooth_idf)
+
+def main(script_folder, vocab_pickle_filename, idf_filename=None, max_script_count=10000, smooth_idf=True, cache_folder=None, num_workers=1,
+         vectorizer_kwargs=None):
+
+    vocab = pickle.load(open(vocab_pickle_filename, "rb"))
+    if max_script_count is not None and max_script_count <= 0:
+        max_script_count = None
+    if not vectorizer_kwargs:
+        vectorizer_kwargs = {}
+    idf = build_tfidf_weights(script_folder, vocab, max_script_count, smooth_idf, vectorizer_kwargs, cache_folder, num_workers)
+
+    if not idf_filename:
+        idf_filename = default_idf_filename(vocab_pickle_filename)
+    numpy.save(idf_filename, idf)
+    # TFIDFVectorizer only uses the weights with the same settings
+    with open(idf_settings_filename(idf_filename), "w") as f:
+        json.dump({"vectorizer_kwargs": vectorizer_kwargs, "smooth_idf": smooth_idf}, f)
+    logger.info("IDF weights saved at %s" % idf_filename)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Fit TF-IDF weights once over a folder of Python scripts for TFIDFVectorizer.')
+
+    # Required args
+    parser.add_argument("script_folder",
+                        type=str,
+                        help="Folder location of Python scripts")
+    parser.add_argument("vocab_pickle_filename",
+                        type=str,
+                        help="Input file location for pickle file containing previously built vocabulary list")
+
+    # Optional args
+    parser.add_argument("--idf_filename",
+                        type=str,
+                        help="Output file name for the IDF weights (default = [vocab_pickle_filename without extension]_idf.npy)")
+    parser.add_argument("--max_script_count",
+                        type=int,
+                        default=10000,
+                        help="Specify maximum number of code scripts to process, 0 reads the whole corpus (default = 10000)")
+    parser.add_argument("--no_smooth_idf",
+                        action="store_true",
+                        help="Do not smooth the IDF weights, as TfidfTransformer(smooth_idf=False) (default = false)")
+    parser.add_argument("--cache_folder",
+                        type=str,
+                        default=os.environ.get(CACHE_FOLDER_ENV),
+                        help="Folder for the preprocessing cache shared by the build scripts (default = $%s, disabled if unset)" % CACHE_FOLDER_ENV)
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes used to read and preprocess the corpus (default = 1)")
+    parser.add_argument("--vectorizer_kwargs",
+                        type=parse_kwargs,
+                        help="Keyword arguments (see CountVectorizer docs for full list), the same as given to the tfidf vectorizer of evaluation.py. Format: key1=val;key2=val2.")
+
+    args = parser.parse_args()
+    main(args.script_folder, args.vocab_pickle_filename, args.idf_filename, args.max_script_count, not args.no_smooth_idf, args.cache_folder, args.num_workers,
+         args.vectorizer_kwargs)
@@ -0,0 +1,99 @@
+import pickle
+import time
+import numpy
+
+from altair.vectorize01.indexes.ExactVectorIndex import ExactVectorIndex
+from altair.vectorize01.indexes.IVFVectorIndex import IVFVectorIndex
+from altair.vectorize01.indexes.VectorStore import VectorStore
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def measure_recall(index, exact_index, vectors, k=5, num_queries=100, seed=0):
+    '''
+    Estimates recall@k of an approximate index by querying it with stored vectors and comparing to exact results
+    Args:
+        index (VectorIndex): index under test
+        exact_index (ExactVectorIndex): reference index over the same vectors
+        vectors (ndarray): stored vectors to draw queries from
+        k (int): number of neighbours compared per query
+        num_queries (int): number of sampled queries
+    Returns:
+        recall (float): average fraction of the exact top k returned by the index
+        mean_latency (float): average seconds per query on the index under test
+    '''
+    rng = numpy.random.RandomState(seed)
+    query_ids = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    found = 0
+    elapsed = 0.0
+    for query_id in query_ids:
+        expected = set(url for url, _ in exact_index.query(vectors[query_id], k))
+        start_time = time.time()
+        returned = set(url for url, _ in index.query(vectors[query_id], k))
+        elapsed += time.time() - start_time
+        found += len(expected & returned)
+    return found / float(k * len(query_ids)), elapsed / len(query_ids)
+
+def main(vector_store_filename, index_pickle_filename, index_type, n_lists, n_probe, train_size, iterations, recall_queries):
+
+    # The index pickle holds no vectors: the demo attaches it to this store
+    store = VectorStore(vector_store_filename[:-len(".npy")])
+    urls, vectors = store.urls, store.vectors
+    logger.info("Loaded %d vectors from %s" % (len(urls), vector_store_filename))
+
+    if index_type == "ivf":
+        index = IVFVectorIndex(n_lists=n_lists, n_probe=n_probe, train_size=train_size, iterations=iterations)
+    else:
+        index = ExactVectorIndex()
+    index.build(urls, vectors)
+
+    if index_type == "ivf" and recall_queries > 0:
+        recall, latency = measure_recall(index, ExactVectorIndex().build(urls, vectors), vectors, num_queries=recall_queries)
+        logger.info("Recall@5 with n_probe=%d of %d lists: %.3f (%.2f ms per query)" % (n_probe, index.n_lists, recall, latency * 1000))
+
+    pickle.dump(index, open(index_pickle_filename, "wb"))
+    logger.info("%s index pickle file saved at %s" % (index_type, index_pickle_filename))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a nearest-neighbour index over a dictionary of URLs and vectors for the Altair demo')
+
+    # Required args
+    parser.add_argument("vector_store_filename",
+                        type=str,
+                        help="Vector store (.npy) built by build_vector_store.py; the demo reads the vectors of the index from it")
+    parser.add_argument("index_pickle_filename",
+                        type=str,
+                        help="Output file name for pickle file containing the vector index")
+
+    # Optional args
+    parser.add_argument("--index_type",
+                        type=str,
+                        choices=["exact", "ivf"],
+                        default="ivf",
+                        help="Exact brute-force index or approximate inverted file index (default = ivf)")
+    parser.add_argument("--n_lists",
+                        type=int,
+                        default=1024,
+                        help="Number of k-means lists in the ivf index (default = 1024)")
+    parser.add_argument("--n_probe",
+                        type=int,
+                        default=16,
+                        help="Number of lists scanned per query; higher values raise recall and latency (default = 16)")
+    parser.add_argument("--train_size",
+                        type=int,
+                        default=100000,
+                        help="Number of sampled vectors used to train the k-means quantizer (default = 100000)")
+    parser.add_argument("--iterations",
+                        type=int,
+                        default=20,
+                        help="Number of k-means iterations (default = 20)")
+    parser.add_argument("--recall_queries",
+                        type=int,
+                        default=100,
+                        help="Number of sampled queries used to report recall against an exact index (default = 100)")
+
+    args = parser.parse_args()
+    if not args.vector_store_filename.endswith(".npy"):
+        parser.error("vector_store_filename must be a vector store (.npy); convert a vector pickle with build_vector_store.py")
+    main(args.vector_store_filename, args.index_pickle_filename, args.index_type, args.n_lists, args.n_probe, args.train_size, args.iterations, args.recall_queries)
@@ -0,0 +1,35 @@
+import pickle
+import numpy
+
+from altair.vectorize01.indexes.VectorStore import VectorStore
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+def main(vector_pickle_filename, store_prefix, half_precision):
+
+    vectors_by_url = pickle.load(open(vector_pickle_filename, "rb"))
+    logger.info("Loaded %d vectors from %s" % (len(vectors_by_url), vector_pickle_filename))
+
+    count = VectorStore.write(store_prefix, vectors_by_url, numpy.float16 if half_precision else numpy.float32)
+    logger.info("Vector store of %d vectors saved at %s.npy and %s.urls" % (count, store_prefix, store_prefix))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a pickled dictionary of URLs and vectors to a memory-mappable vector store')
+
+    # Required args
+    parser.add_argument("vector_pickle_filename",
+                        type=str,
+                        help="Pickle file containing dictionary of URLs for Python scripts and associated Doc2Vec vectors")
+    parser.add_argument("store_prefix",
+                        type=str,
+                        help="Output path without extension; writes [store_prefix].npy and [store_prefix].urls")
+
+    # Optional args
+    parser.add_argument("--half_precision",
+                        action="store_true",
+                        help="Store vectors as float16 instead of float32 (default = false)")
+
+    args = parser.parse_args()
+    main(args.vector_pickle_filename, args.store_prefix, args.half_precision)
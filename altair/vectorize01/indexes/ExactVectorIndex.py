@@ -0,0 +1,31 @@
+import numpy
+from altair.util.top_n_similarity import top_k_indices
+from altair.vectorize01.indexes.VectorIndex import VectorIndex
+
+class ExactVectorIndex(VectorIndex):
+    '''
+    Brute-force cosine similarity against every stored vector
+    The URL list and normalized matrix are built once instead of on every query
+    '''
+    def __init__(self, block_size=65536):
+        self.urls = []
+        self.vectors = numpy.zeros((0, 0), dtype=numpy.float32)
+        self.block_size = block_size
+
+    def build(self, urls, vectors):
+        self.urls = list(urls)
+        self.vectors = self.normalize(vectors)
+        return self
+
+    @classmethod
+    def from_store(cls, store):
+        # Keeps the memory-mapped matrix instead of copying it
+        return cls().attach(store)
+
+    def query(self, vector, k=5):
+        vector = self.normalize(vector)
+        # Blocked so float16 stores are upcast a block at a time rather than as one full-size copy
+        sims = numpy.concatenate([self.vectors[start:start + self.block_size].astype(numpy.float32, copy=False).dot(vector)
+                                  for start in range(0, len(self.vectors), self.block_size)])
+        indices = top_k_indices(sims.reshape(1, -1), k)[0]
+        return [(self.urls[index], float(sims[index])) for index in indices]
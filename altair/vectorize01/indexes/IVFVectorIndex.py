@@ -0,0 +1,81 @@
+import numpy
+from altair.util.top_n_similarity import top_k_indices
+from altair.vectorize01.indexes.VectorIndex import VectorIndex
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+class IVFVectorIndex(VectorIndex):
+    '''
+    Approximate index with an inverted file (IVF): a spherical k-means coarse quantizer assigns every vector to
+    one of n_lists lists, and a query only scans the n_probe lists whose centroids are closest to it
+    Recall is tuned with n_probe (more lists scanned = higher recall, slower queries); n_probe = n_lists is exact
+    Only the centroids and the inverted lists of row ids are pickled; the vectors are read from the VectorStore
+    the index is attached to, gathering just the rows of the probed lists
+    '''
+    def __init__(self, n_lists=1024, n_probe=16, train_size=100000, iterations=20, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.urls = []
+
+    def build(self, urls, vectors):
+        vectors = self.normalize(vectors)
+        rng = numpy.random.RandomState(self.seed)
+        # Train the coarse quantizer on a sample, then assign every vector to its closest centroid
+        if len(vectors) > self.train_size:
+            sample = vectors[rng.choice(len(vectors), self.train_size, replace=False)]
+        else:
+            sample = vectors
+        # k-means picks its initial centroids from the sample, so there can be no more lists than sampled vectors
+        if self.n_lists > len(sample):
+            logger.warning("Reducing n_lists from %d to the %d sampled training vectors" % (self.n_lists, len(sample)))
+        self.n_lists = max(1, min(self.n_lists, len(sample)))
+        self.centroids = self._kmeans(sample, rng)
+        assignments = self._assign(vectors)
+
+        # Store the row ids of each inverted list contiguously: list i holds ids[list_offsets[i]:list_offsets[i+1]]
+        self.ids = numpy.argsort(assignments, kind="mergesort")
+        self.vectors = vectors
+        self.urls = list(urls)
+        self.list_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(assignments, minlength=self.n_lists))))
+        return self
+
+    def query(self, vector, k=5, n_probe=None):
+        if n_probe is None:
+            n_probe = self.n_probe
+        vector = self.normalize(vector)
+        probed = top_k_indices(self.centroids.dot(vector).reshape(1, -1), n_probe)[0]
+
+        # Rows gathered in id order, which reads the mapped matrix sequentially and breaks ties like ExactVectorIndex
+        ids = numpy.sort(numpy.concatenate([self.ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probed]))
+        sims = self.vectors[ids].astype(numpy.float32, copy=False).dot(vector)
+        best = top_k_indices(sims.reshape(1, -1), k)[0]
+        return [(self.urls[ids[i]], float(sims[i])) for i in best]
+
+    def attach(self, store):
+        if len(store) != len(self.ids):
+            raise ValueError("Index was built over %d vectors but the store has %d" % (len(self.ids), len(store)))
+        return VectorIndex.attach(self, store)
+
+    def _assign(self, vectors, block_size=65536):
+        # Blocked so the vectors x centroids similarity matrix never has to exist in full
+        assignments = numpy.empty(len(vectors), dtype=numpy.intp)
+        for start in range(0, len(vectors), block_size):
+            assignments[start:start + block_size] = vectors[start:start + block_size].dot(self.centroids.T).argmax(axis=1)
+        return assignments
+
+    def _kmeans(self, sample, rng):
+        self.centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)]
+        for iteration in range(self.iterations):
+            assignments = self._assign(sample)
+            centroids = numpy.zeros_like(self.centroids)
+            numpy.add.at(centroids, assignments, sample)
+            # Re-seed empty lists with random sample vectors
+            empty = numpy.flatnonzero(numpy.bincount(assignments, minlength=self.n_lists) == 0)
+            centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+            self.centroids = self.normalize(centroids)
+            logger.info("k-means iteration %d: %d empty lists" % (iteration + 1, len(empty)))
+        return self.centroids
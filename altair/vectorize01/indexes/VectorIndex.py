@@ -0,0 +1,43 @@
+from abc import ABCMeta, abstractmethod
+
+import numpy
+
+class VectorIndex:
+    '''
+    Nearest-neighbour index over a collection of document vectors keyed by URL (or script name)
+    Indexes are built offline, pickled and loaded once at startup; similarity is cosine similarity
+    Pickles leave out the vectors and URLs: a loaded index is attached to the VectorStore it was built from, so
+    server processes share the memory-mapped matrix instead of each unpickling a private copy
+    '''
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def build(self, urls, vectors):
+        raise NotImplementedError("Child class must implement build().")
+
+    @abstractmethod
+    def query(self, vector, k=5):
+        raise NotImplementedError("Child class must implement query().")
+
+    def attach(self, store):
+        # Reads vectors and URLs from a memory-mapped VectorStore, whose rows are already normalized
+        self.urls = store.urls
+        self.vectors = store.vectors
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("urls", None)
+        state.pop("vectors", None)
+        return state
+
+    def __len__(self):
+        return len(self.urls)
+
+    @staticmethod
+    def normalize(vectors):
+        # Unit length rows so cosine similarity is a dot product; all-zero rows stay all zeros
+        vectors = numpy.asarray(vectors, dtype=numpy.float32)
+        norms = numpy.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
@@ -0,0 +1,50 @@
+import numpy
+from numpy.lib.format import open_memmap
+
+from altair.vectorize01.indexes.VectorIndex import VectorIndex
+
+class VectorStore:
+    '''
+    On-disk collection of document vectors that opens without unpickling
+    A store is two files sharing a prefix:
+        <prefix>.npy - contiguous float32 (or float16) matrix with L2-normalized rows
+        <prefix>.urls - UTF-8 text with one URL (or script id) per line, in row order
+    The matrix is opened with numpy.load(mmap_mode='r'), so startup is near instant and every process that
+    opens the same store shares its pages through the OS page cache
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.vectors = numpy.load(prefix + ".npy", mmap_mode="r")
+        with open(prefix + ".urls", "r", encoding="utf-8") as f:
+            self.urls = f.read().split("\n")[:-1]
+        if len(self.urls) != len(self.vectors):
+            raise ValueError("Vector store %s has %d vectors but %d urls" % (prefix, len(self.vectors), len(self.urls)))
+
+    def __len__(self):
+        return len(self.urls)
+
+    @staticmethod
+    def write(prefix, vectors_by_url, dtype=numpy.float32):
+        '''
+        Writes a dictionary of URL -> vector as a vector store, one row at a time
+        Args:
+            prefix (str): output path without extension
+            vectors_by_url (dict): URL -> 1d array, as pickled by vectorize_python_corpus.py
+            dtype: numpy.float32 or numpy.float16 (half the size, ~3 significant digits)
+        Returns:
+            count (int): number of vectors written
+        '''
+        urls = list(vectors_by_url.keys())
+        if not urls:
+            raise ValueError("No vectors to write")
+        dimension = len(vectors_by_url[urls[0]])
+        matrix = open_memmap(prefix + ".npy", mode="w+", dtype=dtype, shape=(len(urls), dimension))
+        with open(prefix + ".urls", "w", encoding="utf-8") as f:
+            for row, url in enumerate(urls):
+                if "\n" in url:
+                    raise ValueError("URL contains a newline: %r" % url)
+                matrix[row] = VectorIndex.normalize(vectors_by_url[url])
+                f.write(url + "\n")
+        matrix.flush()
+        del matrix
+        return len(urls)
@@ -2,11 +2,13 @@ import abc
 import pickle
 from sklearn.feature_extraction.text import CountVectorizer
 from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
+from altair.util.vector_cache import file_signature
 
 class BowAllVectorizer(Vectorizer):
     def __init__(self, pkl_vocab, vectorizer_kwargs=None):
         if not vectorizer_kwargs:
             vectorizer_kwargs = {}
+        self.cache_params = {"pkl_vocab": file_signature(pkl_vocab), "vectorizer_kwargs": dict(vectorizer_kwargs)}
 
         with open(pkl_vocab, "rb") as f:
             vocab = pickle.load(f)
@@ -1,8 +1,8 @@
 import pickle
-from redbaron import RedBaron
 from sklearn.feature_extraction.text import CountVectorizer
 from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
-from altair.vectorize01.build.build_imported_libraries_vocabulary import parse_fromimport_statements, parse_import_statements
+from altair.util.extract_imports import extract_imports
+from altair.util.vector_cache import file_signature
 
 from altair.util.log import getLogger
 
@@ -12,6 +12,7 @@ class BowImportVectorizer(Vectorizer):
     def __init__(self, pkl_libraries, vectorizer_kwargs=None):
         if not vectorizer_kwargs:
             vectorizer_kwargs = {}
+        self.cache_params = {"pkl_libraries": file_signature(pkl_libraries), "vectorizer_kwargs": dict(vectorizer_kwargs)}
 
         with open(pkl_libraries, "rb") as f:
             vocab = pickle.load(f)
@@ -19,14 +20,8 @@ class BowImportVectorizer(Vectorizer):
         self.vectorizer = CountVectorizer(**vectorizer_kwargs)
 
     def _extract_libraries(self, document):
-        try:
-            red = RedBaron(document)
-            libraries = parse_import_statements(red.find_all("ImportNode"))
-            libraries |= parse_fromimport_statements(red.find_all("FromImportNode"))
-        # TODO: Skip document and remove from raw list if red baron fails parsing 
-        except:
-            libraries = set()
-            logger.info("Red baron error;continuing")
+        # Scripts that do not parse are scanned token by token, so they keep the imports found before the error
+        libraries = extract_imports(document)
         return " ".join(libraries)
 
     def vectorize(self, document):
@@ -0,0 +1,85 @@
+import numpy
+import scipy.sparse
+from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
+from altair.util.vector_cache import VectorCache
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+class CachedVectorizer(Vectorizer):
+    '''
+    Wraps any Vectorizer with a VectorCache so documents seen before (repeated evaluation runs, repeated demo queries)
+    are not tokenized and vectorized again. Vectors are keyed by a hash of the document content, the vectorizer class
+    and its settings (see Vectorizer.cache_identity). Vectorizers with deterministic = False are never cached.
+    Cached vectors are shared between calls, so callers must not modify returned vectors in place.
+    '''
+    def __init__(self, vectorizer, cache=None, max_bytes=256 * 1024 * 1024, cache_folder=None):
+        self.vectorizer = vectorizer
+        self.cache = cache if cache is not None else VectorCache(max_bytes, cache_folder)
+        self.identity = vectorizer.cache_identity()
+        self.deterministic = vectorizer.deterministic
+        self.token_kwargs = vectorizer.token_kwargs
+        if not self.deterministic:
+            logger.warning("%s is not deterministic; vectors will not be cached" % vectorizer.__class__.__name__)
+
+    def cache_identity(self):
+        return self.identity
+
+    def stats(self):
+        return self.cache.stats()
+
+    def _key(self, document):
+        return VectorCache.key(self.identity, document)
+
+    def vectorize(self, document):
+        if not self.deterministic:
+            return self.vectorizer.vectorize(document)
+        key = self._key(document)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.vectorizer.vectorize(document)
+            self.cache.put(key, vector)
+        return vector
+
+    def vectorize_multi(self, documents):
+        '''
+        Vectorizes the documents missing from the cache with a single vectorize_multi call and caches them row by row
+        Output: vectorized (same type as the wrapped vectorizer's vectorize_multi, rows in input order)
+        '''
+        if not self.deterministic:
+            return self.vectorizer.vectorize_multi(documents)
+        return self._vectorize_cached(documents, [self._key(document) for document in documents], self.vectorizer.vectorize_multi)
+
+    def vectorize_tokens_multi(self, token_lists):
+        '''
+        Same as vectorize_multi for token lists, keyed by the tokens instead of the document content
+        '''
+        if not self.deterministic:
+            return self.vectorizer.vectorize_tokens_multi(token_lists)
+        keys = [VectorCache.key(self.identity, "tokens", "\n".join(tokens)) for tokens in token_lists]
+        return self._vectorize_cached(token_lists, keys, self.vectorizer.vectorize_tokens_multi)
+
+    def _vectorize_cached(self, documents, keys, vectorize_multi):
+        rows = [self.cache.get(key) for key in keys]
+        # Vectorize each distinct missing document once
+        missing = {}
+        for index, row in enumerate(rows):
+            if row is None and keys[index] not in missing:
+                missing[keys[index]] = index
+        if missing:
+            missing_indexes = sorted(missing.values())
+            vectorized = vectorize_multi([documents[index] for index in missing_indexes])
+            for offset, index in enumerate(missing_indexes):
+                row = vectorized[offset]
+                # A dense row is a view that would keep the whole batch alive while the cache only counts the row;
+                # sparse row slicing already copies
+                if isinstance(row, numpy.ndarray):
+                    row = row.copy()
+                self.cache.put(keys[index], row)
+                missing[keys[index]] = row
+            rows = [missing[key] if row is None else row for key, row in zip(keys, rows)]
+
+        if rows and scipy.sparse.issparse(rows[0]):
+            return scipy.sparse.vstack(rows, format="csr")
+        return numpy.vstack(rows) if rows else numpy.empty((0, 0))
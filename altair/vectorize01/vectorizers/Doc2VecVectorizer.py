@@ -1,9 +1,69 @@
+import os
+import uuid
 import pickle
+import numpy
+from multiprocessing import Pool, get_start_method
 from altair.util.normalize_text import normalize_text
+from altair.util.vector_cache import file_signature
 from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
+
+# gensim seeds the initial vector of infer_vector with Python's string hash, so inferred vectors are only
+# reproducible across processes when PYTHONHASHSEED is fixed; otherwise cached vectors are scoped to this process
+hash_seed = os.environ.get("PYTHONHASHSEED", "random")
+if hash_seed == "random":
+    hash_seed = "process-%s" % uuid.uuid4().hex
+
+# Per-process inference state; filled in by the parent before forking or by init_inference_worker after spawning
+worker_state = {}
+
+def document_tokens(document, normalizer_kwargs):
+    # Doc2Vec expects a list of words that includes stop words
+    return normalize_text(document, remove_stop_words=False, only_letters=False, return_list=True, **normalizer_kwargs)
+
+def infer_tokens(model, tokens, infer_kwargs, seed):
+    # Doc2Vec requires a defined seed for deterministic results when calling infer_vector
+    # Reseeding per document makes each vector independent of which worker or chunk it was inferred in
+    model.random.seed(seed)
+    return model.infer_vector(tokens, **infer_kwargs)
+
+def infer_document(model, document, normalizer_kwargs, infer_kwargs, seed):
+    return infer_tokens(model, document_tokens(document, normalizer_kwargs), infer_kwargs, seed)
+
+def init_inference_worker(pkl_d2v_model, normalizer_kwargs, infer_kwargs, seed):
+    # Forked workers inherit the parent's model read-only; spawned workers load it once here
+    if worker_state.get("pkl_d2v_model") != pkl_d2v_model:
+        with open(pkl_d2v_model, "rb") as f:
+            worker_state["model"] = pickle.load(f)
+        worker_state["pkl_d2v_model"] = pkl_d2v_model
+    worker_state["normalizer_kwargs"] = normalizer_kwargs
+    worker_state["infer_kwargs"] = infer_kwargs
+    worker_state["seed"] = seed
+
+def inference_workers(num_workers):
+    '''
+    Number of processes to infer with so the vectors match those of one process: workers share the parent's
+    string hash seed with the fork start method, otherwise only when PYTHONHASHSEED is set
+    '''
+    if num_workers > 1 and get_start_method() != "fork" and "PYTHONHASHSEED" not in os.environ:
+        # infer_vector seeds each document's initial vector with hash(), which model.random.seed does not control
+        logger.warning("Inferring serially: set PYTHONHASHSEED for %s workers to give the same vectors as one process" % get_start_method())
+        return 1
+    return num_workers
+
+def infer_chunk(chunk):
+    # Documents are normalized here unless the chunk holds token lists already
+    start, documents, tokenized = chunk
+    vectors = numpy.empty((len(documents), worker_state["model"].vector_size), dtype=numpy.float32)
+    for offset, document in enumerate(documents):
+        tokens = document if tokenized else document_tokens(document, worker_state["normalizer_kwargs"])
+        vectors[offset] = infer_tokens(worker_state["model"], tokens, worker_state["infer_kwargs"], worker_state["seed"])
+    return start, vectors
 
 class Doc2VecVectorizer(Vectorizer):
-    def __init__(self, pkl_d2v_model, normalizer_kwargs=None, infer_kwargs=None):
+    def __init__(self, pkl_d2v_model, normalizer_kwargs=None, infer_kwargs=None, num_workers=1, chunk_size=256, seed=0):
         if not normalizer_kwargs:
             normalizer_kwargs = {}
         if not infer_kwargs:
@@ -11,22 +71,53 @@ class Doc2VecVectorizer(Vectorizer):
 
         with open(pkl_d2v_model, "rb") as f:
             self.model = pickle.load(f)
+        self.pkl_d2v_model = pkl_d2v_model
         self.normalizer_kwargs = normalizer_kwargs
         self.infer_kwargs = infer_kwargs
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.cache_params = {"pkl_d2v_model": file_signature(pkl_d2v_model), "normalizer_kwargs": normalizer_kwargs,
+                             "infer_kwargs": infer_kwargs, "seed": seed, "hash_seed": hash_seed}
+        # Same normalization as document_tokens, so PreprocessCache.tokens(script, **token_kwargs) can be inferred directly
+        self.token_kwargs = dict(normalizer_kwargs, remove_stop_words=False, only_letters=False)
 
     def vectorize(self, document):
-        # Doc2Vec expects a list of words that includes stop words
-        normalized_doc = normalize_text(document, remove_stop_words=False, only_letters=False, return_list=True, **self.normalizer_kwargs)
-        # Doc2Vec requires a defined seed for deterministic results when calling infer_vector
-        self.model.random.seed(0)
-        return self.model.infer_vector(normalized_doc, **self.infer_kwargs)
+        return infer_document(self.model, document, self.normalizer_kwargs, self.infer_kwargs, self.seed)
 
     def vectorize_multi(self, documents):
-        vectorized = []
-        for document in documents:
-            # Doc2Vec expects a list of words that includes stop words
-            normalized_doc = normalize_text(document, remove_stop_words=False, only_letters=False, return_list=True, **self.normalizer_kwargs)
-            # Doc2Vec requires a defined seed for deterministic results when calling infer_vector
-            self.model.random.seed(0)
-            vectorized.append(self.model.infer_vector(normalized_doc, **self.infer_kwargs))
+        '''
+        Infers vectors for a list of documents, in parallel when num_workers > 1
+        Vectors only match the serial ones when the workers share the parent's string hash seed: always with the
+        fork start method, otherwise only when PYTHONHASHSEED is set; without it, documents are inferred serially
+        Output: vectorized (float32 ndarray of shape documents x vector_size, in input order)
+        '''
+        return self._infer_multi(documents, False)
+
+    def vectorize_tokens_multi(self, token_lists):
+        '''
+        Same as vectorize_multi for documents already normalized with token_kwargs (ex: by PreprocessCache.tokens)
+        '''
+        return self._infer_multi(token_lists, True)
+
+    def _infer_multi(self, documents, tokenized):
+        vectorized = numpy.empty((len(documents), self.model.vector_size), dtype=numpy.float32)
+        num_workers = inference_workers(self.num_workers)
+        if num_workers <= 1:
+            for index, document in enumerate(documents):
+                tokens = document if tokenized else document_tokens(document, self.normalizer_kwargs)
+                vectorized[index] = infer_tokens(self.model, tokens, self.infer_kwargs, self.seed)
+            return vectorized
+
+        # Share the already loaded model with forked workers instead of reloading it in each of them
+        worker_state["model"] = self.model
+        worker_state["pkl_d2v_model"] = self.pkl_d2v_model
+        chunks = [(start, documents[start:start + self.chunk_size], tokenized) for start in range(0, len(documents), self.chunk_size)]
+        pool = Pool(num_workers, init_inference_worker, (self.pkl_d2v_model, self.normalizer_kwargs, self.infer_kwargs, self.seed))
+        try:
+            for start, vectors in pool.imap_unordered(infer_chunk, chunks):
+                vectorized[start:start + len(vectors)] = vectors
+        finally:
+            pool.close()
+            pool.join()
         return vectorized
@@ -1,11 +1,14 @@
 import pickle
 from sklearn.feature_extraction.text import CountVectorizer
 from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
+from altair.util.vector_cache import file_signature
 
 class LDAVectorizer(Vectorizer):
     def __init__(self, pkl_lda_model, pkl_vocab, vectorizer_kwargs=None):
         if not vectorizer_kwargs:
             vectorizer_kwargs = {}
+        self.cache_params = {"pkl_lda_model": file_signature(pkl_lda_model), "pkl_vocab": file_signature(pkl_vocab),
+                             "vectorizer_kwargs": dict(vectorizer_kwargs)}
 
         with open(pkl_lda_model, "rb") as f:
             self.model = pickle.load(f)
@@ -1,13 +1,27 @@
+import os
 import pickle
+import numpy
+import scipy.sparse
+from sklearn.preprocessing import normalize
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 from altair.vectorize01.vectorizers.Vectorizer import Vectorizer
+from altair.vectorize01.build.build_tfidf_weights import default_idf_filename, load_idf_settings, idf_settings_filename
+from altair.util.vector_cache import file_signature
+
+from altair.util.log import getLogger
+
+logger = getLogger(__name__)
 
 class TFIDFVectorizer(Vectorizer):
-    def __init__(self, pkl_vocab, vectorizer_kwargs=None, transformer_kwargs=None):
+    def __init__(self, pkl_vocab, vectorizer_kwargs=None, transformer_kwargs=None, idf_filename=None):
         if not vectorizer_kwargs:
             vectorizer_kwargs = {}
         if not transformer_kwargs:
             transformer_kwargs = {}
+        if not idf_filename:
+            idf_filename = default_idf_filename(pkl_vocab)
+        self.cache_params = {"pkl_vocab": file_signature(pkl_vocab), "idf_filename": file_signature(idf_filename),
+                             "vectorizer_kwargs": dict(vectorizer_kwargs), "transformer_kwargs": dict(transformer_kwargs)}
 
         with open(pkl_vocab, "rb") as f:
             vocab = pickle.load(f)
@@ -15,10 +29,43 @@ class TFIDFVectorizer(Vectorizer):
         self.vectorizer = CountVectorizer(**vectorizer_kwargs)
         self.transformer = TfidfTransformer(**transformer_kwargs)
 
+        # IDF weights fitted once over the corpus by build_tfidf_weights, applied as a sparse diagonal multiply
+        self.idf_diag = None
+        if self.transformer.use_idf:
+            # The saved weights only apply to the features and smoothing they were fitted with
+            idf_settings = {"vectorizer_kwargs": self.cache_params["vectorizer_kwargs"], "smooth_idf": self.transformer.smooth_idf}
+            if not os.path.exists(idf_filename):
+                logger.warning("IDF weights not found at %s; fitting IDF on every call (build them with build_tfidf_weights)" % idf_filename)
+            elif load_idf_settings(idf_filename) != idf_settings:
+                logger.warning("IDF weights at %s were built with other settings (see %s); fitting IDF on every call" % \
+                               (idf_filename, idf_settings_filename(idf_filename)))
+            else:
+                idf = numpy.load(idf_filename)
+                self.idf_diag = scipy.sparse.diags(idf, 0, shape=(len(idf), len(idf)), format="csr")
+            if self.idf_diag is None:
+                # Vectors then depend on the other documents of each call, so they must not be cached
+                self.deterministic = False
+
+    def _tfidf(self, counts):
+        if self.transformer.use_idf and self.idf_diag is None:
+            # Previous behavior without saved weights: IDF fitted on the documents of this call only
+            return self.transformer.fit_transform(counts)
+
+        # Same steps as TfidfTransformer.transform with the saved IDF weights
+        tfidf = counts.astype(numpy.float64)
+        if self.transformer.sublinear_tf:
+            numpy.log(tfidf.data, tfidf.data)
+            tfidf.data += 1
+        if self.idf_diag is not None:
+            tfidf = tfidf * self.idf_diag
+        if self.transformer.norm:
+            tfidf = normalize(tfidf, norm=self.transformer.norm, copy=False)
+        return tfidf
+
     def vectorize(self, document):
         counts = self.vectorizer.transform([document])
-        return self.transformer.fit_transform(counts)
+        return self._tfidf(counts)
 
     def vectorize_multi(self, documents):
         counts = self.vectorizer.transform(documents)
-        return self.transformer.fit_transform(counts)
+        return self._tfidf(counts)
@@ -1,12 +1,34 @@
+import json
 from abc import ABCMeta, abstractmethod
 
 class Vectorizer:
     __metaclass__ = ABCMeta
 
+    # Vectorizers whose output for a document can change between calls (ex: depends on the other documents of a
+    # batch) set this to False so CachedVectorizer never caches their vectors
+    deterministic = True
+
+    # Constructor arguments (model/vocabulary file signatures and kwargs) that identify the vectors produced;
+    # set by child classes
+    cache_params = None
+
+    # normalize_text keyword arguments of the words a vectorizer reads from a document; set by child classes that
+    # accept documents already tokenized this way (ex: by PreprocessCache.tokens) in vectorize_tokens_multi
+    token_kwargs = None
+
     @abstractmethod
     def vectorize(self, document):
         raise NotImplementedError("Child class must implement vectorize().")
 
     @abstractmethod
     def vectorize_multi(self, documents):
-        raise NotImplementedError("Child class must implement vectorize_multi().")
\ No newline at end of file
+        raise NotImplementedError("Child class must implement vectorize_multi().")
+
+    def vectorize_tokens_multi(self, token_lists):
+        raise NotImplementedError("Child class must set token_kwargs and implement vectorize_tokens_multi().")
+
+    def cache_identity(self):
+        '''
+        String identifying the vectorizer class and its settings, part of the key of cached vectors
+        '''
+        return json.dumps([self.__class__.__name__, self.cache_params], sort_keys=True, default=repr)